@@ -0,0 +1,255 @@
+"""
+Minimal in-memory stand-in for the parts of pymongo used by rightmove.worker and the modules it writes through
+(incremental, sharding, retrieval_meta) or that read what it stored (store, export), so the storage stage can be
+exercised without a MongoDB server. Only the query and update operators these modules use are supported.
+"""
+import collections
+import copy
+import operator
+import threading
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReturnDocument
+
+_MISSING = object()
+_TYPES = {"object": dict, "array": list, "string": str}
+_COMPARISONS = {"$lt": operator.lt, "$lte": operator.le, "$gt": operator.gt, "$gte": operator.ge}
+
+
+class _Result(object):
+    def __init__(self, inserted_ids=None):
+        self.inserted_ids = inserted_ids or []
+
+
+def _get(doc, key):
+    val = doc
+    for part in key.split("."):
+        val = val.get(part, _MISSING) if isinstance(val, dict) else _MISSING
+    return val
+
+
+def _set(doc, key, value):
+    parts = key.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _matches_value(val, cond):
+    if not (isinstance(cond, dict) and len(cond) > 0 and all(k.startswith("$") for k in cond)):
+        return (None if val is _MISSING else val) == cond
+    for op, arg in cond.items():
+        present = val is not _MISSING
+        if op == "$exists":
+            ok = present == bool(arg)
+        elif op == "$type":
+            ok = isinstance(val, _TYPES[arg])
+        elif op == "$in":
+            ok = (val if present else None) in arg
+        elif op == "$ne":
+            ok = (val if present else None) != arg
+        elif op in _COMPARISONS:
+            ok = present and val is not None and _COMPARISONS[op](val, arg)
+        else:
+            raise NotImplementedError(f"Unsupported query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def _matches(doc, flt):
+    for k, v in flt.items():
+        if k == "$or":
+            if not any(_matches(doc, f) for f in v):
+                return False
+        elif not _matches_value(_get(doc, k), v):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.copy(doc)
+    out = {"_id": doc["_id"]} if projection.get("_id", 1) else {}
+    for k, v in projection.items():
+        if k != "_id" and v:
+            val = _get(doc, k)
+            if val is not _MISSING:
+                _set(out, k, val)
+    return out
+
+
+def _sort_key(sort):
+    def key(doc):
+        # None and missing values sort first, as in MongoDB
+        return [(val is not _MISSING and val is not None, val if val is not _MISSING and val is not None else 0)
+                for val in (_get(doc, k) for k, _ in sort)]
+    return key
+
+
+def _sorted(docs, sort):
+    docs = list(docs)
+    # one stable sort per key, least significant first
+    for k, direction in reversed(list(sort)):
+        docs.sort(key=_sort_key([(k, direction)]), reverse=direction < 0)
+    return docs
+
+
+class FakeCollection(object):
+    def __init__(self, name):
+        self.name = name
+        self.docs = collections.OrderedDict()
+        self.indexes = {}
+        self._lock = threading.Lock()
+        self.n_calls = collections.Counter()
+
+    def _insert(self, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        self.docs[doc["_id"]] = doc
+        return doc["_id"]
+
+    def insert_many(self, docs, ordered=True):
+        with self._lock:
+            self.n_calls["insert_many"] += 1
+            return _Result([self._insert(d) for d in docs])
+
+    def insert_one(self, doc):
+        with self._lock:
+            self.n_calls["insert_one"] += 1
+            return _Result([self._insert(doc)])
+
+    def _matches(self, doc, flt):
+        return _matches(doc, flt)
+
+    @staticmethod
+    def _apply(doc, update):
+        for k, v in update.get("$set", {}).items():
+            _set(doc, k, v)
+        for k, v in update.get("$inc", {}).items():
+            _set(doc, k, (_get(doc, k) if _get(doc, k) is not _MISSING else 0) + v)
+        for op, better in (("$min", lambda new, old: new < old), ("$max", lambda new, old: new > old)):
+            for k, v in update.get(op, {}).items():
+                old = _get(doc, k)
+                if old is _MISSING or old is None or better(v, old):
+                    _set(doc, k, v)
+
+    def _update(self, flt, update, upsert=False, many=False):
+        matched = [d for d in self.docs.values() if self._matches(d, flt)]
+        if len(matched) == 0 and upsert:
+            doc = {k: v for k, v in flt.items() if not k.startswith("$") and not isinstance(v, dict)}
+            doc.update(update.get("$setOnInsert", {}))
+            self._insert(doc)
+            self._apply(doc, {k: v for k, v in update.items() if k != "$setOnInsert"})
+            return [doc]
+        for d in (matched if many else matched[:1]):
+            self._apply(d, update)
+        return matched if many else matched[:1]
+
+    def bulk_write(self, ops, ordered=True):
+        with self._lock:
+            self.n_calls["bulk_write"] += 1
+            for op in ops:
+                doc = op._doc
+                if isinstance(op, InsertOne):
+                    self._insert(doc)
+                elif isinstance(op, UpdateOne):
+                    self._update(op._filter, doc, upsert=op._upsert)
+                elif isinstance(op, UpdateMany):
+                    self._update(op._filter, doc, upsert=op._upsert, many=True)
+                else:
+                    raise NotImplementedError(f"Unsupported operation {op!r}")
+
+    def update_one(self, flt, update, upsert=False):
+        with self._lock:
+            self.n_calls["update_one"] += 1
+            self._update(flt, update, upsert=upsert)
+
+    def find_one_and_update(self, flt, update, sort=None, upsert=False, return_document=ReturnDocument.BEFORE):
+        with self._lock:
+            self.n_calls["find_one_and_update"] += 1
+            matched = [d for d in self.docs.values() if self._matches(d, flt)]
+            if sort is not None:
+                matched = _sorted(matched, sort)
+            if len(matched) == 0 and not upsert:
+                return None
+            before = copy.deepcopy(matched[0]) if len(matched) > 0 else None
+            if len(matched) > 0:
+                self._apply(matched[0], update)
+                after = matched[0]
+            else:
+                after = self._update(flt, update, upsert=True)[0]
+            return copy.deepcopy(after if return_document == ReturnDocument.AFTER else before)
+
+    def find(self, flt=None, projection=None, batch_size=None):
+        with self._lock:
+            return [_project(d, projection) for d in self.docs.values() if self._matches(d, flt or {})]
+
+    def find_one(self, flt=None, projection=None):
+        found = self.find(flt, projection)
+        return found[0] if len(found) > 0 else None
+
+    def count_documents(self, flt):
+        return len(self.find(flt))
+
+    def distinct(self, key, flt=None):
+        out = []
+        for d in self.find(flt):
+            val = _get(d, key)
+            if val is not _MISSING and val not in out:
+                out.append(val)
+        return out
+
+    def create_index(self, keys, name=None, **kwargs):
+        name = name or "_".join(f"{k}_{v}" for k, v in keys)
+        self.indexes[name] = (list(keys), kwargs)
+        return name
+
+    def aggregate(self, pipeline, **kwargs):
+        """
+        Supports $match, $sort, $project (inclusion), $group by one field with `$first: "$$ROOT"`, and $replaceRoot.
+        """
+        docs = self.find()
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if _matches(d, arg)]
+            elif op == "$sort":
+                docs = _sorted(docs, arg.items())
+            elif op == "$project":
+                docs = [_project(d, arg) for d in docs]
+            elif op == "$group":
+                groups = collections.OrderedDict()
+                key = arg["_id"].lstrip("$")
+                for d in docs:
+                    k = _get(d, key)
+                    if k not in groups:
+                        groups[k] = {"_id": k, **{f: d for f, spec in arg.items() if spec == {"$first": "$$ROOT"}}}
+                docs = list(groups.values())
+            elif op == "$replaceRoot":
+                docs = [d[arg["newRoot"].lstrip("$")] for d in docs]
+            else:
+                raise NotImplementedError(f"Unsupported aggregation stage {op}")
+        return iter(docs)
+
+
+class FakeDatabase(object):
+    def __init__(self, name="test"):
+        self.name = name
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self.collections:
+                self.collections[name] = FakeCollection(name)
+            return self.collections[name]
+
+
+class FakeMongoClient(object):
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = FakeDatabase(name)
+        return self.databases[name]
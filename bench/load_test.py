@@ -0,0 +1,131 @@
+"""
+Full-crawl load test: runs worker.get_all_outcodes against the local mock server, with an in-memory MongoDB stand-in
+and a temporary access log, and reports throughput, request totals, retries (of outcodes and of HTTP requests) and time
+spent waiting in the limiter and the adaptive rate controller.
+
+Usage:
+    PYTHONPATH=. python -m bench.load_test --outcodes 100 --workers 8 --limit-per-second 20 --error-rate 0.02
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from core import register, requester
+from rightmove import consts, worker
+from bench.fakes import FakeMongoClient
+from bench.mock_server import MockRightmoveServer, add_server_arguments, server_kwargs
+
+
+def run_load_test(server, n_outcodes=50, property_type=consts.PROPERTY_TYPE_FORSALE, workers=4,
+                  limit_per_second=None, limit_per_hour=None, retries=3, sec_between_retry=1, adaptive=True,
+                  **crawl_kwargs):
+    """
+    Crawl the first `n_outcodes` outcodes from the mock server.
+    :param server: A started MockRightmoveServer.
+    :param adaptive: Pace requests with an AdaptiveRateController, capped at `limit_per_second`.
+    :param crawl_kwargs: Passed to worker.get_all_outcodes.
+    :return: Dictionary of results.
+    """
+    orig_find_urls = dict(consts.FIND_URLS)
+    orig_outcode_map = consts.OUTCODE_MAP
+    orig = {k: getattr(worker, k) for k in ("MONGO_CLI", "ACCESS_LOG", "PAGE_LOG")}
+    req = worker.get_requester()
+    orig_limiter = req.limiter
+    orig_controller = req.rate_controller
+    limiter = requester.Limiter(per_second=limit_per_second, per_hour=limit_per_hour, name="load_test")
+    controller = None
+    if adaptive:
+        # starting at the limit, as the crawler does by default
+        controller = requester.AdaptiveRateController(initial_rate=limit_per_second or 1., max_rate=limit_per_second,
+                                                      name="load_test")
+    stats_before = req.connection_stats()
+    retries_before = req.n_retries
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_fn = os.path.join(tmpdir, "access_log.db")
+        access_log = register.AccessLog(database=db_fn)
+        mongo = FakeMongoClient()
+        try:
+            consts.FIND_URLS.update(server.find_urls())
+            consts.OUTCODE_MAP = dict(list(orig_outcode_map.items())[:n_outcodes])
+            worker.MONGO_CLI = mongo
+            worker.ACCESS_LOG = access_log
+            worker.PAGE_LOG = register.PageCheckpointLog(batch_size=1, database=db_fn)
+            req.limiter = limiter
+            req.rate_controller = controller
+
+            t0 = time.perf_counter()
+            oids = worker.get_all_outcodes(property_type, retries=retries, sec_between_retry=sec_between_retry,
+                                           workers=workers, **crawl_kwargs)
+            elapsed = time.perf_counter() - t0
+        finally:
+            consts.FIND_URLS.clear()
+            consts.FIND_URLS.update(orig_find_urls)
+            consts.OUTCODE_MAP = orig_outcode_map
+            for k, v in orig.items():
+                setattr(worker, k, v)
+            req.limiter = orig_limiter
+            req.rate_controller = orig_controller
+
+        rows = access_log.connection.execute(
+            "SELECT COUNT(*), SUM(success), SUM(num_retries) FROM rightmove"
+        ).fetchone()
+        access_log.close()
+
+    stats_after = req.connection_stats()
+    n_listings = sum(len(v) for v in oids.values())
+    n_requests = server.counts["requests"]
+    return {
+        "outcodes": n_outcodes,
+        "workers": workers,
+        "elapsed_sec": elapsed,
+        "outcodes_succeeded": int(rows[1] or 0),
+        "outcodes_failed": int(rows[0] - (rows[1] or 0)),
+        "outcode_retries": int(rows[2] or 0),
+        "listings_stored": n_listings,
+        "requests": n_requests,
+        "requests_per_sec": n_requests / elapsed,
+        "listings_per_sec": n_listings / elapsed,
+        "status_counts": {str(k): v for k, v in sorted(server.status_counts.items())},
+        "bytes_received": server.bytes_sent,
+        "http_retries": req.n_retries - retries_before,
+        "limiter_calls": limiter.total_calls,
+        "limiter_wait_sec": limiter.total_wait,
+        "controller_wait_sec": controller.total_wait if controller is not None else None,
+        "connections_opened": stats_after["connections"] - stats_before["connections"],
+        "final_rate": controller.rate if controller is not None else None,
+        "throttled": controller.n_throttled if controller is not None else None,
+    }
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Load test a full crawl against the local mock server.")
+    argparser.add_argument("--outcodes", type=int, default=50, help="Number of outcodes to crawl.")
+    argparser.add_argument("--property-type", type=int, default=consts.PROPERTY_TYPE_FORSALE,
+                           choices=sorted(consts.FIND_URLS))
+    argparser.add_argument("--workers", type=int, default=4)
+    argparser.add_argument("--limit-per-second", type=int)
+    argparser.add_argument("--limit-per-hour", type=int)
+    argparser.add_argument("--retries", type=int, default=3)
+    argparser.add_argument("--sec-between-retry", type=float, default=1)
+    argparser.add_argument("--adaptive", action=argparse.BooleanOptionalAction, default=True,
+                           help="Pace requests with the adaptive rate controller.")
+    argparser.add_argument("--json", help="Also write the results to this file.")
+    add_server_arguments(argparser)
+    args = argparser.parse_args(argv)
+
+    with MockRightmoveServer(**server_kwargs(args)) as server:
+        res = run_load_test(server, n_outcodes=args.outcodes, property_type=args.property_type,
+                            workers=args.workers, limit_per_second=args.limit_per_second,
+                            limit_per_hour=args.limit_per_hour, retries=args.retries,
+                            sec_between_retry=args.sec_between_retry, adaptive=args.adaptive)
+    for k, v in res.items():
+        print(f"{k:<22}{v:.2f}" if isinstance(v, float) else f"{k:<22}{v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
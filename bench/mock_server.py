@@ -0,0 +1,260 @@
+"""
+Local stand-in for the Rightmove search endpoints in consts.FIND_URLS. Serves synthetic paginated `window.jsonModel`
+pages for any outcode, with configurable latency (overall, or for given pagination indexes), result counts, error
+injection (random, or for given pagination indexes) and slow-drip responses.
+
+Usage:
+    PYTHONPATH=. python -m bench.mock_server --port 8080 --latency 0.1 --error-rate 0.02
+"""
+import argparse
+import collections
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from rightmove import consts
+from bench import pages as pages_
+
+PATHS = {urlsplit(url).path: property_type for property_type, url in consts.FIND_URLS.items()}
+
+
+class MockRightmoveServer(object):
+    def __init__(self,
+                 host="127.0.0.1",
+                 port=0,
+                 latency=0.05,
+                 latency_jitter=0.02,
+                 min_results=0,
+                 max_results=500,
+                 error_rate=0.,
+                 error_codes=(429, 500, 503),
+                 retry_after=1,
+                 slow_drip_rate=0.,
+                 drip_chunk=8192,
+                 drip_delay=0.05,
+                 capacity=None,
+                 fail_indexes=None,
+                 index_latency=None,
+                 seed=0):
+        """
+        :param latency: Mean delay in seconds before each response.
+        :param latency_jitter: Maximum random deviation from the mean latency.
+        :param min_results, max_results: Range of the (deterministic) number of results for each outcode.
+        :param error_rate: Fraction of requests answered with one of `error_codes`.
+        :param retry_after: Value of the Retry-After header sent with 429 and 503 responses.
+        :param slow_drip_rate: Fraction of responses sent slowly, in chunks of `drip_chunk` bytes every `drip_delay`
+        seconds.
+        :param capacity: If given, requests in excess of this many per second are answered with 429, as a rate
+        limiting server would.
+        :param fail_indexes: Optional dictionary mapping a pagination index to the number of requests for that page
+        of each outcode that are answered with a 500 before it succeeds. None means the page always fails.
+        :param index_latency: Optional dictionary mapping a pagination index to an extra delay in seconds before
+        responding, so that pages of an outcode can be made to finish out of order.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.min_results = min_results
+        self.max_results = max_results
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after = retry_after
+        self.slow_drip_rate = slow_drip_rate
+        self.drip_chunk = drip_chunk
+        self.drip_delay = drip_delay
+        self.capacity = capacity
+        self.fail_indexes = dict(fail_indexes or {})
+        self.index_latency = dict(index_latency or {})
+        self._recent = collections.deque()
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.status_counts = collections.Counter()
+        # requests by (outcode, pagination index)
+        self.page_counts = collections.Counter()
+        self.bytes_sent = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.counts["connections"] += 1
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def find_urls(self):
+        """
+        :return: Dictionary equivalent to consts.FIND_URLS, pointing at this server.
+        """
+        return {property_type: self.base_url + urlsplit(url).path for property_type, url in consts.FIND_URLS.items()}
+
+    def n_results(self, outcode, property_type):
+        return random.Random(hash((self.seed, outcode, property_type))).randint(self.min_results, self.max_results)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MockRightmoveServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _over_capacity(self):
+        if self.capacity is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1.:
+                self._recent.popleft()
+            if len(self._recent) >= self.capacity:
+                return True
+            self._recent.append(now)
+            return False
+
+    def _draw(self):
+        with self._lock:
+            return self._rng.random(), self._rng.random(), self._rng.uniform(-1, 1)
+
+    def _send(self, handler, status, body, headers=None, drip=False):
+        handler.send_response(status)
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        if drip:
+            for i in range(0, len(body), self.drip_chunk):
+                handler.wfile.write(body[i:i + self.drip_chunk])
+                handler.wfile.flush()
+                time.sleep(self.drip_delay)
+        else:
+            handler.wfile.write(body)
+        with self._lock:
+            self.status_counts[status] += 1
+            self.bytes_sent += len(body)
+
+    def _handle(self, handler):
+        with self._lock:
+            self.counts["requests"] += 1
+        u_error, u_drip, jitter = self._draw()
+        delay = max(self.latency + jitter * self.latency_jitter, 0.)
+        if delay > 0:
+            time.sleep(delay)
+
+        url = urlsplit(handler.path)
+        if url.path not in PATHS:
+            self._send(handler, 404, b"Not found")
+            return
+        property_type = PATHS[url.path]
+        params = parse_qs(url.query)
+        try:
+            outcode = int(params["locationIdentifier"][0].split("^")[1])
+            per_page = int(params.get("numberOfPropertiesPerPage", ["48"])[0])
+            index = int(params.get("index", ["0"])[0])
+        except (KeyError, IndexError, ValueError):
+            self._send(handler, 400, b"Bad request")
+            return
+
+        with self._lock:
+            self.page_counts[(outcode, index)] += 1
+            n_page_requests = self.page_counts[(outcode, index)]
+        if self.index_latency.get(index, 0.) > 0:
+            time.sleep(self.index_latency[index])
+
+        if self._over_capacity():
+            self._send(handler, 429, b"Too many requests", headers={"Retry-After": str(self.retry_after)})
+            return
+
+        if index in self.fail_indexes:
+            n_fail = self.fail_indexes[index]
+            if n_fail is None or n_page_requests <= n_fail:
+                self._send(handler, 500, b"Injected error")
+                return
+
+        if u_error < self.error_rate and len(self.error_codes) > 0:
+            code = self.error_codes[int(u_error / self.error_rate * len(self.error_codes)) % len(self.error_codes)]
+            headers = {}
+            if code in (429, 503):
+                headers["Retry-After"] = str(self.retry_after)
+            self._send(handler, code, b"Injected error", headers=headers)
+            return
+
+        body = pages_.synthetic_page(outcode, index=index, per_page=per_page,
+                                     n_results=self.n_results(outcode, property_type), property_type=property_type)
+        self._send(handler, 200, body, drip=u_drip < self.slow_drip_rate)
+
+
+def add_server_arguments(argparser):
+    argparser.add_argument("--latency", type=float, default=0.05)
+    argparser.add_argument("--latency-jitter", type=float, default=0.02)
+    argparser.add_argument("--min-results", type=int, default=0)
+    argparser.add_argument("--max-results", type=int, default=500)
+    argparser.add_argument("--error-rate", type=float, default=0.)
+    argparser.add_argument("--error-codes", type=int, nargs="+", default=[429, 500, 503])
+    argparser.add_argument("--retry-after", type=int, default=1)
+    argparser.add_argument("--slow-drip-rate", type=float, default=0.)
+    argparser.add_argument("--capacity", type=int, help="Answer requests above this many per second with 429.")
+    argparser.add_argument("--seed", type=int, default=0)
+
+
+def server_kwargs(args):
+    return dict(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        min_results=args.min_results,
+        max_results=args.max_results,
+        error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        retry_after=args.retry_after,
+        slow_drip_rate=args.slow_drip_rate,
+        capacity=args.capacity,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Serve synthetic Rightmove search pages locally.")
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=8080)
+    add_server_arguments(argparser)
+    args = argparser.parse_args(argv)
+    server = MockRightmoveServer(host=args.host, port=args.port, **server_kwargs(args))
+    for property_type, url in server.find_urls().items():
+        print(f"{consts.PROPERTY_TYPE_MAP[property_type]}: {url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Search result pages for benchmarking: recorded fixtures, or synthetic pages with the same structure as the real site.
+"""
+import glob
+import gzip
+import json
+import os
+import random
+from rightmove import consts
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+DESCRIPTIONS = (
+    "{n} bedroom semi-detached house for sale",
+    "{n} bedroom detached house for sale",
+    "{n} bedroom terraced house for sale",
+    "{n} bedroom end of terrace house for sale",
+    "{n} bedroom flat for sale",
+    "{n} bedroom apartment for sale",
+    "{n} bedroom detached bungalow for sale",
+    "{n} bedroom maisonette for sale",
+    "{n} bedroom cottage for sale",
+    "{n} bedroom town house for sale",
+    "{n} bedroom ground floor flat for sale",
+    "{n} bedroom retirement property for sale",
+    "Studio flat for sale",
+    "Land for sale",
+    "{n} bedroom link detached house for sale",
+    "{n} bedroom barn conversion for sale",
+)
+
+SUMMARIES = (
+    "A well presented family home close to local amenities and schools, offered with no onward chain.",
+    "Bright and spacious apartment with allocated parking, bills included for the first month.",
+    "Newly refurbished throughout with a modern kitchen, garden and off-street parking.",
+    "Ideal first-time buyer or investment opportunity within walking distance of the station.",
+)
+
+
+def fixture_paths(fixture_dir=FIXTURE_DIR):
+    return sorted(glob.glob(os.path.join(fixture_dir, "*.html")) + glob.glob(os.path.join(fixture_dir, "*.html.gz")))
+
+
+def load_fixtures(fixture_dir=FIXTURE_DIR):
+    """
+    :return: List of raw page bodies (bytes) recorded in the fixture directory.
+    """
+    out = []
+    for fn in fixture_paths(fixture_dir):
+        opener = gzip.open if fn.endswith(".gz") else open
+        with opener(fn, "rb") as f:
+            out.append(f.read())
+    return out
+
+
+def save_fixture(content, name, fixture_dir=FIXTURE_DIR):
+    os.makedirs(fixture_dir, exist_ok=True)
+    fn = os.path.join(fixture_dir, name + ".html.gz")
+    with gzip.open(fn, "wb") as f:
+        f.write(content)
+    return fn
+
+
+def synthetic_listing(rng, property_id, property_type=consts.PROPERTY_TYPE_FORSALE):
+    n_bed = rng.randint(1, 5)
+    desc = rng.choice(DESCRIPTIONS).format(n=n_bed)
+    if property_type == consts.PROPERTY_TYPE_TORENT:
+        desc = desc.replace("for sale", "to rent")
+        amount = rng.randrange(500, 3500, 25)
+        frequency = "monthly"
+    else:
+        amount = rng.randrange(80000, 1500000, 5000)
+        frequency = "not specified"
+    lat = 51.5 + rng.uniform(-2, 2)
+    lng = -0.1 + rng.uniform(-2, 2)
+    return {
+        "id": property_id,
+        "bedrooms": n_bed,
+        "bathrooms": rng.randint(1, 3),
+        "numberOfImages": rng.randint(5, 40),
+        "numberOfFloorplans": rng.randint(0, 2),
+        "numberOfVirtualTours": rng.randint(0, 1),
+        "summary": rng.choice(SUMMARIES),
+        "displayAddress": f"{rng.randint(1, 200)} Example Road, Exampletown, EX{rng.randint(1, 99)}",
+        "countryCode": "GB",
+        "location": {"latitude": round(lat, 6), "longitude": round(lng, 6)},
+        "propertySubType": rng.choice(["Semi-Detached", "Detached", "Flat", "Terraced", "House Share"]),
+        "listingUpdate": {
+            "listingUpdateReason": rng.choice(["new", "price_reduced"]),
+            "listingUpdateDate": "2026-10-0%dT09:00:00Z" % rng.randint(1, 9),
+        },
+        "premiumListing": False,
+        "featuredProperty": rng.random() < 0.05,
+        "price": {
+            "amount": amount,
+            "frequency": frequency,
+            "currencyCode": "GBP",
+            "displayPrices": [{"displayPrice": f"£{amount:,}", "displayPriceQualifier": ""}],
+        },
+        "customer": {
+            "branchId": rng.randint(1000, 99999),
+            "brandPlusLogoURI": "/company/clogo_0000_0001.png",
+            "contactTelephone": "01234 567890",
+            "branchDisplayName": "Example Estates, Exampletown",
+            "branchName": "Exampletown",
+            "brandTradingName": "Example Estates",
+            "branchLandingPageUrl": "/estate-agents/agent/Example-Estates/Exampletown-1234.html",
+            "development": False,
+            "showReducedProperties": True,
+            "commercial": False,
+            "showOnMap": True,
+            "enhancedListing": False,
+        },
+        "distance": None,
+        "transactionType": "rent" if property_type == consts.PROPERTY_TYPE_TORENT else "buy",
+        "productLabel": {"productLabelText": "", "spotlightLabel": False},
+        "commercial": False,
+        "development": False,
+        "residential": True,
+        "students": False,
+        "auction": False,
+        "feesApply": False,
+        "displaySize": "",
+        "showOnMap": True,
+        "propertyUrl": f"/properties/{property_id}#/?channel=RES_BUY",
+        "contactUrl": f"/property-for-sale/contactBranch.html?propertyId={property_id}",
+        "staticMapUrl": None,
+        "channel": "BUY",
+        "firstVisibleDate": "2026-09-%02dT10:00:00Z" % rng.randint(1, 28),
+        "keywords": [],
+        "saved": False,
+        "hidden": False,
+        "onlineViewingsAvailable": rng.random() < 0.2,
+        "displayStatus": rng.choice(["", "", "", "Under offer", "Sold STC"]),
+        "isRecent": False,
+        "heading": "",
+        "addedOrReduced": "Added on 01/10/2026",
+        "formattedBranchName": " by Example Estates, Exampletown",
+        "propertyTypeFullDescription": desc,
+        "propertyImages": {
+            "images": [
+                {"srcUrl": f"https://media.example/{property_id}_{i}.jpeg", "caption": None} for i in range(8)
+            ],
+            "mainImageSrc": f"https://media.example/{property_id}_0.jpeg",
+        },
+    }
+
+
+def synthetic_page(outcode, index=0, per_page=48, n_results=480, property_type=consts.PROPERTY_TYPE_FORSALE,
+                   seed=None):
+    """
+    Build a search result page with the same structure as the real site: property card markup plus an embedded
+    `window.jsonModel` script.
+    :param outcode: Outcode integer, used to seed the content.
+    :param index: Pagination index of the page.
+    :param n_results: Total number of results for the outcode.
+    :return: Page body (bytes).
+    """
+    rng = random.Random(seed if seed is not None else (outcode * 100003 + index) * 10 + property_type)
+    n_on_page = max(min(per_page, n_results - index), 0)
+    listings = [
+        synthetic_listing(rng, outcode * 100000 + index + i, property_type=property_type) for i in range(n_on_page)
+    ]
+    model = {
+        "properties": listings,
+        "resultCount": f"{n_results:,}",
+        "searchParameters": {"locationIdentifier": f"OUTCODE^{outcode}", "index": str(index)},
+        "pagination": {
+            "total": max((n_results + per_page - 1) // per_page, 1),
+            "first": "0",
+            "last": f"{max(n_results - 1, 0) // per_page * per_page:,}",
+            "page": str(index // per_page + 1),
+        },
+    }
+    cards = []
+    for attr in listings:
+        cards.append(
+            '<div class="l-searchResult is-list" data-test="propertyCard-{id}"><div class="propertyCard">'
+            '<a class="propertyCard-headerLink" href="{url}"><h2 class="propertyCard-title">{desc}</h2></a>'
+            '<address class="propertyCard-address"><span>{addr}</span></address>'
+            '<div class="propertyCard-description"><span>{summary}</span></div>'
+            '<div class="propertyCard-priceValue">{price}</div>'
+            '<div class="propertyCard-contacts"><a href="tel:{tel}">{tel}</a></div>'
+            '</div></div>'.format(
+                id=attr["id"],
+                url=attr["propertyUrl"],
+                desc=attr["propertyTypeFullDescription"],
+                addr=attr["displayAddress"],
+                summary=attr["summary"],
+                price=attr["price"]["displayPrices"][0]["displayPrice"],
+                tel=attr["customer"]["contactTelephone"],
+            )
+        )
+    html = (
+        '<!DOCTYPE html><html><head><title>Property search</title></head><body>'
+        '<div id="l-container"><span class="searchHeader-resultCount">{count}</span>'
+        '<div id="l-searchResults">{cards}</div></div>'
+        '<script>window.jsonModel = {model}</script>'
+        '</body></html>'
+    ).format(count=model["resultCount"], cards="".join(cards), model=json.dumps(model))
+    return html.encode("utf-8")
+
+
+def synthetic_pages(n_pages, per_page=48, property_type=consts.PROPERTY_TYPE_FORSALE):
+    """
+    :return: List of `n_pages` synthetic full pages, spread over several outcodes.
+    """
+    out = []
+    pages_per_outcode = 10
+    for i in range(n_pages):
+        outcode = 1 + i // pages_per_outcode
+        index = (i % pages_per_outcode) * per_page
+        out.append(synthetic_page(outcode, index=index, per_page=per_page, n_results=pages_per_outcode * per_page,
+                                  property_type=property_type))
+    return out
@@ -0,0 +1,33 @@
+"""
+Record real search result pages as benchmark fixtures.
+
+Usage:
+    PYTHONPATH=. python -m bench.record_fixtures --property-type 1 --outcode 1 --outcode 2 --max-pages 5
+"""
+import argparse
+import itertools
+from core import requester
+from rightmove import consts, getter
+from bench import pages as pages_
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Record search result pages for the benchmarks.")
+    argparser.add_argument("--property-type", type=int, default=consts.PROPERTY_TYPE_FORSALE,
+                           choices=sorted(consts.FIND_URLS))
+    argparser.add_argument("--outcode", type=int, action="append", required=True)
+    argparser.add_argument("--max-pages", type=int, default=5, help="Maximum number of pages per outcode.")
+    argparser.add_argument("--fixtures", default=pages_.FIXTURE_DIR)
+    args = argparser.parse_args(argv)
+
+    req = requester.MoverightRequester()
+    find_url = consts.FIND_URLS[args.property_type]
+    for outcode in args.outcode:
+        gen = getter.outcode_search_generator(outcode, find_url, requester=req)
+        for page in itertools.islice(gen, args.max_pages):
+            name = f"{consts.PROPERTY_TYPE_MAP[args.property_type]}-{outcode}-{page.index}"
+            print(pages_.save_fixture(page.content, name, fixture_dir=args.fixtures))
+
+
+if __name__ == "__main__":
+    main()
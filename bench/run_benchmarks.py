@@ -0,0 +1,185 @@
+"""
+Micro-benchmarks for each stage of the crawl pipeline, run on recorded search result pages (see record_fixtures), or on
+synthetic pages if none have been recorded.
+
+Usage:
+    PYTHONPATH=. python -m bench.run_benchmarks [--repeat 5] [--compare bench/results/<previous>.json]
+
+Results are printed and saved as JSON in bench/results/, so runs can be compared across versions.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from bs4 import BeautifulSoup
+from config import cfg
+from rightmove import consts, parser, worker
+from bench import pages as pages_
+from bench.fakes import FakeMongoClient
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _stage_soup_extract(contents):
+    for c in contents:
+        parser.parse_search_results(BeautifulSoup(c, "html.parser"))
+
+
+def _stage_page_extract(contents):
+    for c in contents:
+        parser.SearchPage(c).model
+
+
+def _decoded_pages(contents):
+    out = []
+    for c in contents:
+        p = parser.SearchPage(c)
+        p.model
+        out.append(p)
+    return out
+
+
+def _stage_parse(property_type):
+    def setup(contents):
+        return _decoded_pages(contents)
+
+    def run(pages):
+        for p in pages:
+            parser.parse_from_soup(p, property_type=property_type)
+    return setup, run
+
+
+def _setup_meta(contents):
+    return [copy.deepcopy(p.properties) for p in _decoded_pages(contents)]
+
+
+def _stage_meta(attr_arrs):
+    meta = worker.retrieval_meta(outcode=1, property_type=consts.PROPERTY_TYPE_FORSALE)
+    for attr_arr in attr_arrs:
+        for attr in attr_arr:
+            worker.add_retrieval_meta(attr, meta["_id"])
+
+
+def _stage_get_one_outcode(contents):
+    worker.MONGO_CLI = FakeMongoClient()
+    pages = [parser.SearchPage(c, index=i * 48) for i, c in enumerate(contents)]
+    worker.get_one_outcode(1, consts.PROPERTY_TYPE_FORSALE, incremental=False, pages=pages, outcode_postcode="AB1")
+
+
+def stages():
+    """
+    :return: Ordered list of (name, setup, run). `setup` prepares the input for `run` outside the timed region.
+    """
+    identity = (lambda contents: contents)
+    return [
+        ("html_to_json_soup", identity, _stage_soup_extract),
+        ("html_to_json_page", identity, _stage_page_extract),
+        ("parse_for_sale",) + _stage_parse(consts.PROPERTY_TYPE_FORSALE),
+        ("parse_to_rent",) + _stage_parse(consts.PROPERTY_TYPE_TORENT),
+        ("add_retrieval_meta", _setup_meta, _stage_meta),
+        ("get_one_outcode", identity, _stage_get_one_outcode),
+    ]
+
+
+def measure(setup, run, contents, repeat):
+    times = []
+    for _ in range(repeat):
+        dat = setup(contents)
+        t0 = time.perf_counter()
+        run(dat)
+        times.append(time.perf_counter() - t0)
+
+    # memory is measured in a separate pass, since tracing slows everything down
+    dat = setup(contents)
+    tracemalloc.start()
+    try:
+        run(dat)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run_benchmarks(contents, repeat=5, only=None):
+    n_pages = len(contents)
+    n_listings = sum(len(parser.SearchPage(c).properties) for c in contents)
+    out = {
+        "version": cfg["env"]["version"],
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "n_pages": n_pages,
+        "n_listings": n_listings,
+        "repeat": repeat,
+        "stages": {},
+    }
+    for name, setup, run in stages():
+        if only and name not in only:
+            continue
+        times, peak = measure(setup, run, contents, repeat)
+        best = min(times)
+        out["stages"][name] = {
+            "best_sec": best,
+            "median_sec": statistics.median(times),
+            "pages_per_sec": n_pages / best,
+            "listings_per_sec": n_listings / best,
+            "peak_memory_bytes": peak,
+        }
+    return out
+
+
+def print_results(res, baseline=None):
+    print(f"{res['n_pages']} pages, {res['n_listings']} listings, best of {res['repeat']} (version {res['version']})")
+    header = f"{'stage':<22}{'pages/s':>12}{'listings/s':>14}{'peak MiB':>10}"
+    if baseline is not None:
+        header += f"{'vs base':>10}"
+    print(header)
+    for name, r in res["stages"].items():
+        line = f"{name:<22}{r['pages_per_sec']:>12.1f}{r['listings_per_sec']:>14.1f}" \
+               f"{r['peak_memory_bytes'] / 2 ** 20:>10.1f}"
+        if baseline is not None and name in baseline.get("stages", {}):
+            line += f"{r['pages_per_sec'] / baseline['stages'][name]['pages_per_sec']:>9.2f}x"
+        print(line)
+
+
+def save_results(res, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    fn = os.path.join(results_dir, f"bench-{res['version'].strip()}-{res['timestamp'].replace(':', '')}.json")
+    with open(fn, "w") as f:
+        json.dump(res, f, indent=2)
+    return fn
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Benchmark the crawl pipeline stages on recorded pages.")
+    argparser.add_argument("--fixtures", default=pages_.FIXTURE_DIR, help="Directory of recorded pages.")
+    argparser.add_argument("--synthetic-pages", type=int, default=50,
+                           help="Number of synthetic pages to use if no recorded pages are found.")
+    argparser.add_argument("--repeat", type=int, default=5)
+    argparser.add_argument("--stage", action="append", help="Only run the named stage(s).")
+    argparser.add_argument("--compare", help="JSON results of a previous run to compare against.")
+    argparser.add_argument("--no-save", action="store_true")
+    args = argparser.parse_args(argv)
+
+    contents = pages_.load_fixtures(args.fixtures)
+    if len(contents) == 0:
+        print(f"No recorded pages in {args.fixtures}; using {args.synthetic_pages} synthetic pages.")
+        contents = pages_.synthetic_pages(args.synthetic_pages)
+
+    res = run_benchmarks(contents, repeat=args.repeat, only=args.stage)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_results(res, baseline=baseline)
+    if not args.no_save:
+        print(f"Saved results to {save_results(res)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+from rightmove import export
+
+if __name__ == "__main__":
+    export.main()
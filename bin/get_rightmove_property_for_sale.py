@@ -1,4 +1,4 @@
-from rightmove import consts, worker
+from rightmove import consts, cli
 
 if __name__ == "__main__":
-    worker.get_all_outcodes(consts.PROPERTY_TYPE_FORSALE)
\ No newline at end of file
+    cli.main(consts.PROPERTY_TYPE_FORSALE)
@@ -0,0 +1,4 @@
+from rightmove import retrieval_meta
+
+if __name__ == "__main__":
+    retrieval_meta.main()
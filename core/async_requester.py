@@ -0,0 +1,149 @@
+import aiohttp
+import asyncio
+import requests
+import time
+from typing import Optional
+from core import get_logger
+from core.requester import (
+    Limiter, AdaptiveRateController, DEFAULT_LIMITER, DEFAULT_RATE_CONTROLLER, DEFAULT_USER_AGENT,
+    DEFAULT_REQUEST_FROM, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, DEFAULT_ACCEPT_ENCODING, DEFAULT_RETRIES,
+    RETRY_STATUSES, LIMITER_WAIT, HTTP_LATENCY, HTTP_RESPONSES, backoff_delay, parse_retry_after, moveright_headers
+)
+
+
+class AsyncResponse(object):
+    """
+    Response of an AsyncRequester, with the body already read, since aiohttp releases the connection (and with it
+    the body) when the request context manager exits.
+    """
+    def __init__(self, url, status, reason, headers, body, request_info=None):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.request_info = request_info
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise aiohttp.ClientResponseError(self.request_info, (), status=self.status, message=self.reason,
+                                              headers=self.headers)
+
+
+class AsyncRequester(object):
+    """
+    asyncio counterpart of RequesterSingleton, with the same headers and limiter semantics.
+    This is not a singleton, because the underlying aiohttp session is bound to the event loop that created it. Use it
+    as an async context manager, or call `close` when finished.
+    """
+    def __init__(self,
+                 headers=None,
+                 limiter: Optional[Limiter] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Optional[tuple] = DEFAULT_TIMEOUT,
+                 accept_encoding: Optional[str] = DEFAULT_ACCEPT_ENCODING,
+                 rate_controller: Optional[AdaptiveRateController] = None,
+                 retries: int = DEFAULT_RETRIES):
+        self.limiter = limiter
+        self.rate_controller = rate_controller
+        self.retries = retries
+        self.n_retries = 0
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.logger = get_logger(self.__class__.__name__)
+        self.headers = dict(requests.utils.default_headers())
+        if accept_encoding is not None:
+            self.headers['Accept-Encoding'] = accept_encoding
+        if headers is not None:
+            self.headers.update(headers)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            timeout = None
+            if self.timeout is not None:
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_size),
+                timeout=timeout,
+            )
+        return self._session
+
+    async def _check_limits(self):
+        if self.limiter is not None:
+            LIMITER_WAIT.observe(await self.limiter.acquire_async(), limiter="hard")
+        if self.rate_controller is not None:
+            LIMITER_WAIT.observe(await self.rate_controller.acquire_async(), limiter="adaptive")
+
+    def _record(self, method, status, latency, retry_after=None):
+        status_label = "error" if status is None else status
+        HTTP_LATENCY.observe(latency, method=method, status=status_label)
+        HTTP_RESPONSES.inc(method=method, status=status_label)
+        if self.rate_controller is not None:
+            self.rate_controller.record(status, latency, retry_after)
+
+    async def request(self, method, url, retries=None, **kwargs) -> AsyncResponse:
+        """
+        Make a request once the limits allow it, retrying in the same way as RequesterSingleton.request.
+        :return: AsyncResponse, holding the whole body.
+        """
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            await self._check_limits()
+            t0 = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as client_resp:
+                    resp = AsyncResponse(str(client_resp.url), client_resp.status, client_resp.reason,
+                                         client_resp.headers, await client_resp.read(), client_resp.request_info)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                self._record(method, None, time.monotonic() - t0)
+                if attempt >= retries:
+                    raise
+                delay = backoff_delay(attempt)
+                self.logger.warning("Request to %s failed (%r); retrying in %.1f seconds.", url, exc, delay)
+            else:
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                self._record(method, resp.status, time.monotonic() - t0, retry_after)
+                if resp.status not in RETRY_STATUSES or attempt >= retries:
+                    return resp
+                delay = max(backoff_delay(attempt), retry_after or 0.)
+                self.logger.warning("Got status %d from %s; retrying in %.1f seconds.", resp.status, url, delay)
+            attempt += 1
+            self.n_retries += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, url, params=None, **kwargs):
+        return await self.request("GET", url, params=params, **kwargs)
+
+    async def post(self, url, data=None, json=None, **kwargs):
+        return await self.request("POST", url, data=data, json=json, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncMoverightRequester(AsyncRequester):
+    def __init__(self,
+                 user_agent: str=DEFAULT_USER_AGENT,
+                 request_from: Optional[str]=DEFAULT_REQUEST_FROM,
+                 limiter: Optional[Limiter]=DEFAULT_LIMITER,
+                 rate_controller: Optional[AdaptiveRateController]=DEFAULT_RATE_CONTROLLER):
+        self.user_agent = user_agent
+        self.request_from = request_from
+        super().__init__(headers=moveright_headers(user_agent, request_from), limiter=limiter,
+                         rate_controller=rate_controller)
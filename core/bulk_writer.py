@@ -0,0 +1,203 @@
+import collections
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+from config import cfg
+from core import get_logger, metrics
+
+writer_cfg = cfg.get("writer", {})
+DEFAULT_BATCH_SIZE = writer_cfg.get("batch_size", 1000)
+DEFAULT_FLUSH_INTERVAL = writer_cfg.get("flush_interval", 2.)
+DEFAULT_MAX_QUEUE = writer_cfg.get("max_queue", 50)
+
+WRITE_SECONDS = metrics.histogram(
+    "mongo_write_seconds", "Time taken by each write to MongoDB.", ("collection", "mode")
+)
+WRITE_OPS = metrics.counter("mongo_write_ops_total", "Operations written to MongoDB.", ("collection", "mode"))
+
+_STOP = object()
+_FLUSH = object()
+
+
+class _Ticket(object):
+    """
+    Tracks the outstanding submissions made under one key.
+    """
+    def __init__(self):
+        self.pending = 0
+        self.ids = []
+        self.error: Optional[Exception] = None
+
+
+class BulkWriter(object):
+    """
+    Background stage writing to MongoDB. Producers submit write operations from any thread; a single writer thread
+    coalesces them, across submissions and collections, into large unordered `bulk_write` calls, flushed when the
+    batch size is reached or the oldest buffered submission is `flush_interval` seconds old.
+    The submission queue is bounded, so producers block (backpressure) when MongoDB falls behind.
+
+    Each submission is a list of `(collection_name, operations)` stages, applied in order: if a stage fails, the later
+    stages of that submission are skipped. Submissions are grouped under a key (e.g. one per outcode), and `wait`
+    returns the IDs recorded for that key once all of its submissions have been written.
+    """
+    def __init__(self,
+                 db,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_queue: int = DEFAULT_MAX_QUEUE):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = get_logger(self.__class__.__name__)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._tickets: Dict[object, _Ticket] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Flush everything outstanding and stop the writer thread.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, key, stages, ids=(), callback=None):
+        """
+        Queue write operations. Blocks while the queue is full.
+        :param key: Hashable key grouping submissions, used in `wait`.
+        :param stages: List of `(collection_name, operations)`.
+        :param ids: IDs to report for this key once the submission has been written successfully.
+        :param callback: Optional callable, run with no arguments on the writer thread once the submission has been
+        written successfully.
+        """
+        if self._thread is None:
+            raise RuntimeError("The writer has not been started.")
+        with self._cond:
+            ticket = self._tickets.setdefault(key, _Ticket())
+            ticket.pending += 1
+        self._queue.put((key, stages, list(ids), callback))
+
+    def wait(self, key, timeout: Optional[float] = None) -> List:
+        """
+        Block until every submission made under `key` has been written, and forget the key.
+        :return: The IDs recorded for the key.
+        :raises: The first exception raised while writing any of the key's submissions.
+        """
+        with self._cond:
+            ticket = self._tickets.get(key)
+        if ticket is None:
+            return []
+        # no need to wait for the flush interval: the caller is blocked on this
+        self._queue.put(_FLUSH)
+        with self._cond:
+            if not self._cond.wait_for(lambda: ticket.pending == 0, timeout=timeout):
+                raise TimeoutError(f"Timed out waiting for writes under key {key}.")
+            self._tickets.pop(key, None)
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.ids
+
+    def _run(self):
+        buffered = []
+        n_ops = 0
+        first_buffered = None
+        while True:
+            timeout = None
+            if len(buffered) > 0:
+                timeout = max(self.flush_interval - (time.monotonic() - first_buffered), 0.)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP and item is not _FLUSH:
+                if len(buffered) == 0:
+                    first_buffered = time.monotonic()
+                buffered.append(item)
+                n_ops += sum(len(ops) for _, ops in item[1])
+
+            flush_now = (
+                item is None
+                or item is _STOP
+                or item is _FLUSH
+                or n_ops >= self.batch_size
+                or time.monotonic() - first_buffered >= self.flush_interval
+            )
+            if flush_now and len(buffered) > 0:
+                self._flush(buffered)
+                buffered = []
+                n_ops = 0
+            if item is _STOP:
+                break
+
+    def _flush(self, items):
+        from pymongo.errors import BulkWriteError
+        errors: Dict[int, Exception] = {}
+        n_stages = max(len(item[1]) for item in items)
+        for stage in range(n_stages):
+            # group this stage of every still-healthy submission by collection
+            by_coll = collections.defaultdict(list)
+            for i, (_, stages, _, _) in enumerate(items):
+                if i not in errors and stage < len(stages):
+                    by_coll[stages[stage][0]].append(i)
+            for coll_name, idx in by_coll.items():
+                ops = []
+                owners = []
+                for i in idx:
+                    stage_ops = items[i][1][stage][1]
+                    ops.extend(stage_ops)
+                    owners.extend([i] * len(stage_ops))
+                if len(ops) == 0:
+                    continue
+                WRITE_OPS.inc(len(ops), collection=coll_name, mode="background")
+                try:
+                    with WRITE_SECONDS.time(collection=coll_name, mode="background"):
+                        self.db[coll_name].bulk_write(ops, ordered=False)
+                except BulkWriteError as exc:
+                    # unordered: only the submissions owning the failed operations are affected
+                    for err in exc.details.get("writeErrors", []):
+                        errors.setdefault(owners[err["index"]], exc)
+                    if len(exc.details.get("writeErrors", [])) == 0:
+                        for i in idx:
+                            errors.setdefault(i, exc)
+                    self.logger.error("Bulk write to %s failed for %d operations.", coll_name,
+                                      len(exc.details.get("writeErrors", [])) or len(ops))
+                except Exception as exc:
+                    self.logger.exception("Bulk write of %d operations to %s failed.", len(ops), coll_name)
+                    for i in idx:
+                        errors.setdefault(i, exc)
+
+        for i, (_, _, _, callback) in enumerate(items):
+            if callback is not None and i not in errors:
+                try:
+                    callback()
+                except Exception:
+                    self.logger.exception("Callback for a completed bulk write failed.")
+
+        with self._cond:
+            for i, (key, _, ids, _) in enumerate(items):
+                ticket = self._tickets.get(key)
+                if ticket is None:
+                    continue
+                if i in errors:
+                    if ticket.error is None:
+                        ticket.error = errors[i]
+                else:
+                    ticket.ids.extend(ids)
+                ticket.pending -= 1
+            self._cond.notify_all()
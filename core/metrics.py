@@ -0,0 +1,269 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence
+from config import cfg
+from core import get_logger
+
+metrics_cfg = cfg.get("metrics", {})
+DEFAULT_METRICS_PATH = metrics_cfg.get("path")
+DEFAULT_EXPORT_INTERVAL = metrics_cfg.get("interval", 60.)
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000)
+SIZE_BUCKETS = tuple(2 ** k for k in range(14, 25))
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(labels.items()) + list((extra or {}).items())
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric(object):
+    type_name = None
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(k, "")) for k in self.label_names)
+
+    def _labels(self, key):
+        return dict(zip(self.label_names, key))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. of requests or listings.
+    """
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def prometheus_lines(self):
+        for key, value in self._items():
+            yield f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+
+    def snapshot(self):
+        return [{"labels": self._labels(key), "value": value} for key, value in self._items()]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, e.g. the current request rate.
+    """
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, e.g. latencies, counted into buckets with the given upper bounds.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names=label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0., 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the time spent in its body, in seconds.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _items(self):
+        with self._lock:
+            return sorted((key, ([c for c in state[0]], state[1], state[2])) for key, state in self._values.items())
+
+    def prometheus_lines(self):
+        bounds = self.buckets + (float("inf"),)
+        for key, (counts, total, n) in self._items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                yield f"{self.name}_bucket{_format_labels(labels, {'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {n}"
+
+    def snapshot(self):
+        out = []
+        for key, (counts, total, n) in self._items():
+            out.append({
+                "labels": self._labels(key),
+                "count": n,
+                "sum": total,
+                "mean": total / n if n > 0 else None,
+                "buckets": {_format_value(b): c for b, c in zip(self.buckets + (float("inf"),), counts)},
+            })
+        return out
+
+
+class MetricsRegistry(object):
+    """
+    Named collection of metrics, exported together as Prometheus text or a JSON snapshot.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} is already registered as a {metric.type_name}.")
+            return metric
+
+    def counter(self, name, help_text, label_names=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, label_names=label_names)
+
+    def gauge(self, name, help_text, label_names=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, label_names=label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, label_names=label_names, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "metrics": {
+                m.name: {"type": m.type_name, "help": m.help_text, "values": m.snapshot()} for m in self.metrics()
+            },
+        }
+
+    def write(self, path: str):
+        """
+        Write all metrics to `path`: a JSON snapshot if it ends in .json, otherwise Prometheus text format (e.g. for
+        the node exporter's textfile collector). The file is replaced atomically, so readers never see a partial
+        export.
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.snapshot(), indent=2)
+        else:
+            content = self.to_prometheus()
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class MetricsExporter(object):
+    """
+    Writes the registry to a file every `interval` seconds from a background thread, and once more on close.
+    """
+    def __init__(self, path: str, interval: float = DEFAULT_EXPORT_INTERVAL, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.logger = get_logger(self.__class__.__name__)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def export(self):
+        try:
+            self.registry.write(self.path)
+        except OSError:
+            self.logger.exception("Failed to write metrics to %s", self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def start(self):
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name="MetricsExporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.export()
+        self.logger.info("Wrote metrics to %s", self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
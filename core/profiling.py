@@ -0,0 +1,277 @@
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import cfg
+from core import get_logger
+
+profiling_cfg = cfg.get("profiling", {})
+DEFAULT_PROFILE_DIR = profiling_cfg.get("dir", "profiles")
+DEFAULT_PROFILE_OUTCODES = profiling_cfg.get("outcodes", 20)
+DEFAULT_SAMPLE_INTERVAL = profiling_cfg.get("sample_interval", 0.01)
+DEFAULT_TOP_N = profiling_cfg.get("top_n", 25)
+
+PROFILE_MODES = ("cprofile", "sample")
+
+# crawl phases, matched in order against "<filename>:<function>" of the function where the time was spent
+PHASES = (
+    ("decode", ("extract_json_model", "json/", "_json")),
+    ("parse", ("rightmove/parser", "rightmove/incremental", "bs4/", "/re/", "_sre")),
+    ("store", ("pymongo/", "bson/", "core/bulk_writer", "core/register", "sqlite3")),
+    ("wait", ("requester.py:acquire", "time.sleep", "threading.py:wait", "threading.py:join", "queue.py:get",
+              "queue.py:put", "futures/_base.py:result", "futures/_base.py:wait", "lock' objects", "SimpleQueue")),
+    ("fetch", ("requests/", "urllib3/", "aiohttp/", "http/client", "ssl", "socket", "selectors", "zlib",
+               "core/requester")),
+)
+OTHER_PHASE = "other"
+
+
+def classify(filename: str, function: str) -> str:
+    """
+    :return: Name of the crawl phase the given function belongs to, or "other".
+    """
+    key = f"{filename}:{function}".replace(os.sep, "/")
+    for phase, patterns in PHASES:
+        if any(p in key for p in patterns):
+            return phase
+    return OTHER_PHASE
+
+
+def _format_func(filename, lineno, function):
+    if filename == "~":
+        return function
+    path = os.path.relpath(filename) if os.path.isabs(filename) else filename
+    if lineno is None:
+        return f"{path}({function})"
+    return f"{path}:{lineno}({function})"
+
+
+def _summary_lines(title, by_phase, rows, total, top_n, unit):
+    """
+    :param by_phase: Dictionary of phase -> self time (or samples).
+    :param rows: List of (self, cumulative, phase, description), sorted by decreasing self.
+    """
+    lines = [title, "", "Time by phase (self %s):" % unit]
+    for phase, value in sorted(by_phase.items(), key=lambda x: -x[1]):
+        lines.append(f"  {phase:<8}{value:>12.3f}{100 * value / total if total else 0:>8.1f}%")
+    lines += ["", f"Top {top_n} functions by self {unit}:", f"  {'self':>10}{'cumul':>10}  {'phase':<8}function"]
+    for tt, ct, phase, desc in rows[:top_n]:
+        lines.append(f"  {tt:>10.3f}{ct:>10.3f}  {phase:<8}{desc}")
+    for phase in sorted(by_phase, key=lambda p: -by_phase[p]):
+        phase_rows = [r for r in rows if r[2] == phase][:max(top_n // 5, 5)]
+        lines += ["", f"Top functions in phase {phase}:"]
+        for tt, ct, _, desc in phase_rows:
+            lines.append(f"  {tt:>10.3f}{ct:>10.3f}  {desc}")
+    return lines
+
+
+class ThreadProfiler(object):
+    """
+    Deterministic profiling with cProfile of the calling thread and of every thread started while it is running.
+    On its own, cProfile only sees the thread that enabled it, whereas the crawl runs in worker threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+        self._main = None
+        self._stats: Optional[pstats.Stats] = None
+
+    def _start_thread(self, frame, event, arg):
+        # called once in each new thread, which then gets a profiler of its own
+        sys.setprofile(None)
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # newer interpreters allow one active profiler, which already sees every thread
+            return
+        with self._lock:
+            self._profiles.append(prof)
+
+    def start(self):
+        self._main = cProfile.Profile()
+        self._profiles.append(self._main)
+        self._stats = None
+        threading.setprofile(self._start_thread)
+        self._main.enable()
+        return self
+
+    def stop(self):
+        threading.setprofile(None)
+        self._main.disable()
+        with self._lock:
+            profiles = list(self._profiles)
+        for prof in profiles[1:]:
+            # a thread still running (e.g. a daemon thread) may call into its profiler after this, so the stats are
+            # also frozen here
+            prof.disable()
+        self._stats = self._combine(profiles)
+
+    @staticmethod
+    def _combine(profiles):
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        return stats
+
+    def stats(self) -> pstats.Stats:
+        """
+        :return: Stats of all the profiled threads combined, as of `stop` once it has been called.
+        """
+        if self._stats is not None:
+            return self._stats
+        with self._lock:
+            profiles = list(self._profiles)
+        return self._combine(profiles)
+
+    def write(self, out_dir, title, top_n=DEFAULT_TOP_N) -> Dict[str, str]:
+        """
+        Write the combined profile (loadable with pstats or snakeviz) and a text summary of the hottest functions,
+        overall and by crawl phase.
+        :return: Dictionary of the paths written.
+        """
+        stats = self.stats()
+        prof_fn = os.path.join(out_dir, "profile.prof")
+        stats.dump_stats(prof_fn)
+
+        rows = []
+        by_phase = collections.Counter()
+        for (filename, lineno, function), (_, _, tt, ct, callers) in stats.stats.items():
+            phase = classify(filename, function)
+            if phase == OTHER_PHASE and filename == "~" and len(callers) > 0:
+                # built-ins (e.g. bytes.find) take the phase of the caller they spent most time under
+                caller = max(callers, key=lambda c: callers[c][3] if isinstance(callers[c], tuple) else 0)
+                phase = classify(caller[0], caller[2])
+            by_phase[phase] += tt
+            rows.append((tt, ct, phase, _format_func(filename, lineno, function)))
+        rows.sort(key=lambda r: -r[0])
+        lines = _summary_lines(title, by_phase, rows, sum(by_phase.values()), top_n, "seconds")
+
+        # the standard report as well, sorted by cumulative time
+        buf = io.StringIO()
+        stats.stream = buf
+        stats.sort_stats("cumulative").print_stats(top_n)
+        lines += ["", buf.getvalue()]
+
+        summary_fn = os.path.join(out_dir, "summary.txt")
+        with open(summary_fn, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return {"profile": prof_fn, "summary": summary_fn}
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiling: a background thread records the stack of every other thread every `interval` seconds.
+    The overhead is low and does not depend on the number of function calls, so it can be left on for a full crawl.
+    """
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.n_samples = 0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.n_samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write(self, out_dir, title, top_n=DEFAULT_TOP_N) -> Dict[str, str]:
+        """
+        Write the samples as collapsed stacks (the input format of flamegraph.pl and speedscope), and a text summary
+        of the functions most often at the top of a stack, overall and by crawl phase. Times are estimated as samples * interval.
+        :return: Dictionary of the paths written.
+        """
+        stacks_fn = os.path.join(out_dir, "stacks.txt")
+        with open(stacks_fn, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(";".join(f"{fn}({os.path.basename(filename)})" for filename, fn in stack) + f" {n}\n")
+
+        self_counts = collections.Counter()
+        cumul_counts = collections.Counter()
+        for stack, n in self.stacks.items():
+            # the innermost frame belonging to a phase decides it, since time in C functions (e.g. waiting on a
+            # socket) shows up in the Python function that called them
+            phase = next((p for p in (classify(*frame) for frame in reversed(stack)) if p != OTHER_PHASE),
+                         OTHER_PHASE)
+            self_counts[(stack[-1], phase)] += n
+            for key in set(stack):
+                cumul_counts[key] += n
+        rows = []
+        by_phase = collections.Counter()
+        for ((filename, fn), phase), n in self_counts.items():
+            by_phase[phase] += n * self.interval
+            rows.append((n * self.interval, cumul_counts[(filename, fn)] * self.interval, phase,
+                         _format_func(filename, None, fn)))
+        rows.sort(key=lambda r: -r[0])
+        title = f"{title}\n{self.n_samples} samples every {self.interval}s, over all threads"
+        lines = _summary_lines(title, by_phase, rows, sum(by_phase.values()), top_n, "seconds (estimated)")
+
+        summary_fn = os.path.join(out_dir, "summary.txt")
+        with open(summary_fn, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return {"stacks": stacks_fn, "summary": summary_fn}
+
+
+class ProfileRun(object):
+    """
+    Context manager profiling its body with either profiler, and writing the results to a new directory under
+    `profile_dir` on exit.
+    """
+    def __init__(self, mode: str = "cprofile", profile_dir: str = DEFAULT_PROFILE_DIR, name: str = "run",
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL, top_n: int = DEFAULT_TOP_N):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}; expected one of {PROFILE_MODES}.")
+        self.mode = mode
+        self.name = name
+        self.top_n = top_n
+        self.out_dir = os.path.join(profile_dir, f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{name}-{mode}")
+        if mode == "cprofile":
+            self.profiler = ThreadProfiler()
+        else:
+            self.profiler = SamplingProfiler(interval=sample_interval)
+        self.logger = get_logger(self.__class__.__name__)
+        self.paths: Optional[Dict[str, str]] = None
+        self._t0 = None
+
+    def __enter__(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.logger.info("Profiling with %s; results will be written to %s", self.mode, self.out_dir)
+        self._t0 = time.perf_counter()
+        self.profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.stop()
+        elapsed = time.perf_counter() - self._t0
+        title = f"Profile of {self.name} ({self.mode}), {elapsed:.1f}s wall time"
+        self.paths = self.profiler.write(self.out_dir, title, top_n=self.top_n)
+        self.logger.info("Wrote profile summary to %s", self.paths["summary"])
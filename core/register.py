@@ -6,9 +6,16 @@ from core import get_logger
 import datetime
 import collections
 import itertools
+import threading
+import time
+from typing import Dict, Optional
 
 LOGGER = get_logger("register")
 DEFAULT_KWARGS = cfg["sqlite"]
+access_log_cfg = cfg.get("access_log", {})
+DEFAULT_BATCH_SIZE = access_log_cfg.get("batch_size", 50)
+DEFAULT_FLUSH_INTERVAL = access_log_cfg.get("flush_interval", 10.)
+DEFAULT_FLUSH_SUCCESS = access_log_cfg.get("flush_success", True)
 
 class AccessLog(object):
     _schema = collections.OrderedDict([
@@ -23,21 +30,50 @@ class AccessLog(object):
         "dt": datetime.datetime.now
     }
 
-    def __init__(self, **kwargs):
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 flush_success: Optional[bool] = None, **kwargs):
+        """
+        :param batch_size: Rows are buffered and written in one transaction once this many are waiting.
+        :param flush_interval: Buffered rows are also written once the oldest has waited this many seconds, from a
+        timer if no other row is logged in the meantime.
+        :param flush_success: If True, a row with success=1 is written straight away, with any rows buffered before
+        it. Resumed runs skip the outcodes in those rows, so they must not be lost if the process is killed.
+        :param kwargs: Passed to sqlite3.connect. If none are supplied, the sqlite section of the config is used.
+        """
         if len(kwargs) == 0:
             kwargs = copy.copy(DEFAULT_KWARGS)
 
+        self.batch_size = batch_size if batch_size is not None else DEFAULT_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else DEFAULT_FLUSH_INTERVAL
+        self.flush_success = flush_success if flush_success is not None else DEFAULT_FLUSH_SUCCESS
         kwargs["detect_types"] = sqlite3.PARSE_DECLTYPES
+        # access is serialised by our own lock
+        kwargs["check_same_thread"] = False
         assert "database" in kwargs, "Required kwarg `database` not supplied"
         db_dir = os.path.dirname(kwargs["database"])
         if not os.path.isdir(db_dir):
             os.makedirs(db_dir)
             LOGGER.info("Created new directory %s for sqlite database.", db_dir)
         self.connection = sqlite3.connect(**kwargs)
+        # WAL lets readers carry on while we write, and only needs a full fsync at checkpoints
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
         LOGGER.info("Using sqlite DB at %s", kwargs["database"])
+        self._lock = threading.RLock()
+        self._insert_sql: Dict[str, str] = {}
+        self._buffer = collections.defaultdict(list)
+        self._n_buffered = 0
+        self._first_buffered = None
+        self._timer = None
         self.table_names = None
         self.update_table_names()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
     @property
     def cursor(self):
         return self.connection.cursor()
@@ -59,6 +95,23 @@ class AccessLog(object):
         sql.append(")")
         return "".join(sql)
 
+    def _create_index_sql(self, table_name):
+        return f"CREATE INDEX IF NOT EXISTS {table_name}_history ON {table_name} (outcode, property_type, dt)"
+
+    def _prepare_insert(self, table_name):
+        """
+        The INSERT statement for a table, built once. sqlite3 caches the compiled statement by its text.
+        """
+        if table_name not in self._insert_sql:
+            if table_name not in self.table_names:
+                self.create_access_log_table(table_name)
+            else:
+                # tables created by earlier versions may lack the index
+                self.cursor.execute(self._create_index_sql(table_name))
+            placeholders = ", ".join("?" * len(self._schema))
+            self._insert_sql[table_name] = f"INSERT INTO {table_name} VALUES({placeholders});"
+        return self._insert_sql[table_name]
+
     def create_access_log_table(self, table_name, overwrite=False):
         if overwrite:
             sql = f"""
@@ -71,35 +124,116 @@ class AccessLog(object):
                 pass
         sql = self._create_if_not_exists_sql(table_name)
         self.cursor.execute(sql)
+        self.cursor.execute(self._create_index_sql(table_name))
         self.update_table_names()
         if table_name not in self.table_names:
             raise KeyError(f"I just tried to create a table called {table_name}, but it isn't in the list of table "
                            f"names after an update. Did creation fail?")
 
     def log(self, table_name, **insert_kwargs):
-        if table_name not in self.table_names:
-            self.create_access_log_table(table_name)
-
+        """
+        Buffer one row for insertion. Rows are written when the buffer reaches `batch_size`, when the oldest row has
+        waited `flush_interval` seconds, on `flush`/`close`, or straight away for a successful row if `flush_success`
+        is set.
+        """
         # check that the insert kwargs include only fields in the schema
         unknown_kwargs = set(insert_kwargs).difference(self._schema)
         if len(unknown_kwargs) > 0:
             unknown_str = ",".join(unknown_kwargs)
             raise KeyError(f"{len(unknown_kwargs)} unknown insert_kwargs: {unknown_str}.")
 
-        ins_str = f"INSERT INTO {table_name} VALUES("
         ins_vals = []
-        last_ = list(self._schema.keys())[-1]
         for k in self._schema:
             val = insert_kwargs.get(k)
             if val is None and k in self._default_for_insert:
                 val = self._default_for_insert[k]()
             ins_vals.append(val)
-            ins_str += "?"
-            if k != last_:
-                ins_str += ", "
-        ins_str += ");"
 
-        self.cursor.execute(ins_str, tuple(ins_vals))
-        self.connection.commit()
+        with self._lock:
+            self._prepare_insert(table_name)
+            if self._n_buffered == 0:
+                self._first_buffered = time.monotonic()
+                self._start_timer()
+            self._buffer[table_name].append(tuple(ins_vals))
+            self._n_buffered += 1
+            if self._n_buffered >= self.batch_size or time.monotonic() - self._first_buffered >= self.flush_interval:
+                self.flush()
+            elif self.flush_success and insert_kwargs.get("success") == 1:
+                self.flush()
+
+    def _start_timer(self):
+        if self.flush_interval is None or self.flush_interval <= 0:
+            return
+        self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            LOGGER.exception("Failed to write buffered rows to the access log.")
+
+    def flush(self):
+        """
+        Write all buffered rows in a single transaction.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._n_buffered == 0:
+                return
+            with self.connection:
+                for table_name, rows in self._buffer.items():
+                    self.connection.executemany(self._prepare_insert(table_name), rows)
+            self._buffer.clear()
+            self._n_buffered = 0
 
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.connection.close()
+
+    def _select_distinct(self, table_name, column, since, **where):
+        """
+        Distinct values of one column in rows logged since a given time, matching the supplied column values.
+        """
+        self.flush()
+        with self._lock:
+            if table_name not in self.table_names:
+                # the table may have been created since by another process sharing the database
+                self.update_table_names()
+            if table_name not in self.table_names:
+                return set()
+            sql = f"SELECT DISTINCT {column} FROM {table_name} WHERE dt >= ?"
+            vals = [since]
+            for k, v in where.items():
+                sql += f" AND {k} = ?"
+                vals.append(v)
+            return set(itertools.chain(*self.cursor.execute(sql, tuple(vals)).fetchall()))
+
+    def successful_outcodes(self, table_name, property_type, since):
+        """
+        :return: Set of outcodes successfully retrieved since the given datetime.
+        """
+        return self._select_distinct(table_name, "outcode", since, property_type=property_type, success=1)
+
+
+class PageCheckpointLog(AccessLog):
+    """
+    Log of individual pages of results that have been stored, so that an interrupted crawl of a large outcode can be
+    resumed part way through.
+    """
+    _schema = collections.OrderedDict([
+        ("dt", "TIMESTAMP NOT NULL"),
+        ("outcode", "INTEGER NOT NULL"),
+        ("property_type", "INTEGER NOT NULL"),
+        ("page_index", "INTEGER NOT NULL"),
+    ])
 
+    def completed_pages(self, table_name, outcode, property_type, since):
+        """
+        :return: Set of pagination indexes stored for the outcode since the given datetime.
+        """
+        return self._select_distinct(table_name, "page_index", since, outcode=outcode, property_type=property_type)
@@ -1,54 +1,355 @@
 import requests
+import requests.adapters
 from typing import Optional, Dict
 from functools import wraps
-from datetime import datetime, timedelta
+import asyncio
+import email.utils
+import hashlib
+import json
+import os
+import random
+import sqlite3
 import time
+import threading
+import zlib
 from config import cfg
-from core import get_logger
+from core import get_logger, metrics
 
 requester_cfg = cfg.get("requester", {})
 DEFAULT_REQUEST_FROM = requester_cfg.get("request_from")
 DEFAULT_USER_AGENT = requester_cfg.get("user_agent")
 DEFAULT_LIMIT_PER_SECOND = requester_cfg.get("limit_per_second")
 DEFAULT_LIMIT_PER_HOUR = requester_cfg.get("limit_per_hour")
+DEFAULT_LIMITER_STORE = requester_cfg.get("limiter_store")
+DEFAULT_POOL_SIZE = requester_cfg.get("pool_size", 10)
+DEFAULT_TIMEOUT = (requester_cfg.get("connect_timeout", 10), requester_cfg.get("read_timeout", 30))
+DEFAULT_ACCEPT_ENCODING = requester_cfg.get("accept_encoding", "gzip, deflate")
+DEFAULT_RETRIES = requester_cfg.get("retries", 3)
+DEFAULT_BACKOFF_BASE = requester_cfg.get("backoff_base", 1.)
+DEFAULT_BACKOFF_MAX = requester_cfg.get("backoff_max", 60.)
+adaptive_cfg = requester_cfg.get("adaptive", {})
+cache_cfg = requester_cfg.get("cache", {})
+DEFAULT_CACHE_PATH = cache_cfg.get("path")
+DEFAULT_CACHE_MAX_MB = cache_cfg.get("max_mb", 1024)
+DEFAULT_CACHE_FRESH_MINUTES = cache_cfg.get("fresh_minutes", 0)
 
+# responses that are worth retrying. 429 and 503 are the server asking us to slow down.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+THROTTLE_STATUSES = frozenset((429, 503))
 
-def increment_time_unit(dt: datetime, unit: str, increment: int=1):
-    time_units = ["hour", "minute", "second", "day", "month", "year", "microsecond"]
-    time_delta_dict = {
-        "hour": timedelta(hours=increment),
-        "minute": timedelta(minutes=increment),
-        "second": timedelta(seconds=increment),
-        "day": timedelta(days=increment),
-        "microsecond": timedelta(microseconds=increment)
-    }
-    if unit == "month":
-        kwargs = {k: getattr(dt, k) for k in time_units}
-        if kwargs["month"] == 12:
-            kwargs["year"] += 1
-        kwargs["month"] += 1
-        new_dt = datetime(**kwargs)
-    elif unit == "year":
-        kwargs = {k: getattr(dt, k) for k in time_units}
-        kwargs["year"] += 1
-        new_dt = datetime(**kwargs)
-    else:
-        new_dt = dt + time_delta_dict[unit]
-
-    wait_for = (new_dt - datetime.now()).total_seconds()
+LIMITER_WAIT = metrics.histogram(
+    "requester_limiter_wait_seconds", "Time spent waiting for the rate limits before each request.", ("limiter",)
+)
+HTTP_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "Time taken by each HTTP request, including reading the body.",
+    ("method", "status")
+)
+HTTP_RESPONSES = metrics.counter(
+    "http_responses_total", "HTTP responses by status code, or 'error' for requests that got no response.",
+    ("method", "status")
+)
+CACHE_RESULTS = metrics.counter(
+    "http_cache_total", "GET requests by HTTP cache outcome: fresh, revalidated (304), miss or stored.", ("result",)
+)
+REQUEST_RATE = metrics.gauge(
+    "requester_adaptive_rate", "Current target rate of the adaptive rate controller, in requests per second.",
+    ("name",)
+)
+
+
+PERIOD_SECONDS = {
+    "second": 1.,
+    "minute": 60.,
+    "hour": 3600.,
+    "day": 86400.,
+    "month": 30 * 86400.,
+    "year": 365 * 86400.,
+}
+
+
+def _bucket_specs(name, limits):
+    """
+    Token buckets enforcing the given limits. The shortest period is a plain token bucket, whose capacity is the
+    burst size. A bucket of a longer period holds at most that burst (or half its limit, if smaller) and refills with
+    the rest of its limit over the period, so no window of that length contains more calls than the limit, even when
+    the buckets start full, e.g. in a new process.
+    :param limits: Iterable of `(period name, limit)`.
+    :return: List of `(key, capacity, refill_rate_per_second)`.
+    """
+    limits = sorted(limits, key=lambda x: PERIOD_SECONDS[x[0]])
+    if len(limits) == 0:
+        return []
+    shortest, burst = limits[0]
+    buckets = [(f"{name}:{shortest}", burst, burst / PERIOD_SECONDS[shortest])]
+    for period, lim in limits[1:]:
+        capacity = min(burst, lim / 2.)
+        buckets.append((f"{name}:{period}", capacity, (lim - capacity) / PERIOD_SECONDS[period]))
+    return buckets
+
+
+def _reserve_tokens(state, buckets, now):
+    """
+    Take one token from each of the buckets, updating `state` in-place. Buckets are allowed to go into debt, so that
+    a call which must wait has its slot reserved and later callers queue up behind it.
+    :param state: Dictionary, keyed by bucket key, with values `(tokens, last_updated)`.
+    :param buckets: Iterable of `(key, capacity, refill_rate_per_second)`.
+    :param now: Current time, in the same units as the `last_updated` values.
+    :return: Number of seconds to wait before the call may be made.
+    """
+    wait_for = 0.
+    for key, capacity, rate in buckets:
+        tokens, updated = state.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(now - updated, 0.) * rate) - 1
+        state[key] = (tokens, now)
+        if tokens < 0:
+            wait_for = max(wait_for, -tokens / rate)
     return wait_for
 
 
+class MemoryBucketStore(object):
+    """
+    Token bucket state held in the memory of this process. Safe to share between threads.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, tuple] = {}
+
+    def reserve(self, buckets):
+        with self._lock:
+            return _reserve_tokens(self._state, buckets, self.clock())
+
+
+class SqliteBucketStore(object):
+    """
+    Token bucket state held in a SQLite database, so that several processes (e.g. the for-sale and to-rent jobs)
+    share one combined quota. Each reservation runs in an immediate transaction, which serialises access.
+    """
+    clock = staticmethod(time.time)
+    table_name = "limiter_bucket"
+
+    def __init__(self, database: str, timeout: float = 30.):
+        self.database = database
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads, so keep one per thread
+        # the database is only touched on first use
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            db_dir = os.path.dirname(self.database)
+            if db_dir and not os.path.isdir(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.database, timeout=self.timeout, isolation_level=None)
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table_name} (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            self._local.connection = conn
+        return conn
+
+    def reserve(self, buckets):
+        conn = self._connection()
+        keys = [t[0] for t in buckets]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT key, tokens, updated FROM {self.table_name} WHERE key IN ({', '.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+            state = {k: (tokens, updated) for k, tokens, updated in rows}
+            wait_for = _reserve_tokens(state, buckets, self.clock())
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?)",
+                [(k,) + state[k] for k in keys]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait_for
+
+
+class CachedResponse(object):
+    """
+    A response stored in the HTTP cache.
+    """
+    # response headers kept with the body
+    kept_headers = ("Content-Type", "ETag", "Last-Modified", "Date")
+
+    def __init__(self, url, body, headers, stored_at):
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.stored_at = stored_at
+
+    @property
+    def etag(self):
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self):
+        return self.headers.get("Last-Modified")
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = self.url
+        resp.headers = requests.structures.CaseInsensitiveDict(self.headers)
+        resp._content = self.body
+        resp._content_consumed = True
+        resp.from_cache = True
+        return resp
+
+
+class HttpCache(object):
+    """
+    Disk-backed cache of GET responses, keyed by the full URL including the query string, and held in a SQLite
+    database so that concurrent jobs share it. Bodies are stored compressed; once their total size exceeds
+    `max_bytes`, the least recently used entries are evicted.
+    Stored responses are revalidated with a conditional request (If-None-Match / If-Modified-Since), and a 304 is
+    answered from the cache. If `fresh_for` is set, a response stored within that many seconds is served without
+    making a request at all, which is useful in development and when re-running a job.
+    """
+    clock = staticmethod(time.time)
+    table_name = "http_cache"
+
+    def __init__(self, database: str, max_bytes: int = DEFAULT_CACHE_MAX_MB * 2 ** 20,
+                 fresh_for: float = DEFAULT_CACHE_FRESH_MINUTES * 60., timeout: float = 30.):
+        self.database = database
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # as SqliteBucketStore: one connection per thread, the database is only touched on first use
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            db_dir = os.path.dirname(self.database)
+            if db_dir and not os.path.isdir(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.database, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table_name} (key TEXT PRIMARY KEY, url TEXT, headers TEXT, "
+                f"body BLOB, size INTEGER, stored_at REAL, last_used REAL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table_name}_lru ON {self.table_name} (last_used)"
+            )
+            self._local.connection = conn
+        return conn
+
+    @staticmethod
+    def request_url(url, params=None) -> str:
+        """
+        :return: The URL with `params` encoded into the query string, as it would be sent.
+        """
+        req = requests.models.PreparedRequest()
+        req.prepare_url(url, params)
+        return req.url
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url) -> Optional[CachedResponse]:
+        conn = self._connection()
+        key = self._key(url)
+        row = conn.execute(
+            f"SELECT headers, body, stored_at FROM {self.table_name} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(f"UPDATE {self.table_name} SET last_used = ? WHERE key = ?", (self.clock(), key))
+        headers, body, stored_at = row
+        return CachedResponse(url, zlib.decompress(body), json.loads(headers), stored_at)
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return bool(self.fresh_for) and self.clock() - entry.stored_at <= self.fresh_for
+
+    def is_cacheable(self, resp) -> bool:
+        """
+        Only successful responses are stored, and only if they can be revalidated or may be served while fresh.
+        """
+        if resp.status_code != 200:
+            return False
+        return bool(self.fresh_for) or "ETag" in resp.headers or "Last-Modified" in resp.headers
+
+    def put(self, url, resp):
+        headers = {k: resp.headers[k] for k in CachedResponse.kept_headers if k in resp.headers}
+        body = zlib.compress(resp.content)
+        now = self.clock()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(url), url, json.dumps(headers), body, len(body), now, now)
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def refresh(self, url):
+        """
+        Mark a stored response as revalidated now.
+        """
+        now = self.clock()
+        self._connection().execute(
+            f"UPDATE {self.table_name} SET stored_at = ?, last_used = ? WHERE key = ?", (now, now, self._key(url))
+        )
+
+    def _evict(self, conn):
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table_name}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_delete = []
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table_name} ORDER BY last_used"):
+            to_delete.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        conn.executemany(f"DELETE FROM {self.table_name} WHERE key = ?", to_delete)
+
+    def stats(self) -> Dict[str, int]:
+        n, total = self._connection().execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table_name}"
+        ).fetchone()
+        return {"entries": n, "bytes": total}
+
+
 class Limiter(object):
+    """
+    Token bucket rate limiter. Each limit is a bucket refilled continuously over its period, so calls are spread at
+    the allowed rate. The shortest limit sets the burst size; longer ones are never exceeded over any window of their
+    period (see `_bucket_specs`). Safe to share between threads and asyncio tasks; pass a
+    SqliteBucketStore to share the limits between processes.
+    """
     def __init__(self,
                  per_hour: Optional[int] = None,
                  per_minute: Optional[int] = None,
                  per_second: Optional[int] = None,
                  per_day: Optional[int] = None,
                  per_month: Optional[int] = None,
-                 per_year: Optional[int] = None):
+                 per_year: Optional[int] = None,
+                 store=None,
+                 name: str = "default"):
 
         self.total_calls = 0
+        self.total_wait = 0.
         self.limit_per: Dict[str, Optional[int]] = {
             "hour": per_hour,
             "minute": per_minute,
@@ -57,30 +358,243 @@ class Limiter(object):
             "month": per_month,
             "year": per_year,
         }
-
-        self.calls_per: Dict[str, int] = {}
-        self.last_check_time: Dict[str, datetime] = {}
+        self.name = name
+        self.store = store if store is not None else MemoryBucketStore()
+        self._buckets = _bucket_specs(name, [(k, lim) for k, lim in self.limit_per.items() if lim is not None])
+        self._count_lock = threading.Lock()
         self.logger = get_logger(self.__class__.__name__)
 
-    def check_limits_and_wait(self):
-        for k, lim in self.limit_per.items():
-            if lim is not None:
-                if k in self.last_check_time:
-                    if self.calls_per.get(k, 0) >= lim:
-                        wait_for = increment_time_unit(self.last_check_time[k], unit=k)
-                        if wait_for > 0:
-                            self.logger.info("Exceeded per second limit. Sleeping for %.2f seconds...", wait_for)
-                            time.sleep(wait_for)
-                        # reset the counter
-                        self.calls_per[k] = 0
-                self.last_check_time[k] = datetime.now()
-
-    def increment_count(self):
-        self.total_calls += 1
-        for k, lim in self.limit_per.items():
-            if lim is not None:
-                self.calls_per.setdefault(k, 0)
-                self.calls_per[k] += 1
+    def reserve(self) -> float:
+        """
+        Reserve a slot for one call.
+        :return: Number of seconds the caller must wait before making the call.
+        """
+        wait_for = self.store.reserve(self._buckets) if len(self._buckets) > 0 else 0.
+        with self._count_lock:
+            self.total_calls += 1
+            self.total_wait += wait_for
+        if wait_for >= 1:
+            self.logger.info("Rate limit reached. Sleeping for %.2f seconds...", wait_for)
+        return wait_for
+
+    def acquire(self) -> float:
+        """
+        Block until a call may be made.
+        :return: Number of seconds spent waiting.
+        """
+        wait_for = self.reserve()
+        if wait_for > 0:
+            time.sleep(wait_for)
+        return wait_for
+
+    async def acquire_async(self) -> float:
+        """
+        Equivalent of `acquire` that yields to the event loop while waiting. The reservation itself runs in the
+        loop's default executor, since the store may block, e.g. on a SQLite transaction held by another process.
+        """
+        wait_for = await asyncio.get_running_loop().run_in_executor(None, self.reserve)
+        if wait_for > 0:
+            await asyncio.sleep(wait_for)
+        return wait_for
+
+    # retained for backwards compatibility: reserving a slot already counts the call
+    check_limits_and_wait = acquire
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, which is either a number of seconds or an HTTP date.
+    :return: Number of seconds to wait, or None if the header is missing or malformed.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(dt.timestamp() - time.time(), 0.)
+
+
+def backoff_delay(attempt: int, base: float = DEFAULT_BACKOFF_BASE, cap: float = DEFAULT_BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with jitter: half of the delay is fixed and half random, so that clients which failed together
+    don't all retry together.
+    :param attempt: Number of attempts made so far, starting from 0.
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class AdaptiveRateController(object):
+    """
+    Paces requests below the hard limits of the Limiter, adjusting the rate with AIMD: while responses are successful
+    and fast, the rate is increased by about `increase` requests per second every second. Throttling (429 or 503) is
+    counted over windows of at least `window` seconds and `min_responses` responses, and multiplies the rate by
+    `decrease` at most once per window, when more than a `tolerance` share of the window's requests were throttled.
+    Responses to requests sent before the last decrease don't count towards it. Other server errors and slow responses hold the rate where it is. A Retry-After
+    header pauses all requests until it has passed.
+    Safe to share between threads, and between the sync and async requesters.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self,
+                 initial_rate: float = 1.,
+                 min_rate: float = 0.1,
+                 max_rate: Optional[float] = None,
+                 increase: float = 0.1,
+                 decrease: float = 0.5,
+                 latency_target: Optional[float] = 5.,
+                 window: float = 1.,
+                 tolerance: float = 0.2,
+                 min_responses: int = 20,
+                 name: str = "default"):
+        """
+        :param initial_rate, min_rate, max_rate: Requests per second.
+        :param latency_target: Responses slower than this (in seconds) don't count as healthy.
+        :param window: Length in seconds of the windows over which throttling is counted.
+        :param tolerance: Share of a window's requests that may be throttled before the rate is decreased. With 0,
+        every throttled response decreases the rate, unless it already was within the window.
+        :param min_responses: Minimum number of responses in a window, so that the share is not judged from a handful
+        of requests at low rates.
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.window = window
+        self.tolerance = tolerance
+        self.min_responses = min_responses
+        self._rate = self._clamp(initial_rate)
+        self._lock = threading.Lock()
+        self._next_slot = 0.
+        self._blocked_until = 0.
+        self._window_start = None
+        self._window_responses = 0
+        self._window_throttled = 0
+        self._last_decrease = None
+        self.n_success = 0
+        self.n_throttled = 0
+        self.n_errors = 0
+        self.total_calls = 0
+        self.total_wait = 0.
+        self.name = name
+        self.logger = get_logger(f"{self.__class__.__name__}({name})")
+        REQUEST_RATE.set(self._rate, name=name)
+
+    def _clamp(self, rate):
+        rate = max(rate, self.min_rate)
+        if self.max_rate is not None:
+            rate = min(rate, self.max_rate)
+        return rate
+
+    @property
+    def rate(self) -> float:
+        """
+        Current target rate, in requests per second.
+        """
+        return self._rate
+
+    def reserve(self) -> float:
+        """
+        Reserve the next request slot at the current rate.
+        :return: Number of seconds to wait before making the request.
+        """
+        with self._lock:
+            now = self.clock()
+            start = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = start + 1. / self._rate
+            self.total_calls += 1
+            self.total_wait += start - now
+        return start - now
+
+    def acquire(self) -> float:
+        wait_for = self.reserve()
+        if wait_for > 0:
+            time.sleep(wait_for)
+        return wait_for
+
+    async def acquire_async(self) -> float:
+        # off the event loop, like Limiter.acquire_async, since the lock may be held by a thread
+        wait_for = await asyncio.get_running_loop().run_in_executor(None, self.reserve)
+        if wait_for > 0:
+            await asyncio.sleep(wait_for)
+        return wait_for
+
+    def record(self, status: Optional[int], latency: Optional[float] = None, retry_after: Optional[float] = None):
+        """
+        Adjust the rate according to the outcome of a request.
+        :param status: HTTP status code, or None if the request failed without a response.
+        :param latency: Time taken by the request, in seconds.
+        :param retry_after: Value of the Retry-After header, in seconds.
+        """
+        with self._lock:
+            old_rate = self._rate
+            now = self.clock()
+            if self._window_start is None:
+                self._new_window(now)
+            elif now - self._window_start >= self.window and self._window_responses >= self.min_responses:
+                if self._window_throttled > self.tolerance * self._window_responses:
+                    self._decrease(now)
+                else:
+                    self._new_window(now)
+            # a response to a request sent before the last decrease says nothing about the new rate
+            sent_before_decrease = (self._last_decrease is not None and latency is not None
+                                    and now - latency < self._last_decrease)
+            if not sent_before_decrease:
+                self._window_responses += 1
+            if status in THROTTLE_STATUSES:
+                self.n_throttled += 1
+                if not sent_before_decrease:
+                    self._window_throttled += 1
+                    # no need to wait for the end of the window if it is over the tolerance already
+                    expected = max(self._rate * self.window, self.min_responses, self._window_responses)
+                    if self._window_throttled > self.tolerance * expected:
+                        self._decrease(now)
+            elif status is None or status >= 500:
+                self.n_errors += 1
+            else:
+                self.n_success += 1
+                if self.latency_target is None or latency is None or latency <= self.latency_target:
+                    # one increment per `rate` successes, so the rate grows by ~`increase` per second
+                    self._rate = self._clamp(self._rate + self.increase / self._rate)
+            if retry_after is not None:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            new_rate = self._rate
+        REQUEST_RATE.set(new_rate, name=self.name)
+        if new_rate < old_rate:
+            self.logger.warning("Too many requests throttled; reducing rate from %.2f to %.2f requests per second.",
+                                old_rate, new_rate)
+        if retry_after:
+            self.logger.warning("Server asked to retry after %.1f seconds; pausing requests.", retry_after)
+
+    def _decrease(self, now):
+        # at most once per window: the next one starts now
+        self._rate = self._clamp(self._rate * self.decrease)
+        self._last_decrease = now
+        self._new_window(now)
+
+    def _new_window(self, now):
+        self._window_start = now
+        self._window_responses = 0
+        self._window_throttled = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "rate": self._rate,
+                "success": self.n_success,
+                "throttled": self.n_throttled,
+                "errors": self.n_errors,
+                "calls": self.total_calls,
+                "wait": self.total_wait,
+                "paused_for": max(self._blocked_until - self.clock(), 0.),
+            }
 
 
 def limited_requests(fn):
@@ -118,93 +632,203 @@ class Singleton(type):
 
 
 class RequesterSingleton(metaclass=Singleton):
-    def __init__(self, headers=None, limiter: Optional[Limiter] = None):
+    """
+    Rate limited requester. All requests go through one pooled session, so connections to a host are kept alive and
+    reused rather than opening a new TCP + TLS connection every time.
+    """
+    def __init__(self,
+                 headers=None,
+                 limiter: Optional[Limiter] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Optional[tuple] = DEFAULT_TIMEOUT,
+                 accept_encoding: Optional[str] = DEFAULT_ACCEPT_ENCODING,
+                 rate_controller: Optional[AdaptiveRateController] = None,
+                 retries: int = DEFAULT_RETRIES,
+                 cache: Optional[HttpCache] = None):
+        """
+        :param rate_controller: Optional adaptive pacing, applied on top of the limiter.
+        :param retries: Number of times a request is re-sent after a retryable status or connection error.
+        :param cache: Optional HttpCache for GET requests.
+        """
         self.limiter = limiter
-        # self.limit_per_second = limit_per_second
-        #
-        # self._total_calls = 0
-        # self.calls_this_second = 0
-        # self.calls_this_hour = 0
-        # self.second_time = datetime.now()
-        # self.hour_time = datetime.now()
+        self.rate_controller = rate_controller
+        self.retries = retries
+        self.n_retries = 0
+        self._retries_lock = threading.Lock()
+        self.cache = cache
+        self.timeout = timeout
         self.logger = get_logger(self.__class__.__name__)
         self.headers = requests.utils.default_headers()
+        if accept_encoding is not None:
+            self.headers['Accept-Encoding'] = accept_encoding
         if headers is not None:
             self.headers.update(headers)
 
-    # def increment_call_counts(self):
-    #     now = datetime.now()
-    #     self._total_calls += 1
-    #
-    #     if (now - self.second_time).total_seconds() > 1:
-    #         self.calls_this_second = 1
-    #         self.second_time = now
-    #     else:
-    #         self.calls_this_second += 1
-    #
-    #     if (now - self.hour_time).total_seconds() / 3600. > 1:
-    #         self.calls_this_hour = 1
-    #         self.hour_time = now
-    #     else:
-    #         self.calls_this_hour += 1
-    #
-    # def check_limits(self):
-    #     """
-    #     Test whether we have exceeded any limits and, if so, wait
-    #     :return:
-    #     """
-    #     if self.limit_per_second is not None:
-    #         if self.calls_this_second == self.limit_per_second:
-    #             # wait until the second is up
-    #             wait_til = self.second_time + timedelta(seconds=1)
-    #             wait_for = (wait_til - datetime.now()).total_seconds()
-    #             self.logger.info("Exceeded per second limit. Sleeping for %.2f seconds...", wait_for)
-    #             time.sleep(wait_for)
-    #
-    #     if self.limit_per_hour is not None:
-    #         if self.calls_this_hour == self.limit_per_hour:
-    #             # wait until the hour is up
-    #             wait_til = self.hour_time + timedelta(hours=1)
-    #             wait_for = (wait_til - datetime.now()).total_seconds()
-    #             self.logger.info("Exceeded per hour limit. Sleeping for %d minutes...", int(wait_for / 60.))
-    #             time.sleep(wait_for)
+        self.session = requests.Session()
+        self.session.headers = self.headers
+        # no retries at the transport level: failed requests are handled by the caller
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-    def get(self, url, params=None, **kwargs):
-        # self.check_limits()
-        self.limiter.check_limits_and_wait()
-        if 'headers' not in kwargs:
-            kwargs['headers'] = self.headers
-        resp = requests.get(url, params=params, **kwargs)
-        # self.increment_call_counts()
-        self.limiter.increment_count()
+    def _check_limits(self):
+        if self.limiter is not None:
+            LIMITER_WAIT.observe(self.limiter.acquire(), limiter="hard")
+        if self.rate_controller is not None:
+            LIMITER_WAIT.observe(self.rate_controller.acquire(), limiter="adaptive")
+
+    def _record(self, method, status, latency, retry_after=None):
+        status_label = "error" if status is None else status
+        HTTP_LATENCY.observe(latency, method=method, status=status_label)
+        HTTP_RESPONSES.inc(method=method, status=status_label)
+        if self.rate_controller is not None:
+            self.rate_controller.record(status, latency, retry_after)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Summarise connection reuse in the session's pools. Any request in excess of the number of connections opened
+        was made over a kept-alive connection.
+        """
+        n_requests = 0
+        n_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    n_requests += pool.num_requests
+                    n_connections += pool.num_connections
+        return {
+            "requests": n_requests,
+            "connections": n_connections,
+            "reused": max(n_requests - n_connections, 0),
+        }
+
+    def request(self, method, url, retries=None, **kwargs) -> requests.Response:
+        """
+        Make a request once the limits allow it. Connection errors and retryable statuses (429 and 5xx) are re-sent up
+        to `retries` times, with exponential backoff, or after the delay given by a Retry-After header if longer.
+        The last response is returned whatever its status, so callers should still check it.
+        GET requests go through the cache, if there is one: responses served from it have `from_cache` set.
+        """
+        if self.cache is not None and method == 'GET':
+            return self._cached_get(url, retries, **kwargs)
+        return self._send(method, url, retries, **kwargs)
+
+    def _cached_get(self, url, retries, **kwargs) -> requests.Response:
+        full_url = self.cache.request_url(url, kwargs.get('params'))
+        entry = self.cache.get(full_url)
+        if entry is not None:
+            if self.cache.is_fresh(entry):
+                CACHE_RESULTS.inc(result="fresh")
+                return entry.to_response()
+            headers = dict(kwargs.get('headers') or {})
+            headers.update(entry.conditional_headers())
+            kwargs['headers'] = headers
+        resp = self._send('GET', url, retries, **kwargs)
+        if resp.status_code == 304 and entry is not None:
+            CACHE_RESULTS.inc(result="revalidated")
+            self.cache.refresh(full_url)
+            return entry.to_response()
+        CACHE_RESULTS.inc(result="miss")
+        if self.cache.is_cacheable(resp):
+            CACHE_RESULTS.inc(result="stored")
+            self.cache.put(full_url, resp)
         return resp
 
+    def _send(self, method, url, retries=None, **kwargs) -> requests.Response:
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self._check_limits()
+            t0 = time.monotonic()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                self._record(method, None, time.monotonic() - t0)
+                if attempt >= retries:
+                    raise
+                delay = backoff_delay(attempt)
+                self.logger.warning("Request to %s failed (%s); retrying in %.1f seconds.", url, exc, delay)
+            else:
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                self._record(method, resp.status_code, time.monotonic() - t0, retry_after)
+                if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return resp
+                delay = max(backoff_delay(attempt), retry_after or 0.)
+                self.logger.warning("Got status %d from %s; retrying in %.1f seconds.", resp.status_code, url, delay)
+                resp.close()
+            attempt += 1
+            with self._retries_lock:
+                self.n_retries += 1
+            time.sleep(delay)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
     def post(self, url, data=None, json=None, **kwargs):
-        # self.check_limits()
-        self.limiter.check_limits_and_wait()
-        if 'headers' not in kwargs:
-            kwargs['headers'] = self.headers
-        resp = requests.post(url, data=data, json=json, **kwargs)
-        # self.increment_call_counts()
-        self.limiter.increment_count()
-        return resp
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Snapshot for monitoring: connection reuse, time spent in the limiter and the adaptive rate.
+        """
+        out = dict(self.connection_stats())
+        out["retries"] = self.n_retries
+        if self.limiter is not None:
+            out["limiter_calls"] = self.limiter.total_calls
+            out["limiter_wait"] = self.limiter.total_wait
+        if self.rate_controller is not None:
+            out.update({f"rate_{k}": v for k, v in self.rate_controller.stats().items()})
+        return out
+
 
+DEFAULT_LIMITER = Limiter(
+    per_hour=DEFAULT_LIMIT_PER_HOUR,
+    per_second=DEFAULT_LIMIT_PER_SECOND,
+    store=SqliteBucketStore(DEFAULT_LIMITER_STORE) if DEFAULT_LIMITER_STORE else None,
+    name="rightmove",
+)
 
-DEFAULT_LIMITER = Limiter(per_hour=DEFAULT_LIMIT_PER_HOUR, per_second=DEFAULT_LIMIT_PER_SECOND)
+DEFAULT_HTTP_CACHE = HttpCache(
+    DEFAULT_CACHE_PATH,
+    max_bytes=DEFAULT_CACHE_MAX_MB * 2 ** 20,
+    fresh_for=DEFAULT_CACHE_FRESH_MINUTES * 60.,
+) if DEFAULT_CACHE_PATH else None
+
+DEFAULT_RATE_CONTROLLER = AdaptiveRateController(
+    initial_rate=adaptive_cfg.get("initial_rate") or DEFAULT_LIMIT_PER_SECOND or 1.,
+    min_rate=adaptive_cfg.get("min_rate", 0.1),
+    max_rate=adaptive_cfg.get("max_rate", DEFAULT_LIMIT_PER_SECOND),
+    increase=adaptive_cfg.get("increase", 0.1),
+    decrease=adaptive_cfg.get("decrease", 0.5),
+    latency_target=adaptive_cfg.get("latency_target", 5.),
+    window=adaptive_cfg.get("window", 1.),
+    tolerance=adaptive_cfg.get("tolerance", 0.2),
+    min_responses=adaptive_cfg.get("min_responses", 20),
+    name="rightmove",
+) if adaptive_cfg.get("enabled", True) else None
+
+
+def moveright_headers(user_agent: str, request_from: Optional[str] = None):
+    headers = {
+        'User-Agent': user_agent,
+    }
+    if request_from is not None:
+        headers['From'] = request_from
+    return headers
 
 
 class MoverightRequester(RequesterSingleton):
     def __init__(self,
                  user_agent: str=DEFAULT_USER_AGENT,
                  request_from: Optional[str]=DEFAULT_REQUEST_FROM,
-                 limiter: Optional[Limiter]=DEFAULT_LIMITER):
+                 limiter: Optional[Limiter]=DEFAULT_LIMITER,
+                 rate_controller: Optional[AdaptiveRateController]=DEFAULT_RATE_CONTROLLER,
+                 cache: Optional[HttpCache]=DEFAULT_HTTP_CACHE):
         self.user_agent = user_agent
         self.request_from = request_from
-
-        headers = {
-            'User-Agent': self.user_agent,
-        }
-        if self.request_from is not None:
-            headers['From'] = self.request_from
-        super().__init__(headers=headers, limiter=limiter)
+        super().__init__(headers=moveright_headers(user_agent, request_from), limiter=limiter,
+                         rate_controller=rate_controller, cache=cache)
 
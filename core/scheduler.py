@@ -0,0 +1,42 @@
+import heapq
+import itertools
+import time
+from typing import Any, Optional
+
+
+class RetryScheduler(object):
+    """
+    Delayed priority queue of tasks. Each task is pushed with a deadline, and becomes available once the deadline has
+    passed, earliest first. Tasks with the same deadline are returned in the order they were pushed.
+    Not thread-safe: intended to be used from the thread that dispatches work.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, task: Any, delay: float = 0.):
+        """
+        :param delay: Number of seconds from now until the task is due.
+        """
+        heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), task))
+
+    def pop_due(self) -> Optional[Any]:
+        """
+        :return: The earliest task whose deadline has passed, or None if no task is due yet.
+        """
+        if len(self._heap) > 0 and self._heap[0][0] <= self.clock():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def time_until_due(self) -> Optional[float]:
+        """
+        :return: Number of seconds until the next task is due (0 if one is due already), or None if there are none.
+        """
+        if len(self._heap) == 0:
+            return None
+        return max(self._heap[0][0] - self.clock(), 0.)
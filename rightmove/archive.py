@@ -0,0 +1,102 @@
+"""
+Content-addressed archive of raw search result pages, so that a night's data can be reprocessed without crawling again.
+
+Layout under the archive root:
+    objects/<aa>/<sha256>.gz                             gzip compressed page bodies, stored once per distinct content
+    runs/<run_date>/<property_type>/<outcode>.json       manifest mapping pagination index to content hash
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from rightmove import consts, parser
+
+
+def _atomic_write(path, data: bytes):
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+class PageArchive(object):
+    def __init__(self, root, compress_level=6):
+        self.root = root
+        self.compress_level = compress_level
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".gz")
+
+    def _manifest_path(self, run_date, property_type, outcode):
+        return os.path.join(
+            self.root, "runs", str(run_date), consts.PROPERTY_TYPE_MAP[property_type], f"{outcode}.json"
+        )
+
+    def put(self, content: bytes) -> str:
+        """
+        Store a page body, unless identical content is already archived.
+        :return: The content hash.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.isfile(path):
+            _atomic_write(path, gzip.compress(content, compresslevel=self.compress_level))
+        return digest
+
+    def get(self, digest) -> bytes:
+        with open(self._object_path(digest), "rb") as f:
+            return gzip.decompress(f.read())
+
+    def manifest(self, run_date, property_type, outcode):
+        """
+        :return: Dictionary mapping pagination index to content hash. Empty if the outcode was not archived.
+        """
+        path = self._manifest_path(run_date, property_type, outcode)
+        if not os.path.isfile(path):
+            return {}
+        with open(path, "r") as f:
+            return {int(k): v for k, v in json.load(f).items()}
+
+    def record(self, pages, run_date, property_type, outcode):
+        """
+        Archive pages as they pass through.
+        :param pages: Iterable of parser.SearchPage.
+        :return: Generator yielding the same pages.
+        """
+        man = self.manifest(run_date, property_type, outcode)
+        path = self._manifest_path(run_date, property_type, outcode)
+        for page in pages:
+            man[page.index] = self.put(page.content)
+            # rewrite the manifest each time, so a crash part way through keeps the pages already archived
+            _atomic_write(path, json.dumps({str(k): v for k, v in sorted(man.items())}).encode("utf-8"))
+            yield page
+
+    def iter_pages(self, run_date, property_type, outcode):
+        """
+        Replay the archived pages of one outcode, in pagination order.
+        :return: Generator yielding parser.SearchPage.
+        """
+        for index, digest in sorted(self.manifest(run_date, property_type, outcode).items()):
+            yield parser.SearchPage(self.get(digest), index=index)
+
+    def outcodes(self, run_date, property_type):
+        """
+        :return: Sorted list of the outcodes archived for a run date and property type.
+        """
+        d = os.path.dirname(self._manifest_path(run_date, property_type, 0))
+        if not os.path.isdir(d):
+            return []
+        return sorted(int(fn[:-5]) for fn in os.listdir(d) if fn.endswith(".json"))
+
+    def run_dates(self):
+        d = os.path.join(self.root, "runs")
+        if not os.path.isdir(d):
+            return []
+        return sorted(os.listdir(d))
@@ -0,0 +1,75 @@
+import argparse
+import functools
+from datetime import date
+from core import metrics, profiling, requester
+from rightmove import consts, worker, sharding
+
+
+def build_parser(property_type):
+    parser = argparse.ArgumentParser(
+        description=f"Retrieve all {consts.PROPERTY_TYPE_MAP[property_type]} listings from Rightmove."
+    )
+    parser.add_argument("--workers", type=int, default=worker.DEFAULT_WORKERS,
+                        help="Number of outcodes to retrieve concurrently.")
+    parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=worker.DEFAULT_INCREMENTAL,
+                        help="Only store listings that are new or have changed since they were last seen.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run, skipping outcodes and pages already retrieved.")
+    parser.add_argument("--archive", default=worker.DEFAULT_ARCHIVE_ROOT,
+                        help="Directory in which to archive the raw search pages.")
+    parser.add_argument("--replay", metavar="YYYY-MM-DD",
+                        help="Process the pages archived on this date instead of fetching from Rightmove.")
+    parser.add_argument("--shard", type=sharding.parse_shard, metavar="K/N",
+                        help="Only crawl shard K of N, e.g. 3/8. The partition of outcodes is stable.")
+    parser.add_argument("--lease-queue", metavar="RUN_ID", nargs="?", const=date.today().isoformat(),
+                        help="Take outcodes from the shared MongoDB lease queue for this run (default: today's date), "
+                             "so that several workers split the crawl between them.")
+    parser.add_argument("--metrics", default=metrics.DEFAULT_METRICS_PATH, metavar="PATH",
+                        help="Write crawl metrics to this file during and at the end of the run (JSON if it ends in "
+                             ".json, otherwise Prometheus text format).")
+    parser.add_argument("--http-cache", default=requester.DEFAULT_CACHE_PATH, metavar="PATH",
+                        help="SQLite database caching search pages, which are then revalidated with conditional "
+                             "requests rather than downloaded again.")
+    parser.add_argument("--cache-fresh", type=float, default=requester.DEFAULT_CACHE_FRESH_MINUTES, metavar="MINUTES",
+                        help="Serve pages cached within this many minutes without making a request at all.")
+    parser.add_argument("--parse-processes", type=int, default=worker.DEFAULT_PARSE_PROCESSES,
+                        help="Decode pages in this many separate processes, so that decoding runs on other cores "
+                             "than fetching. 0 decodes pages in the fetching threads.")
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=profiling.PROFILE_MODES,
+                        help="Profile the run and write a profile dump and a summary of the hottest functions by crawl "
+                             "phase. 'cprofile' (the default) is exact but slow, so only a subset of outcodes is "
+                             "crawled; 'sample' has a low overhead and crawls everything unless --max-outcodes is set.")
+    parser.add_argument("--max-outcodes", type=int,
+                        help="Only crawl this many outcodes (default with --profile cprofile: "
+                             f"{profiling.DEFAULT_PROFILE_OUTCODES}).")
+    parser.add_argument("--profile-dir", default=profiling.DEFAULT_PROFILE_DIR,
+                        help="Directory in which each profiled run writes its results.")
+    parser.add_argument("--sample-interval", type=float, default=profiling.DEFAULT_SAMPLE_INTERVAL,
+                        help="Seconds between stack samples with --profile sample.")
+    return parser
+
+
+def main(property_type, argv=None):
+    """
+    Entry point for the bin scripts.
+    :param property_type: consts.PROPERTY_TYPE integer.
+    :param argv: Command line arguments. If not supplied, sys.argv is used.
+    """
+    args = build_parser(property_type).parse_args(argv)
+    if args.http_cache:
+        worker.get_requester().cache = requester.HttpCache(args.http_cache, fresh_for=args.cache_fresh * 60.)
+    max_outcodes = args.max_outcodes
+    if args.profile == "cprofile" and max_outcodes is None:
+        max_outcodes = profiling.DEFAULT_PROFILE_OUTCODES
+    run = functools.partial(
+        worker.get_all_outcodes, property_type, workers=args.workers, incremental=args.incremental,
+        resume=args.resume, archive_root=args.archive, replay_date=args.replay, shard=args.shard,
+        lease_run_id=args.lease_queue, metrics_path=args.metrics, max_outcodes=max_outcodes,
+        parse_processes=args.parse_processes,
+    )
+    if args.profile is None:
+        return run()
+    with profiling.ProfileRun(args.profile, profile_dir=args.profile_dir,
+                              name=consts.PROPERTY_TYPE_MAP[property_type],
+                              sample_interval=args.sample_interval):
+        return run()
@@ -1,5 +1,9 @@
-import pandas as pd
 import os
+import csv
+import bisect
+import functools
+from array import array
+from collections.abc import Mapping
 
 
 BUILDING_SITUATION_DETACHED = 1
@@ -112,4 +116,44 @@ outcode_fn = os.path.join(
     os.path.split(os.path.abspath(__file__))[0],
     "outcodes.tsv"
 )
-OUTCODE_MAP = pd.read_csv(outcode_fn, header=0, index_col=0, sep="\t").squeeze().to_dict()
\ No newline at end of file
+
+
+class OutcodeIndex(Mapping):
+    """
+    Read-only mapping from outcode integer to postcode district, held compactly as a sorted array of outcodes and a
+    matching tuple of postcodes.
+    """
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self._outcodes = array("l", [t[0] for t in pairs])
+        self._postcodes = tuple(t[1] for t in pairs)
+
+    def __getitem__(self, outcode):
+        i = bisect.bisect_left(self._outcodes, outcode)
+        if i == len(self._outcodes) or self._outcodes[i] != outcode:
+            raise KeyError(outcode)
+        return self._postcodes[i]
+
+    def __iter__(self):
+        return iter(self._outcodes)
+
+    def __len__(self):
+        return len(self._outcodes)
+
+    def items(self):
+        return list(zip(self._outcodes, self._postcodes))
+
+
+@functools.lru_cache(maxsize=None)
+def load_outcode_index(fn=outcode_fn):
+    with open(fn, "r", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)  # header
+        return OutcodeIndex((int(row[0]), row[1]) for row in reader if len(row) >= 2)
+
+
+def __getattr__(name):
+    # the outcode table is only read when first needed
+    if name == "OUTCODE_MAP":
+        return load_outcode_index()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Export of the stored listings to Parquet, for analytics jobs that would otherwise scan MongoDB. Listings are flattened
+through the search result parsers (as in parser.parse_from_soup) and written as a dataset partitioned by property type
+and crawl date:
+    <root>/property_type=<name>/crawl_date=<YYYY-MM-DD>/part-0.parquet
+
+Exports are incremental: each run writes the crawl dates that are not in the dataset yet. A partition is written to a
+temporary directory and renamed into place once complete, so readers never see a partial day.
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+from config import cfg
+from core import get_logger
+from rightmove import consts, parser, store
+from rightmove import retrieval_meta
+
+TIMEZONE = cfg["env"].get("timezone", "utc")
+EXPORT_CFG = cfg.get("export", {})
+DEFAULT_EXPORT_ROOT = EXPORT_CFG.get("root")
+DEFAULT_COMPRESSION = EXPORT_CFG.get("compression", "zstd")
+PART_FILENAME = "part-0.parquet"
+
+BASE_FIELDS = [
+    ("property_id", pa.int64()),
+    ("url", pa.string()),
+    ("outcode", pa.int64()),
+    ("outcode_postcode", pa.string()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("featured", pa.bool_()),
+    ("building_type", pa.int64()),
+    ("building_situation", pa.int64()),
+    ("n_bed", pa.int64()),
+    ("agent_name", pa.string()),
+    ("agent_attribute", pa.string()),
+    ("address_string", pa.string()),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("asking_price", pa.float64()),
+    ("is_retirement", pa.bool_()),
+    ("status", pa.string()),
+    ("parse_error", pa.string()),
+]
+SCHEMAS = {
+    consts.PROPERTY_TYPE_FORSALE: pa.schema(BASE_FIELDS),
+    consts.PROPERTY_TYPE_TORENT: pa.schema(BASE_FIELDS + [
+        ("payment_frequency", pa.string()),
+        ("is_house_share", pa.bool_()),
+        ("inclusive_bills", pa.bool_()),
+    ]),
+}
+# fields of the stored listings read by the parsers
+SOURCE_FIELDS = ["id", "propertyUrl", "location", "featuredProperty", "propertyTypeFullDescription", "bedrooms",
+                 "customer", "displayAddress", "price", "displayStatus", "propertySubType", "summary"]
+
+LOGGER = get_logger("rightmove_export")
+
+
+def flatten(docs, property_type):
+    """
+    Flatten listings with their retrieval metadata joined in (see store.ListingStore.find) into export rows.
+    Listings whose type we don't track, or that can't be parsed, are left out.
+    :return: Tuple (list of row dictionaries, number of listings left out).
+    """
+    rows = []
+    n_skipped = 0
+    for doc, (obj, error) in zip(docs, parser.parse_search_result_batch(docs, property_type)):
+        if obj is None or error.get("FAILED"):
+            n_skipped += 1
+            continue
+        meta = doc.get(retrieval_meta.META_FIELD) or {}
+        loc = obj.pop("location")
+        obj.pop("property_type")
+        row = dict(
+            property_id=doc.get("id"),
+            url=consts.BASE_URL + doc["propertyUrl"] if doc.get("propertyUrl") else None,
+            outcode=meta.get("outcode"),
+            outcode_postcode=meta.get("outcode_postcode"),
+            timestamp=meta.get("timestamp"),
+            lat=loc["lat"],
+            lon=loc["lon"],
+            parse_error=json.dumps(error, sort_keys=True) if len(error) else None,
+            **obj
+        )
+        rows.append(row)
+    return rows, n_skipped
+
+
+class ParquetExporter(object):
+    """
+    Writes the listings of one property type to the partitioned dataset under `root`.
+    :param db: pymongo database.
+    """
+    def __init__(self, db, property_type, root=DEFAULT_EXPORT_ROOT, compression=DEFAULT_COMPRESSION,
+                 chunk_size=store.DEFAULT_CHUNK_SIZE):
+        if root is None:
+            raise ValueError("No export root given; set export.root in the config or pass --root.")
+        self.db = db
+        self.property_type = property_type
+        self.root = root
+        self.compression = compression
+        self.schema = SCHEMAS[property_type]
+        self.listings = store.ListingStore(db, property_type, chunk_size=chunk_size)
+
+    @property
+    def type_path(self):
+        return os.path.join(self.root, f"property_type={consts.PROPERTY_TYPE_MAP[self.property_type]}")
+
+    def partition_path(self, crawl_date):
+        return os.path.join(self.type_path, f"crawl_date={crawl_date}")
+
+    def exported_dates(self):
+        """
+        :return: Set of the crawl dates (ISO format strings) already in the dataset.
+        """
+        if not os.path.isdir(self.type_path):
+            return set()
+        return {
+            name.split("=", 1)[1] for name in os.listdir(self.type_path)
+            if name.startswith("crawl_date=") and os.path.isfile(os.path.join(self.type_path, name, PART_FILENAME))
+        }
+
+    def crawl_dates(self):
+        """
+        :return: Sorted list of the crawl dates with stored listings, from the retrieval metadata.
+        """
+        return sorted(self.db[retrieval_meta.META_COLLECTION].distinct(
+            "run_date", {"property_type": self.property_type}
+        ))
+
+    def pending_dates(self, include_today=False):
+        """
+        :param include_today: If False, today's crawl date is left out, as its crawl may still be running.
+        :return: Sorted list of the crawl dates not exported yet.
+        """
+        today = datetime.now(pytz.timezone(TIMEZONE)).date().isoformat()
+        exported = self.exported_dates()
+        return [d for d in self.crawl_dates() if d not in exported and (include_today or d < today)]
+
+    def export_date(self, crawl_date):
+        """
+        Write (or replace) the partition of one crawl date, one row group per chunk of listings.
+        :return: Number of rows written.
+        """
+        path = self.partition_path(crawl_date)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        n_rows = 0
+        n_skipped = 0
+        try:
+            with pq.ParquetWriter(os.path.join(tmp_path, PART_FILENAME), self.schema,
+                                  compression=self.compression) as writer:
+                docs = self.listings.find(start=crawl_date, end=crawl_date, fields=SOURCE_FIELDS)
+                for chunk in self.listings.chunks(docs):
+                    rows, skipped = flatten(chunk, self.property_type)
+                    n_skipped += skipped
+                    if len(rows) > 0:
+                        writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+                        n_rows += len(rows)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        LOGGER.info("Exported %d listings of %s crawled on %s (%d left out).", n_rows,
+                    consts.PROPERTY_TYPE_MAP[self.property_type], crawl_date, n_skipped)
+        return n_rows
+
+    def run(self, dates=None, include_today=False):
+        """
+        :param dates: Optional list of crawl dates to export, replacing their partitions if they exist. By default,
+        all the crawl dates not exported yet.
+        :return: Dictionary of crawl date -> number of rows written.
+        """
+        if dates is None:
+            dates = self.pending_dates(include_today=include_today)
+        if len(dates) == 0:
+            LOGGER.info("Nothing to export for %s.", consts.PROPERTY_TYPE_MAP[self.property_type])
+        return {d: self.export_date(d) for d in dates}
+
+
+def main(argv=None):
+    from rightmove import worker
+    argparser = argparse.ArgumentParser(
+        description="Export the stored listings to a Parquet dataset partitioned by property type and crawl date. "
+                    "Only crawl dates not exported yet are written, unless --date is given."
+    )
+    argparser.add_argument("--root", default=DEFAULT_EXPORT_ROOT, help="Root directory of the dataset.")
+    argparser.add_argument("--property-type", choices=["for-sale", "to-rent"], action="append",
+                           help="Property type to export (default: both).")
+    argparser.add_argument("--date", action="append",
+                           help="Crawl date (YYYY-MM-DD) to export, replacing it if it was exported already.")
+    argparser.add_argument("--include-today", action="store_true",
+                           help="Also export today's crawl date, even though its crawl may not have finished.")
+    argparser.add_argument("--compression", default=DEFAULT_COMPRESSION)
+    argparser.add_argument("--chunk-size", type=int, default=store.DEFAULT_CHUNK_SIZE)
+    args = argparser.parse_args(argv)
+
+    property_types = {
+        "for-sale": consts.PROPERTY_TYPE_FORSALE,
+        "to-rent": consts.PROPERTY_TYPE_TORENT,
+    }
+    db = worker.mongo_connection()
+    for name in args.property_type or list(property_types):
+        exporter = ParquetExporter(db, property_types[name], root=args.root, compression=args.compression,
+                                   chunk_size=args.chunk_size)
+        exporter.run(dates=args.date, include_today=args.include_today)
@@ -1,10 +1,12 @@
-import requests
-from bs4 import BeautifulSoup
 from rightmove import parser, consts
 from core import get_logger
-from time import sleep
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from config import cfg
 
 logger = get_logger("rightmove_getter")
+PER_PAGE = 48
+DEFAULT_PAGE_FANOUT = cfg.get("crawler", {}).get("page_fanout", 1)
 
 def _links_from_search(soup, base_url):
     results = soup.find_all('a', attrs={'class': "propertyCard-headerLink"})
@@ -20,9 +22,11 @@ def get_links_one_outcode(outcode_int, find_url, requester=None, per_page=48, in
     """
     :param index: If supplied, this is the pagination parameter. This allows recursive calling.
     """
+    from bs4 import BeautifulSoup
     outcode = "OUTCODE^%d" % outcode_int
     base_url = "http://www.rightmove.co.uk"
     if requester is None:
+        import requests
         requester = requests
     payload = {
         'locationIdentifier': outcode,
@@ -64,7 +68,7 @@ def get_links_one_outcode(outcode_int, find_url, requester=None, per_page=48, in
     return urls
 
 
-def outcode_search_payload(outcode_int, index=None, per_page=48, include_sstc=True):
+def outcode_search_payload(outcode_int, index=None, per_page=PER_PAGE, include_sstc=True):
     """
     :param index: If supplied, this is the pagination parameter. This allows recursive calling.
     """
@@ -81,58 +85,182 @@ def outcode_search_payload(outcode_int, index=None, per_page=48, include_sstc=Tr
     return payload
 
 
-def _run_outcode_search(outcode_int, find_url, requester, payload, retries=1, sec_between_retry=10):
-    try_count = 1
+def _run_outcode_search(outcode_int, find_url, requester, payload):
+    """
+    Fetch one page of search results. Transient failures (429, 5xx, connection errors) are retried by the requester,
+    with backoff; anything still failing here is raised.
+    :return: parser.SearchPage, not decoded yet, so that decoding can be left to the consumer (e.g. a ParsePool).
+    """
+    import requests
     resp = requester.get(find_url, params=payload)
-    while try_count <= retries:
+    if not resp.ok:
+        logger.error(
+            "Failed to get data for outcode %d at URL %s with status %d. Error: %s",
+            outcode_int, find_url, resp.status_code, resp.content
+        )
+        raise requests.exceptions.RequestException(
+            "Failed to get data for outcode %d: status %d" % (outcode_int, resp.status_code), response=resp
+        )
+    return parser.SearchPage(resp.content, index=payload.get('index', 0))
+
+
+def _get_page(outcode_int, find_url, requester, per_page, index):
+    payload = outcode_search_payload(outcode_int, per_page=per_page, index=index)
+    return _run_outcode_search(outcode_int, find_url, requester, payload)
+
+
+def _prefetch_pages(outcode_int, find_url, requester, per_page, indexes, fanout, failed_indexes=None):
+    """
+    Fetch pages concurrently, with at most `fanout` requests in flight, and yield them in pagination order.
+    A failed page is logged (and added to `failed_indexes`, if supplied) and skipped without holding up the others.
+    """
+    indexes = iter(indexes)
+    window = collections.deque()
+    with ThreadPoolExecutor(max_workers=fanout) as executor:
+        try:
+            while True:
+                # keep a few pages queued beyond those in flight, so a slow page doesn't leave the pool idle
+                while len(window) < 2 * fanout:
+                    i = next(indexes, None)
+                    if i is None:
+                        break
+                    window.append((i, executor.submit(_get_page, outcode_int, find_url, requester, per_page, i)))
+                if len(window) == 0:
+                    break
+                i, fut = window.popleft()
+                try:
+                    page = fut.result()
+                except Exception:
+                    logger.exception("Failed to get page of results for outcode %d with index %d", outcode_int, i)
+                    if failed_indexes is not None:
+                        failed_indexes.append(i)
+                    continue
+                yield page
+        finally:
+            # the consumer may stop early
+            for _, fut in window:
+                fut.cancel()
+
+
+def pages_generator(outcode_int, find_url, requester, indexes, per_page=PER_PAGE, fanout=DEFAULT_PAGE_FANOUT,
+                    failed_indexes=None):
+    """
+    Generator yielding a parser.SearchPage for each of the given pagination indexes of one outcode, in order.
+    Pages that fail are logged and skipped.
+    :param failed_indexes: Optional list, to which the index of each page that failed is appended.
+    """
+    indexes = list(indexes)
+    if fanout > 1 and len(indexes) > 1:
+        yield from _prefetch_pages(outcode_int, find_url, requester, per_page, indexes, fanout,
+                                   failed_indexes=failed_indexes)
+        return
+
+    for i in indexes:
         try:
-            resp.raise_for_status()
+            page = _get_page(outcode_int, find_url, requester, per_page, i)
         except Exception:
-            logger.error(
-                "Failed to get data for outcode %d at URL %s on try %d. Error: %s",
-                outcode_int, find_url, try_count, resp.content
-            )
-            try_count += 1
-            sleep(sec_between_retry)
+            logger.exception("Failed to get page of results for outcode %d with index %d", outcode_int, i)
+            if failed_indexes is not None:
+                failed_indexes.append(i)
             continue
-        else:
-            soup = BeautifulSoup(resp.content, "html.parser")
-            dat = parser.parse_search_results(soup)
-            nres = int(dat['pagination']['last'].strip().replace(',', ''))
-            return soup, nres
-    raise requests.exceptions.RequestException("Failed to get data for outcode %d" % outcode_int)
+        yield page
 
 
-def outcode_search_generator(outcode_int, find_url, requester=None, per_page=48):
+def outcode_search_generator(outcode_int, find_url, requester=None, per_page=PER_PAGE, skip_indexes=None,
+                             fanout=DEFAULT_PAGE_FANOUT, failed_indexes=None):
     """
-    :param index: If supplied, this is the pagination parameter. This allows recursive calling.
+    Generator yielding a parser.SearchPage for each page of search results for one outcode, in pagination order.
+    :param skip_indexes: Optional collection of pagination indexes that should not be yielded, e.g. pages already
+    stored by an interrupted run. The first page is always requested, since it gives the number of results.
+    :param fanout: Once the number of pages is known, up to this many of the remaining pages are fetched
+    concurrently (all through the same requester, so the same limits apply).
+    :param failed_indexes: Optional list, to which the index of each page after the first that failed is appended,
+    so that those pages can be retried on their own. If the first page fails, the exception is raised.
     """
     if requester is None:
         logger.info("No requester specified, so we will run without request limits.")
+        import requests
         requester = requests
+    skip_indexes = set(skip_indexes or ())
     payload = outcode_search_payload(outcode_int, per_page=per_page)
     try:
-        soup, nres = _run_outcode_search(outcode_int, find_url, requester, payload)
+        page = _run_outcode_search(outcode_int, find_url, requester, payload)
+        # only the first page is decoded here, for the number of results
+        nres = page.last_index
         indexes = range(per_page, nres + 1, per_page)  # add one to include final page
-        yield soup
     except Exception:
         logger.exception("Failed to get initial results for outcode %d.", outcode_int)
         raise
+    if 0 not in skip_indexes:
+        yield page
 
-    for i in indexes:
-        payload = outcode_search_payload(outcode_int, per_page=per_page, index=i)
+    indexes = [i for i in indexes if i not in skip_indexes]
+    yield from pages_generator(outcode_int, find_url, requester, indexes, per_page=per_page, fanout=fanout,
+                               failed_indexes=failed_indexes)
+
+
+async def _run_outcode_search_async(outcode_int, find_url, requester, payload):
+    resp = await requester.get(find_url, params=payload)
+    if resp.status != 200:
+        logger.error(
+            "Failed to get data for outcode %d at URL %s with status %d. Error: %s",
+            outcode_int, find_url, resp.status, resp.body
+        )
+        resp.raise_for_status()
+    return parser.SearchPage(resp.body, index=payload.get('index', 0))
+
+
+async def async_outcode_search_generator(outcode_int, find_url, requester=None, per_page=PER_PAGE):
+    """
+    asyncio counterpart of outcode_search_generator. Once the first page has given the number of results, the
+    remaining pages are all requested at once (the requester's limiter paces them) and yielded as they arrive, so
+    they are not necessarily in order.
+    :param requester: core.async_requester.AsyncRequester. If not supplied, one without limits is used.
+    """
+    import asyncio
+    close_requester = False
+    if requester is None:
+        from core.async_requester import AsyncRequester
+        logger.info("No requester specified, so we will run without request limits.")
+        requester = AsyncRequester()
+        close_requester = True
+
+    try:
+        payload = outcode_search_payload(outcode_int, per_page=per_page)
         try:
-            soup, nres = _run_outcode_search(outcode_int, find_url, requester, payload)
-            yield soup
+            page = await _run_outcode_search_async(outcode_int, find_url, requester, payload)
+            nres = page.last_index
         except Exception:
-            logger.exception("Failed to get page of results for outcode %d with index %d", outcode_int, i)
+            logger.exception("Failed to get initial results for outcode %d.", outcode_int)
+            raise
+        yield page
+
+        async def get_page(i):
+            payload = outcode_search_payload(outcode_int, per_page=per_page, index=i)
+            try:
+                return await _run_outcode_search_async(outcode_int, find_url, requester, payload)
+            except Exception:
+                logger.exception("Failed to get page of results for outcode %d with index %d", outcode_int, i)
+
+        tasks = [asyncio.ensure_future(get_page(i)) for i in range(per_page, nres + 1, per_page)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                page = await fut
+                if page is not None:
+                    yield page
+        finally:
+            for t in tasks:
+                t.cancel()
+    finally:
+        if close_requester:
+            await requester.close()
 
 
 def search_one_outcode(outcode, property_type, requester=None):
     find_url = consts.FIND_URLS[property_type]
-    for i, soup in enumerate(outcode_search_generator(outcode, find_url, requester=requester)):
+    for i, page in enumerate(outcode_search_generator(outcode, find_url, requester=requester)):
         try:
-            yield parser.parse_from_soup(soup, property_type=property_type)
+            yield parser.parse_from_soup(page, property_type=property_type)
         except Exception:
             logger.exception("Failed to parse page %d of results for outcode %d.", i, outcode)
             raise
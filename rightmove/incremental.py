@@ -0,0 +1,113 @@
+"""
+Change detection for incremental crawls. Each listing is identified by its Rightmove property ID and summarised by a
+fingerprint of the fields we care about. A state collection (one per property type) holds the latest fingerprint for
+every property, so only new or changed listings need to be written in full; unchanged listings just have their
+`last_seen` time updated.
+"""
+import hashlib
+import json
+import collections
+from rightmove import consts
+
+FINGERPRINT_FIELDS = (
+    "price",
+    "displayStatus",
+    "propertyTypeFullDescription",
+    "propertySubType",
+    "bedrooms",
+    "bathrooms",
+    "summary",
+    "displayAddress",
+    "location",
+    "customer",
+    "listingUpdate",
+)
+
+STATUS_NEW = "new"
+STATUS_CHANGED = "changed"
+STATUS_UNCHANGED = "unchanged"
+
+
+def state_collection_name(property_type):
+    return consts.PROPERTY_TYPE_MAP[property_type] + "-state"
+
+
+def listing_fingerprint(attr, fields=FINGERPRINT_FIELDS):
+    """
+    :param attr: Listing dictionary, as generated from parser.property_array_from_search
+    :return: Hex digest of the fingerprinted fields.
+    """
+    dat = [attr.get(k) for k in fields]
+    return hashlib.sha1(json.dumps(dat, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def detect_changes(state_coll, attr_arr, seen=None):
+    """
+    Compare a batch of listings against the stored fingerprints.
+    :param state_coll: pymongo collection holding the fingerprint state.
+    :param attr_arr: List of listing dictionaries.
+    :param seen: Optional set of the property IDs in earlier batches of the same retrieval, updated in-place. Listings
+    already seen are skipped, since the state of earlier batches may not have been written yet (e.g. a featured
+    listing shown on two pages of one outcode, stored by the background writer).
+    :return: to_write, fingerprints, counts
+    to_write: the listings that are new or changed. Listings without a property ID are always written.
+    fingerprints: dictionary, keyed by property ID, with values (fingerprint, status).
+    counts: collections.Counter of statuses.
+    """
+    if seen is None:
+        seen = set()
+    ids = [attr["id"] for attr in attr_arr if attr.get("id") is not None and attr["id"] not in seen]
+    known = {}
+    if len(ids) > 0:
+        known = {d["_id"]: d["fingerprint"] for d in state_coll.find({"_id": {"$in": ids}}, {"fingerprint": 1})}
+
+    to_write = []
+    fingerprints = {}
+    counts = collections.Counter()
+    for attr in attr_arr:
+        pid = attr.get("id")
+        if pid is None:
+            to_write.append(attr)
+            counts[STATUS_NEW] += 1
+            continue
+        if pid in fingerprints or pid in seen:
+            # the same listing can appear more than once in a retrieval (e.g. featured properties)
+            continue
+        fp = listing_fingerprint(attr)
+        if pid not in known:
+            status = STATUS_NEW
+        elif known[pid] != fp:
+            status = STATUS_CHANGED
+        else:
+            status = STATUS_UNCHANGED
+        fingerprints[pid] = (fp, status)
+        counts[status] += 1
+        if status != STATUS_UNCHANGED:
+            to_write.append(attr)
+    seen.update(fingerprints)
+
+    return to_write, fingerprints, counts
+
+
+def state_updates(fingerprints, now):
+    """
+    Build the write operations needed to bring the state collection up to date after a batch has been stored.
+    :param fingerprints: As returned by detect_changes.
+    :param now: Timestamp of the retrieval.
+    :return: List of pymongo write operations, for use with `bulk_write`.
+    """
+    from pymongo import UpdateOne, UpdateMany
+    ops = []
+    unchanged = []
+    for pid, (fp, status) in fingerprints.items():
+        if status == STATUS_UNCHANGED:
+            unchanged.append(pid)
+        else:
+            ops.append(UpdateOne(
+                {"_id": pid},
+                {"$set": {"fingerprint": fp, "last_seen": now, "last_changed": now}, "$setOnInsert": {"first_seen": now}},
+                upsert=True
+            ))
+    if len(unchanged) > 0:
+        ops.append(UpdateMany({"_id": {"$in": unchanged}}, {"$set": {"last_seen": now}}))
+    return ops
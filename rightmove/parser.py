@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import re
 import json
+import functools
+from core import metrics
 from rightmove import consts
 
 NOT_PROPERTY = {
@@ -39,16 +41,107 @@ STATION_TYPE_MAP = {
     "icon-london-overground": consts.STATION_TYPE_OVERGROUND,
 }
 
+DESCRIPTION_CACHE_SIZE = 4096
+
 removed_re = re.compile(r'This property has been removed by the agent', flags=re.I)
 situation_re = re.compile("(?P<t>%s)" % "|".join(BUILDING_SITUATION_MAP.keys()), flags=re.I)
 type_re = re.compile("(?P<t>%s)" % "|".join(BUILDING_TYPE_MAP.keys()), flags=re.I)
 not_property_re = re.compile("(?P<t>%s)" % "|".join(NOT_PROPERTY), flags=re.I)
 latlng_re = re.compile(r"latitude=(?P<lat>[-0-9\.]*).*longitude=(?P<lng>[-0-9\.]*)")
 
+for_sale_re = re.compile(' for sale.*$')
+bedroom_re = re.compile('[1-9]* bedroom *')
+retirement_re = re.compile('retirement')
+studio_re = re.compile('studio', flags=re.I)
+house_share_re = re.compile('house share', flags=re.I)
+
 rent_bills_incl = re.compile(r"(?<!part )bills inclu[^ ]* +(?!for)", flags=re.I)
 
 
+JSON_MODEL_MARKER = b"window.jsonModel = "
+PAGE_DECODE_SECONDS = metrics.histogram(
+    "page_decode_seconds", "Time taken to extract and decode the JSON model of a search page."
+)
+PAGE_SIZE_BYTES = metrics.histogram(
+    "page_size_bytes", "Size of the raw search pages.", buckets=metrics.SIZE_BUCKETS
+)
+PARSE_SECONDS = metrics.histogram(
+    "parse_seconds", "Time taken to parse a batch of listings.", ("property_type",)
+)
+PARSE_ERRORS = metrics.counter("parse_errors_total", "Listings that failed to parse.", ("property_type",))
+_json_decoder = json.JSONDecoder()
+
+
+def extract_json_model(content, encoding="utf-8"):
+    """
+    Extract the `window.jsonModel` object embedded in a search page straight from the raw response bytes, without
+    building a DOM.
+    :param content: Response body (bytes).
+    :param encoding: Encoding of the response body.
+    :return: Decoded JSON model (dict).
+    """
+    start = content.find(JSON_MODEL_MARKER)
+    if start == -1:
+        raise ValueError("No window.jsonModel found in the page content.")
+    start += len(JSON_MODEL_MARKER)
+    end = content.find(b"</script>", start)
+    if end == -1:
+        end = len(content)
+    dat, _ = _json_decoder.raw_decode(content[start:end].decode(encoding).strip())
+    return dat
+
+
+class SearchPage(object):
+    """
+    One page of search results. The embedded JSON model is decoded from the raw content on first access and cached,
+    so pagination and properties are read from a single decode.
+    """
+    def __init__(self, content, index=None, encoding="utf-8"):
+        """
+        :param content: Response body (bytes).
+        :param index: The pagination index used to request this page (zero for the first page).
+        :param encoding: Encoding of the response body.
+        """
+        self.content = content
+        self.index = index
+        self.encoding = encoding
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            PAGE_SIZE_BYTES.observe(len(self.content))
+            with PAGE_DECODE_SECONDS.time():
+                self._model = extract_json_model(self.content, encoding=self.encoding)
+        return self._model
+
+    @property
+    def is_decoded(self):
+        return self._model is not None
+
+    @property
+    def properties(self):
+        return self.model['properties']
+
+    @property
+    def pagination(self):
+        return self.model['pagination']
+
+    @property
+    def last_index(self):
+        """
+        The pagination index of the final page of results.
+        """
+        return int(str(self.pagination['last']).strip().replace(',', ''))
+
+
 def parse_search_results(soup):
+    """
+    :param soup: Either a SearchPage or a BeautifulSoup parsed object.
+    :return: Decoded JSON model.
+    """
+    if isinstance(soup, SearchPage):
+        return soup.model
     el = soup.find('script', text=re.compile(r'window\.jsonModel = '))
     dat = json.loads(re.sub(r'^[^ ]* = ', '', el.contents[0]))
     return dat
@@ -59,37 +152,25 @@ def property_array_from_search(soup):
     return dat['properties']
 
 
-def parse_search_result_base(attr, property_type):
+@functools.lru_cache(maxsize=DESCRIPTION_CACHE_SIZE)
+def classify_description(description):
     """
-    Base function to parse essential results.
-    :param attr: As generated from property_array_from_search
-    :return:
+    Classify a listing from its `propertyTypeFullDescription`. There are only a few hundred distinct descriptions, so
+    the results are cached.
+    :param description: The full description string, e.g. "3 bedroom semi-detached house for sale".
+    :return: building_type, building_situation, is_studio, is_retirement, error
+    `is_studio` indicates that the number of bedrooms should be taken as one.
+    `error` is a tuple of (key, value) pairs, to keep the cached result immutable.
     """
     error = {}
-
-    # WGS84 coordinates
-    loc = {
-        "lat": attr['location']['latitude'],
-        "lon": attr['location']['longitude']
-    }
-
-    featured = attr['featuredProperty']
-
     building_type = None
     building_situation = None
 
-    prop = attr['propertyTypeFullDescription']
-    prop = re.sub(' for sale.*$', '', prop)
-    prop = re.sub('[1-9]* bedroom *', '', prop)
-
-    is_retirement = False
-    if re.search('retirement', prop):
-        is_retirement = True
+    prop = re.sub(for_sale_re, '', description)
+    prop = re.sub(bedroom_re, '', prop)
 
-    if re.search('studio', prop, flags=re.I):
-        n_bed = 1
-    else:
-        n_bed = int(attr['bedrooms'])
+    is_retirement = re.search(retirement_re, prop) is not None
+    is_studio = re.search(studio_re, prop) is not None
 
     sit = re.search(situation_re, prop)
     if sit:
@@ -122,6 +203,32 @@ def parse_search_result_base(attr, property_type):
         error['failure_reason'] = 'Cannot identify building type'
         error['building_type'] = prop
 
+    return building_type, building_situation, is_studio, is_retirement, tuple(error.items())
+
+
+def parse_search_result_base(attr, property_type):
+    """
+    Base function to parse essential results.
+    :param attr: As generated from property_array_from_search
+    :return:
+    """
+    # WGS84 coordinates
+    loc = {
+        "lat": attr['location']['latitude'],
+        "lon": attr['location']['longitude']
+    }
+
+    featured = attr['featuredProperty']
+
+    building_type, building_situation, is_studio, is_retirement, error = classify_description(
+        attr['propertyTypeFullDescription']
+    )
+    error = dict(error)
+    if is_studio:
+        n_bed = 1
+    else:
+        n_bed = int(attr['bedrooms'])
+
     this = dict(
         property_type=property_type,
         featured=featured,
@@ -148,15 +255,49 @@ def parse_residential_for_sale_result(attr):
 def parse_residential_rent_result(attr):
     this, e = parse_search_result_base(attr, property_type=consts.PROPERTY_TYPE_TORENT)
     this['payment_frequency'] = attr['price']['frequency']
-    this['is_house_share'] = (re.search('house share', attr['propertySubType'], flags=re.I) is not None)
+    this['is_house_share'] = (re.search(house_share_re, attr['propertySubType']) is not None)
     this['inclusive_bills'] = (re.search(rent_bills_incl, attr['summary']) is not None)
 
     return this, e
 
 
+RESULT_PARSERS = {
+    consts.PROPERTY_TYPE_FORSALE: parse_residential_for_sale_result,
+    consts.PROPERTY_TYPE_TORENT: parse_residential_rent_result,
+}
+
+
+def parse_search_result_batch(attr_arr, property_type):
+    """
+    Parse a batch of listings of one property type, e.g. a page or a whole outcode. Each listing gives the same result
+    as the matching per-listing parser; descriptions are classified once per distinct string.
+    :param attr_arr: Iterable of listing dictionaries, as generated from property_array_from_search
+    :param property_type: consts.PROPERTY_TYPE integer.
+    :return: List of (obj, error) tuples in the same order as attr_arr. If parsing a listing raised an exception,
+    obj is None and error is the repr of the exception.
+    """
+    if property_type not in RESULT_PARSERS:
+        raise NotImplementedError("Property type not supported.")
+    parse_func = RESULT_PARSERS[property_type]
+
+    out = []
+    n_errors = 0
+    ptype_label = consts.PROPERTY_TYPE_MAP.get(property_type, property_type)
+    with PARSE_SECONDS.time(property_type=ptype_label):
+        for attr in attr_arr:
+            try:
+                out.append(parse_func(attr))
+            except Exception as exc:
+                out.append((None, repr(exc)))
+                n_errors += 1
+    if n_errors > 0:
+        PARSE_ERRORS.inc(n_errors, property_type=ptype_label)
+    return out
+
+
 def parse_from_soup(soup, property_type):
     """
-    :param soup: BeautifulSoup parsed object.
+    :param soup: SearchPage or BeautifulSoup parsed object.
     :param property_type: consts.PROPERTY_TYPE integer. THIs is used to define the parser.
     :return: res, errors
     res: list of tuples, each is (url_string, deferred object)
@@ -165,28 +306,17 @@ def parse_from_soup(soup, property_type):
     Parse a page of search results from the soup.
     """
 
-    parser_lookup = {
-        consts.PROPERTY_TYPE_FORSALE: parse_residential_for_sale_result,
-        consts.PROPERTY_TYPE_TORENT: parse_residential_rent_result,
-    }
-    if property_type not in parser_lookup:
-        raise NotImplementedError("Property type not supported.")
-    parse_func = parser_lookup[property_type]
-
+    attr_arr = property_array_from_search(soup)
     res = []
     errors = {}
 
-    for attr in property_array_from_search(soup):
+    for attr, (obj, e) in zip(attr_arr, parse_search_result_batch(attr_arr, property_type)):
         url = consts.BASE_URL + attr['propertyUrl']
-        try:
-            obj, e = parse_func(attr)
-            if len(e):
-                errors[url] = e
-            else:
-                res.append(
-                    (url, obj)
-                )
-        except Exception as exc:
-            errors[url] = repr(exc)
+        if len(e):
+            errors[url] = e
+        else:
+            res.append(
+                (url, obj)
+            )
 
     return res, errors
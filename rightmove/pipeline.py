@@ -0,0 +1,134 @@
+import collections
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config import cfg
+from core import get_logger
+from rightmove import parser
+
+CRAWLER_CFG = cfg.get("crawler", {})
+DEFAULT_PARSE_PROCESSES = CRAWLER_CFG.get("parse_processes", 0)
+DEFAULT_PARSE_WINDOW = CRAWLER_CFG.get("parse_window", 4)
+
+LOGGER = get_logger("rightmove_pipeline")
+
+
+def tag_listing(attr, meta):
+    """
+    Add retrieval metadata (normally a reference, see rightmove.retrieval_meta) to a listing dictionary in-place.
+    """
+    if "__retrieval_meta" in attr:
+        LOGGER.warning(
+            "attr dict already contains __retrieval_meta: %s",
+            str(attr)
+        )
+    else:
+        attr["__retrieval_meta"] = {}
+    attr["__retrieval_meta"].update(meta)
+
+
+def decode_page(content, encoding="utf-8", meta=None):
+    """
+    Decode the listings of one raw search page and tag them with retrieval metadata. Runs in the parser processes.
+    :return: Tuple of (listings, last pagination index, decode time in seconds).
+    """
+    t0 = time.perf_counter()
+    page = parser.SearchPage(content, encoding=encoding)
+    attr_arr = page.properties
+    last_index = page.last_index
+    elapsed = time.perf_counter() - t0
+    if meta is not None:
+        for attr in attr_arr:
+            tag_listing(attr, meta)
+    return attr_arr, last_index, elapsed
+
+
+class DecodedPage(object):
+    """
+    Result of decoding a page in a parser process. Has the attributes of parser.SearchPage used when storing pages.
+    """
+    def __init__(self, index, properties, last_index, tagged):
+        self.index = index
+        self.properties = properties
+        self.last_index = last_index
+        self.tagged = tagged
+
+
+class ParsePool(object):
+    """
+    Pool of processes decoding raw search pages, so that JSON decoding and tagging run on other cores than the
+    threads making requests. At most `max_pending` pages are queued or being decoded at once, over all callers;
+    `submit` blocks when the queue is full, which holds back the fetchers.
+    Processes are started with the "spawn" method, since the crawl forks from a process already running threads.
+    """
+    def __init__(self, processes=DEFAULT_PARSE_PROCESSES, max_pending=None):
+        self.processes = processes
+        self.max_pending = max_pending or 2 * processes
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        LOGGER.info("Started %d parser processes.", self.processes)
+        return self
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, content, encoding="utf-8", meta=None):
+        """
+        Queue a raw page for decoding, blocking while the queue is full.
+        :return: concurrent.futures.Future of the result of `decode_page`.
+        """
+        self._slots.acquire()
+        try:
+            fut = self._executor.submit(decode_page, content, encoding, meta)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def decode_pages(self, pages, meta=None, window=DEFAULT_PARSE_WINDOW):
+        """
+        Decode search pages in the pool, with up to `window` pages of this iterable in flight at once, and yield
+        them in the original order as DecodedPage. Pages already decoded in this process (e.g. the first page of an
+        outcode, which gives the number of results) are yielded as they are, untagged.
+        :param pages: Iterable of parser.SearchPage.
+        :param meta: Retrieval metadata reference added to each listing decoded in the pool.
+        """
+        pending = collections.deque()
+
+        def pop():
+            page, fut = pending.popleft()
+            if fut is None:
+                return page
+            attr_arr, last_index, elapsed = fut.result()
+            parser.PAGE_SIZE_BYTES.observe(len(page.content))
+            parser.PAGE_DECODE_SECONDS.observe(elapsed)
+            return DecodedPage(page.index, attr_arr, last_index, tagged=meta is not None)
+
+        try:
+            for page in pages:
+                fut = None
+                if not page.is_decoded:
+                    fut = self.submit(page.content, encoding=page.encoding, meta=meta)
+                pending.append((page, fut))
+                while len(pending) > window or (len(pending) > 0 and pending[0][1] is None):
+                    yield pop()
+            while len(pending) > 0:
+                yield pop()
+        finally:
+            for _, fut in pending:
+                if fut is not None:
+                    fut.cancel()
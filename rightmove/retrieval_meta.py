@@ -0,0 +1,187 @@
+"""
+Retrieval metadata (who fetched a listing, when, with which version, for which outcode) is stored once per outcode
+retrieval in the `retrieval_meta` collection. Each listing only carries a reference to it:
+`{"__retrieval_meta": {"id": <ObjectId>}}`. Listings written before this change embed the whole metadata dictionary;
+`join_meta` reads both forms, and `migrate_collection` converts the old form to the new one.
+"""
+import argparse
+import itertools
+from datetime import datetime
+import pytz
+from config import cfg
+from core import get_logger
+from rightmove import consts
+
+TIMEZONE = cfg["env"].get("timezone", "utc")
+META_COLLECTION = "retrieval_meta"
+META_FIELD = "__retrieval_meta"
+DEFAULT_BATCH_SIZE = 1000
+
+# fields identifying one retrieval of one outcode, used to group the embedded metadata of existing listings
+KEY_FIELDS = ("user_agent", "request_from", "version", "outcode", "property_type", "outcode_postcode",
+              "replayed_from", "run_date")
+
+LOGGER = get_logger("rightmove_retrieval_meta")
+
+
+def new_meta(timestamp, **fields):
+    """
+    :param timestamp: Time of retrieval (timezone-aware datetime).
+    :param fields: Any other metadata, e.g. user_agent, outcode.
+    :return: Metadata document with a new _id, ready to insert.
+    """
+    from bson import ObjectId
+    doc = {"_id": ObjectId(), "timestamp": timestamp}
+    doc.setdefault("run_date", timestamp.date().isoformat())
+    doc.update(fields)
+    return doc
+
+
+def meta_ref(meta_id):
+    """
+    :return: Value of the `__retrieval_meta` field of a listing referring to the metadata document `meta_id`.
+    """
+    return {"id": meta_id}
+
+
+def join_meta(db, docs, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Replace the metadata reference of each listing with the full metadata dictionary, as stored before metadata
+    was normalised. Listings that embed their metadata already are passed through unchanged.
+    :param db: pymongo database.
+    :param docs: Iterable of listing documents, e.g. a cursor.
+    :return: Generator of listing documents, in the same order.
+    """
+    cache = {}
+    docs = iter(docs)
+    while True:
+        batch = list(itertools.islice(docs, batch_size))
+        if len(batch) == 0:
+            return
+        missing = {
+            d[META_FIELD]["id"] for d in batch
+            if isinstance(d.get(META_FIELD), dict) and "id" in d[META_FIELD] and d[META_FIELD]["id"] not in cache
+        }
+        if len(missing) > 0:
+            for meta in db[META_COLLECTION].find({"_id": {"$in": list(missing)}}):
+                cache[meta.pop("_id")] = meta
+        for d in batch:
+            ref = d.get(META_FIELD)
+            if isinstance(ref, dict) and "id" in ref:
+                meta = cache.get(ref["id"])
+                if meta is None:
+                    LOGGER.warning("Retrieval metadata %s of listing %s not found.", ref["id"], d.get("_id"))
+                else:
+                    d[META_FIELD] = dict(meta)
+            yield d
+
+
+def find_with_meta(db, collection_name, *args, **kwargs):
+    """
+    Equivalent of `db[collection_name].find(*args, **kwargs)` yielding listings with their full metadata.
+    """
+    return join_meta(db, db[collection_name].find(*args, **kwargs))
+
+
+def _local_date(ts):
+    """
+    :param ts: datetime, in UTC if naive (as pymongo returns it unless the client is tz_aware).
+    :return: The date of `ts` in the crawler's timezone, as for the run dates of new metadata.
+    """
+    if ts.tzinfo is None:
+        ts = pytz.utc.localize(ts)
+    return ts.astimezone(pytz.timezone(TIMEZONE)).date()
+
+
+def _meta_key(meta):
+    ts = meta.get("timestamp")
+    run_date = meta.get("run_date")
+    if run_date is None and isinstance(ts, datetime):
+        run_date = _local_date(ts).isoformat()
+    return tuple(meta.get(k) if k != "run_date" else run_date for k in KEY_FIELDS)
+
+
+def migrate_collection(db, collection_name, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Move the metadata embedded in every listing of a collection to the metadata collection. Listings retrieved for
+    the same outcode on the same day by the same crawler share one metadata document, whose `timestamp` and
+    `timestamp_last` are the first and last of their timestamps. Safe to interrupt and re-run: each listing is
+    updated once its metadata document exists, and existing metadata documents are reused.
+    :param dry_run: If True, only count the listings and metadata documents that would be written.
+    :return: Tuple (number of listings migrated, number of metadata documents created).
+    """
+    from bson import ObjectId
+    from pymongo import UpdateOne
+    coll = db[collection_name]
+    meta_coll = db[META_COLLECTION]
+    ids = {}
+    times = {}
+    n_listings = 0
+    n_created = 0
+    ops = []
+
+    def flush():
+        if dry_run:
+            return
+        if len(ops) > 0:
+            coll.bulk_write(ops, ordered=False)
+        meta_ops = [
+            UpdateOne({"_id": ids[key]}, {"$min": {"timestamp": t0}, "$max": {"timestamp_last": t1}})
+            for key, (t0, t1) in times.items() if t0 is not None
+        ]
+        if len(meta_ops) > 0:
+            meta_coll.bulk_write(meta_ops, ordered=False)
+        ops.clear()
+        times.clear()
+
+    flt = {META_FIELD: {"$exists": True, "$type": "object"}, f"{META_FIELD}.id": {"$exists": False}}
+    for doc in coll.find(flt, {META_FIELD: 1}):
+        meta = doc[META_FIELD]
+        key = _meta_key(meta)
+        if key not in ids:
+            spec = dict(zip(KEY_FIELDS, key))
+            existing = meta_coll.find_one(spec, {"_id": 1})
+            if existing is not None:
+                ids[key] = existing["_id"]
+            else:
+                new = dict(meta)
+                new.update(spec)
+                new["_id"] = ObjectId()
+                new["timestamp_last"] = new.get("timestamp")
+                if not dry_run:
+                    meta_coll.insert_one(new)
+                ids[key] = new["_id"]
+                n_created += 1
+        ts = meta.get("timestamp")
+        t0, t1 = times.get(key, (ts, ts))
+        if ts is not None:
+            times[key] = (min(t0, ts), max(t1, ts))
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {META_FIELD: meta_ref(ids[key])}}))
+        n_listings += 1
+        if len(ops) >= batch_size:
+            flush()
+            LOGGER.info("%s: migrated %d listings so far.", collection_name, n_listings)
+    flush()
+    LOGGER.info("%s: migrated %d listings, created %d metadata documents%s.", collection_name, n_listings,
+                n_created, " (dry run)" if dry_run else "")
+    return n_listings, n_created
+
+
+def main(argv=None):
+    from rightmove import worker
+    argparser = argparse.ArgumentParser(
+        description="Move the retrieval metadata embedded in each listing to the retrieval_meta collection."
+    )
+    argparser.add_argument("--collection", action="append",
+                           help="Collection to migrate (default: the for-sale and to-rent collections).")
+    argparser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    argparser.add_argument("--dry-run", action="store_true")
+    args = argparser.parse_args(argv)
+
+    collections = args.collection or [
+        consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE],
+        consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_TORENT],
+    ]
+    db = worker.mongo_connection()
+    for name in collections:
+        migrate_collection(db, name, batch_size=args.batch_size, dry_run=args.dry_run)
@@ -0,0 +1,167 @@
+"""
+Splitting the outcodes between several crawler processes or machines.
+
+A shard is a stable partition of the outcodes: `--shard 3/8` always selects the same outcodes, wherever it runs.
+Alternatively, a lease queue in MongoDB hands outcodes out to whichever worker is idle, reclaiming expired leases from
+crashed workers, so that each outcode is crawled exactly once per run.
+"""
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from config import cfg
+from core import get_logger
+
+LOGGER = get_logger("rightmove_sharding")
+DEFAULT_LEASE_TTL = cfg.get("crawler", {}).get("lease_ttl_sec", 3600)
+DEFAULT_LEASE_RETENTION_DAYS = cfg.get("crawler", {}).get("lease_retention_days", 7)
+LEASE_COLLECTION = "outcode_leases"
+
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+def parse_shard(spec):
+    """
+    :param spec: String "K/N", selecting shard K (counting from 1) of N.
+    :return: Tuple (K, N).
+    """
+    try:
+        k, n = (int(t) for t in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be given as K/N, e.g. 3/8, not {spec!r}.")
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f"Invalid shard {spec!r}: K must be between 1 and N.")
+    return k, n
+
+
+def shard_of(outcode, n_shards):
+    """
+    :return: The shard (counting from 1) that an outcode belongs to. This does not depend on the process or the
+    ordering of the outcode table.
+    """
+    return zlib.crc32(str(outcode).encode("ascii")) % n_shards + 1
+
+
+def select_shard(outcodes, shard, n_shards):
+    """
+    :param outcodes: Iterable of (outcode, postcode).
+    :return: List of the (outcode, postcode) pairs in the shard.
+    """
+    return [(outcode, pc) for outcode, pc in outcodes if shard_of(outcode, n_shards) == shard]
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class MongoLeaseQueue(object):
+    """
+    Work queue of outcodes for one run, held in MongoDB so that workers on any machine can share it.
+    Every worker calls `populate` (which is idempotent) and then takes outcodes with `acquire`. A lease that is not
+    completed within `ttl` seconds, e.g. because its worker crashed, is handed out again.
+    Finished outcodes are removed by MongoDB once they are `retention_days` old, so the collection does not keep
+    growing with every run.
+    """
+    def __init__(self, db, run_id, property_type, ttl=DEFAULT_LEASE_TTL, owner=None,
+                 retention_days=DEFAULT_LEASE_RETENTION_DAYS):
+        self.coll = db[LEASE_COLLECTION]
+        self.run_id = run_id
+        self.property_type = property_type
+        self.ttl = ttl
+        self.owner = owner or default_owner()
+        self.retention_days = retention_days
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """
+        Create the index used by `acquire`, and the TTL index on the finishing time. Existing indexes are left as they
+        are.
+        """
+        from pymongo import ASCENDING
+        self.coll.create_index(
+            [("run_id", ASCENDING), ("property_type", ASCENDING), ("state", ASCENDING), ("outcode", ASCENDING)],
+            name="run_id_property_type_state_outcode"
+        )
+        if self.retention_days:
+            # only finished outcodes have this field, so pending and leased ones are never expired
+            self.coll.create_index([("finished", ASCENDING)], name="finished_ttl",
+                                   expireAfterSeconds=int(self.retention_days * 86400))
+
+    def _id(self, outcode):
+        return f"{self.run_id}:{self.property_type}:{outcode}"
+
+    def populate(self, outcodes):
+        """
+        Add outcodes to the queue, leaving any already present (in whatever state) untouched.
+        :param outcodes: Iterable of (outcode, postcode).
+        """
+        from pymongo import UpdateOne
+        ops = [
+            UpdateOne(
+                {"_id": self._id(outcode)},
+                {"$setOnInsert": {
+                    "run_id": self.run_id,
+                    "property_type": self.property_type,
+                    "outcode": outcode,
+                    "postcode": pc,
+                    "state": STATE_PENDING,
+                    "attempts": 0,
+                }},
+                upsert=True
+            ) for outcode, pc in outcodes
+        ]
+        if len(ops) > 0:
+            self.coll.bulk_write(ops, ordered=False)
+
+    def acquire(self):
+        """
+        Lease the next pending outcode, or one whose lease has expired.
+        :return: Tuple (outcode, postcode), or None if there is nothing left to lease.
+        """
+        from pymongo import ReturnDocument
+        now = datetime.now(timezone.utc)
+        doc = self.coll.find_one_and_update(
+            {
+                "run_id": self.run_id,
+                "property_type": self.property_type,
+                "$or": [
+                    {"state": STATE_PENDING},
+                    {"state": STATE_LEASED, "lease_expires": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {"state": STATE_LEASED, "owner": self.owner, "lease_expires": now + timedelta(seconds=self.ttl)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("outcode", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+        if doc["attempts"] > 1:
+            LOGGER.info("Reclaimed expired lease on outcode %d.", doc["outcode"])
+        return doc["outcode"], doc["postcode"]
+
+    def complete(self, outcode, success=True):
+        """
+        Mark a leased outcode as finished, so that it is not handed out again in this run.
+        """
+        self.coll.update_one(
+            {"_id": self._id(outcode), "owner": self.owner},
+            {"$set": {"state": STATE_DONE if success else STATE_FAILED, "finished": datetime.now(timezone.utc)}}
+        )
+
+    def __iter__(self):
+        """
+        Lease outcodes one at a time until none are left. Consume this lazily, so that each worker only holds the
+        leases it is working on.
+        """
+        while True:
+            leased = self.acquire()
+            if leased is None:
+                return
+            yield leased
@@ -0,0 +1,223 @@
+"""
+Read access to the stored listings, for analysis. Queries select listings by outcode and crawl date through the
+retrieval metadata (see rightmove.retrieval_meta), stream from batched, projected cursors, and are returned either as
+chunks of documents or as pandas DataFrames, so that a whole collection never has to fit in memory.
+
+The indexes these queries rely on are created the first time a collection is used.
+"""
+import heapq
+import itertools
+import threading
+from datetime import date, datetime, time, timedelta
+import pandas as pd
+import pytz
+from pymongo import ASCENDING, DESCENDING
+from config import cfg
+from core import get_logger
+from rightmove import consts
+from rightmove import retrieval_meta
+
+TIMEZONE = cfg["env"].get("timezone", "utc")
+STORE_CFG = cfg.get("store", {})
+DEFAULT_CHUNK_SIZE = STORE_CFG.get("chunk_size", 5000)
+# metadata references per query; a larger selection is read with one query per batch
+MAX_META_IDS = STORE_CFG.get("max_meta_ids", 50000)
+
+META = retrieval_meta.META_FIELD
+LISTING_INDEXES = (
+    ("meta_id", [(f"{META}.id", ASCENDING)], {}),
+    # latest snapshot of each property: ObjectIds increase with insertion time
+    ("property_id", [("id", ASCENDING), ("_id", DESCENDING)], {}),
+    # listings stored before the metadata was normalised
+    ("legacy_outcode_timestamp", [(f"{META}.outcode", ASCENDING), (f"{META}.timestamp", ASCENDING)],
+     {"sparse": True}),
+)
+META_INDEXES = (
+    ("property_type_outcode_run_date", [("property_type", ASCENDING), ("outcode", ASCENDING),
+                                        ("run_date", ASCENDING)], {}),
+    ("property_type_run_date", [("property_type", ASCENDING), ("run_date", ASCENDING)], {}),
+)
+
+LOGGER = get_logger("rightmove_store")
+
+_INDEXED = set()
+_INDEX_LOCK = threading.Lock()
+
+
+def ensure_indexes(db, property_type):
+    """
+    Create the indexes used by the queries on the listings of `property_type` and on the metadata collection, once
+    per process. Existing indexes are left as they are.
+    """
+    names = (consts.PROPERTY_TYPE_MAP[property_type], retrieval_meta.META_COLLECTION)
+    with _INDEX_LOCK:
+        for coll_name, indexes in zip(names, (LISTING_INDEXES, META_INDEXES)):
+            key = (db.name, coll_name)
+            if key in _INDEXED:
+                continue
+            for name, keys, options in indexes:
+                db[coll_name].create_index(keys, name=name, **options)
+            LOGGER.info("Ensured %d indexes on %s.", len(indexes), coll_name)
+            _INDEXED.add(key)
+
+
+def _as_date(value):
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(value)
+
+
+def _day_start(d):
+    return pytz.timezone(TIMEZONE).localize(datetime.combine(d, time.min))
+
+
+def _chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def to_frame(docs):
+    """
+    :param docs: List of listing documents.
+    :return: pandas DataFrame with one row per listing and nested fields flattened into dotted columns, e.g.
+    `location.latitude` and `__retrieval_meta.outcode`.
+    """
+    return pd.json_normalize(docs, sep=".")
+
+
+class ListingStore(object):
+    """
+    Queries over the listings of one property type.
+    :param db: pymongo database.
+    :param chunk_size: Number of documents fetched per round trip, and per chunk or DataFrame yielded.
+    """
+    def __init__(self, db, property_type, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.db = db
+        self.property_type = property_type
+        self.chunk_size = chunk_size
+        self.collection = db[consts.PROPERTY_TYPE_MAP[property_type]]
+        ensure_indexes(db, property_type)
+
+    def meta_ids(self, outcodes=None, start=None, end=None):
+        """
+        :return: List of the _ids of the retrieval metadata of the given outcodes, crawled between the dates `start`
+        and `end` (inclusive; datetime.date or ISO format strings).
+        """
+        flt = {"property_type": self.property_type}
+        if outcodes is not None:
+            flt["outcode"] = {"$in": list(outcodes)}
+        start, end = _as_date(start), _as_date(end)
+        if start is not None or end is not None:
+            flt["run_date"] = {}
+            if start is not None:
+                flt["run_date"]["$gte"] = start.isoformat()
+            if end is not None:
+                flt["run_date"]["$lte"] = end.isoformat()
+        return [d["_id"] for d in self.db[retrieval_meta.META_COLLECTION].find(flt, {"_id": 1})]
+
+    def _legacy_filter(self, outcodes, start, end):
+        flt = {}
+        if outcodes is not None:
+            flt[f"{META}.outcode"] = {"$in": list(outcodes)}
+        if start is not None or end is not None:
+            flt[f"{META}.timestamp"] = {}
+            if start is not None:
+                flt[f"{META}.timestamp"]["$gte"] = _day_start(start)
+            if end is not None:
+                flt[f"{META}.timestamp"]["$lt"] = _day_start(end + timedelta(days=1))
+        return flt
+
+    def _filters(self, outcodes, start, end):
+        """
+        :return: List of the filters selecting the listings, to be queried one after the other.
+        """
+        start, end = _as_date(start), _as_date(end)
+        if outcodes is None and start is None and end is None:
+            return [{}]
+        meta_ids = self.meta_ids(outcodes, start, end)
+        filters = [{f"{META}.id": {"$in": ids}} for ids in _chunked(meta_ids, MAX_META_IDS)]
+        filters.append(self._legacy_filter(outcodes, start, end))
+        return filters
+
+    @staticmethod
+    def _projection(fields):
+        if fields is None:
+            return None
+        projection = {k: 1 for k in fields}
+        projection[META] = 1
+        return projection
+
+    def find(self, outcodes=None, start=None, end=None, fields=None):
+        """
+        Stream every stored snapshot of the listings of the given outcodes, crawled between `start` and `end`
+        (inclusive). All arguments are optional.
+        :param outcodes: Iterable of outcode integers.
+        :param fields: Optional list of the fields to return (`_id` and the retrieval metadata are always included).
+        :return: Generator of listing documents, with their retrieval metadata joined in.
+        """
+        projection = self._projection(fields)
+        for flt in self._filters(outcodes, start, end):
+            cursor = self.collection.find(flt, projection, batch_size=self.chunk_size)
+            yield from retrieval_meta.join_meta(self.db, cursor, batch_size=self.chunk_size)
+
+    def latest(self, outcodes=None, start=None, end=None, fields=None):
+        """
+        Stream the most recently stored snapshot of each property among the listings selected as in `find`.
+        Listings without a property ID are skipped.
+        :return: Generator of listing documents, in the order of their property ID.
+        """
+        # one aggregation per batch of metadata references, each sorted by property ID, merged keeping the newest
+        # snapshot (ObjectIds increase with insertion time) of each property
+        streams = [self._latest_matching(flt, fields) for flt in self._filters(outcodes, start, end)]
+        merged = heapq.merge(*streams, key=lambda d: d["id"])
+        docs = (max(group, key=lambda d: d["_id"]) for _, group in itertools.groupby(merged, key=lambda d: d["id"]))
+        return retrieval_meta.join_meta(self.db, docs, batch_size=self.chunk_size)
+
+    def _latest_matching(self, flt, fields):
+        """
+        :return: Cursor over the newest snapshot of each property among the listings matching `flt`, in the order of
+        their property ID.
+        """
+        flt = dict(flt, id={"$ne": None})
+        pipeline = [{"$match": flt}, {"$sort": {"id": ASCENDING, "_id": DESCENDING}}]
+        projection = self._projection(fields)
+        if projection is not None:
+            projection["id"] = 1
+            pipeline.append({"$project": projection})
+        pipeline += [
+            {"$group": {"_id": "$id", "doc": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$doc"}},
+            {"$sort": {"id": ASCENDING}},
+        ]
+        return self.collection.aggregate(pipeline, allowDiskUse=True, batchSize=self.chunk_size)
+
+    def chunks(self, docs):
+        """
+        :param docs: Iterable of documents, e.g. from `find` or `latest`.
+        :return: Generator of lists of up to `chunk_size` documents.
+        """
+        return _chunked(docs, self.chunk_size)
+
+    def frames(self, docs):
+        """
+        :param docs: Iterable of documents, e.g. from `find` or `latest`.
+        :return: Generator of DataFrames of up to `chunk_size` listings each.
+        """
+        for chunk in self.chunks(docs):
+            yield to_frame(chunk)
+
+    def dataframe(self, docs):
+        """
+        :param docs: Iterable of documents, e.g. from `find` or `latest`.
+        :return: One DataFrame of all the documents. Use `fields` to keep it small.
+        """
+        frames = list(self.frames(docs))
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
@@ -1,135 +1,543 @@
-from core import requester, register, get_logger
-from rightmove import getter, consts, parser
-import pymongo
+from core import register, scheduler, metrics, get_logger
+from rightmove import getter, consts
+from rightmove import incremental as incremental_
+from rightmove import archive as archive_
+from rightmove import sharding
+from rightmove import pipeline
+from rightmove import retrieval_meta as retrieval_meta_
 from config import cfg
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
+import functools
+import itertools
 import time
 import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 LOGGER = get_logger("rightmove_worker")
-REQUESTER = requester.MoverightRequester()
-ACCESS_LOG = register.AccessLog()
+PAGE_CHECKPOINT_TABLE = "rightmove_page"
 TIMEZONE = cfg["env"].get("timezone", "utc")
 VERSION = cfg["env"]["version"]
+CRAWLER_CFG = cfg.get("crawler", {})
+DEFAULT_WORKERS = CRAWLER_CFG.get("workers", 1)
+DEFAULT_INCREMENTAL = CRAWLER_CFG.get("incremental", False)
+RESUME_WINDOW_HOURS = CRAWLER_CFG.get("resume_window_hours", 20)
+CHECKPOINT_MIN_PAGES = CRAWLER_CFG.get("checkpoint_min_pages", 5)
+DEFAULT_BACKGROUND_WRITES = cfg.get("writer", {}).get("enabled", True)
+DEFAULT_ARCHIVE_ROOT = cfg.get("archive", {}).get("root")
+DEFAULT_PARSE_PROCESSES = pipeline.DEFAULT_PARSE_PROCESSES
+
+OUTCODE_PAGES = metrics.histogram(
+    "outcode_pages", "Pages of search results processed per outcode.", ("property_type",),
+    buckets=metrics.COUNT_BUCKETS
+)
+OUTCODE_LISTINGS = metrics.histogram(
+    "outcode_listings", "Listings found per outcode.", ("property_type",), buckets=metrics.COUNT_BUCKETS
+)
+LISTINGS_STORED = metrics.counter(
+    "listings_stored_total", "Listings stored in full (all of them, unless in incremental mode).", ("property_type",)
+)
+OUTCODES_DONE = metrics.counter("outcodes_total", "Outcodes finished, by result.", ("property_type", "result"))
+RETRIES = metrics.counter("retries_total", "Outcode and page retries scheduled.", ("property_type", "kind"))
+
+# these are all created on first use, so that importing this module has no side effects; their modules (requests,
+# pymongo) are slow to import, so they are only imported then too
+REQUESTER = None
+ACCESS_LOG = None
+PAGE_LOG = None
 MONGO_CLI = None
+_INIT_LOCK = threading.Lock()
+
+
+def get_requester():
+    global REQUESTER
+    with _INIT_LOCK:
+        if REQUESTER is None:
+            from core import requester
+            REQUESTER = requester.MoverightRequester()
+    return REQUESTER
+
+
+def get_access_log():
+    global ACCESS_LOG
+    with _INIT_LOCK:
+        if ACCESS_LOG is None:
+            ACCESS_LOG = register.AccessLog()
+    return ACCESS_LOG
+
+
+def get_page_log():
+    global PAGE_LOG
+    with _INIT_LOCK:
+        if PAGE_LOG is None:
+            # checkpoints are only useful if they survive a crash, so write each one straight away
+            PAGE_LOG = register.PageCheckpointLog(batch_size=1)
+    return PAGE_LOG
 
 
 def mongo_connection():
     global MONGO_CLI
-    if MONGO_CLI is None:
-        MONGO_CLI = pymongo.MongoClient(**cfg["mongodb"])
+    with _INIT_LOCK:
+        if MONGO_CLI is None:
+            import pymongo
+            MONGO_CLI = pymongo.MongoClient(**cfg["mongodb"])
     return MONGO_CLI["rightmove"]
 
 
-def add_retrieval_meta(attr, **kwargs):
+def retrieval_meta(**kwargs):
     """
-    Iterate through the array of attribute dictionaries, adding metadata related to retrieval in-place.
-    :param attr_arr:
+    :return: New retrieval metadata document (see rightmove.retrieval_meta), including any kwargs.
+    """
+    req = get_requester()
+    return retrieval_meta_.new_meta(
+        datetime.now(pytz.timezone(TIMEZONE)),
+        user_agent=req.user_agent,
+        request_from=req.request_from,
+        version=VERSION,
+        **kwargs
+    )
+
+
+def add_retrieval_meta(attr, meta_id):
+    """
+    Add a reference to the retrieval metadata document `meta_id` to the attribute dictionary in-place.
+    :param attr:
+    :param meta_id: _id of the metadata document.
     :return:
     """
-    to_add = {
-        "user_agent": REQUESTER.user_agent,
-        "request_from": REQUESTER.request_from,
-        "timestamp": datetime.now(pytz.timezone(TIMEZONE)),
-        "version": VERSION
-    }
-    to_add.update(kwargs)
-    if "__retrieval_meta" in attr:
-        LOGGER.warning(
-            "attr dict already contains __retrieval_meta: %s",
-            str(attr)
-        )
-    else:
-        attr["__retrieval_meta"] = {}
-    attr["__retrieval_meta"].update(to_add)
+    pipeline.tag_listing(attr, retrieval_meta_.meta_ref(meta_id))
 
 
-def get_one_outcode(outcode, property_type, **retrieval_meta_kwargs):
+def get_one_outcode(outcode, property_type, incremental=DEFAULT_INCREMENTAL, counts=None, writer=None,
+                    skip_pages=None, pages=None, archive=None, run_date=None, page_indexes=None, failed_pages=None,
+                    parse_pool=None, stored_pages=None, **retrieval_meta_kwargs):
     """
     Get the raw attributes for one outcode and store in MongoDB
     :param outcode:
     :param property_type:
-    :param retrieval_meta_kwargs: Any kwargs will be passed into the retrieval metadata
-    :return: None
+    :param incremental: If True, only listings that are new or have changed since they were last seen are stored in
+    full. Unchanged listings are only marked as seen in the state collection.
+    :param counts: Optional collections.Counter, updated in-place with the number of new, changed and unchanged
+    listings (incremental mode only).
+    :param writer: Optional core.bulk_writer.BulkWriter. If supplied, pages are handed to the writer so that fetching
+    continues while they are stored, and this function returns once all of them have been written.
+    :param skip_pages: Optional collection of pagination indexes to skip, e.g. pages already stored by an interrupted
+    run. For outcodes with many pages, each stored page is recorded in the page checkpoint log.
+    :param pages: Optional iterable of parser.SearchPage to process instead of fetching from Rightmove, e.g. when
+    replaying from an archive.
+    :param archive: Optional rightmove.archive.PageArchive. If supplied, the raw pages are archived under `run_date`.
+    :param run_date: Date string used to partition the archive.
+    :param page_indexes: Optional collection of pagination indexes. If supplied, only these pages are fetched, e.g.
+    to retry pages that failed on an earlier attempt.
+    :param failed_pages: Optional list, to which the pagination index of each page that could not be fetched is
+    appended. The other pages are still stored.
+    :param parse_pool: Optional rightmove.pipeline.ParsePool. If supplied, pages are decoded and tagged in the
+    parser processes while the next pages are fetched, and stored in order.
+    :param stored_pages: Optional dictionary, updated with the IDs inserted for each page, keyed by pagination index,
+    once the page has been written. Pages already in it are skipped, so that retrying a call that failed part way
+    through does not store its first pages twice.
+    :param retrieval_meta_kwargs: Any kwargs will be passed into the retrieval metadata. This is written once per
+    call, as a document in the retrieval_meta collection that each listing refers to.
+    :return: List of inserted object IDs.
     """
+    from bson import ObjectId
+    from pymongo import InsertOne
+    from core import bulk_writer
     db_name = consts.PROPERTY_TYPE_MAP[property_type]
-    coll = mongo_connection()[db_name]
+    state_name = incremental_.state_collection_name(property_type)
+    db = mongo_connection()
     find_url = consts.FIND_URLS[property_type]
+    writer_key = (outcode, property_type, object())
     oids = []
-    for i, soup in enumerate(getter.outcode_search_generator(outcode, find_url, requester=REQUESTER)):
-        try:
-            attr_arr = parser.property_array_from_search(soup)
-        except Exception:
-            LOGGER.exception("Failed to parse property array from page %d of results of outcode %d.",
-                             i + 1, outcode)
-            raise
-        if len(attr_arr) > 0:
+    skip_pages = set(skip_pages or ())
+    if stored_pages:
+        skip_pages.update(stored_pages)
+    # only pages fetched from Rightmove are checkpointed
+    fetching = pages is None
+    if pages is None and page_indexes is not None:
+        pages = getter.pages_generator(outcode, find_url, get_requester(), sorted(set(page_indexes) - skip_pages),
+                                       failed_indexes=failed_pages)
+    elif pages is None:
+        pages = getter.outcode_search_generator(outcode, find_url, requester=get_requester(), skip_indexes=skip_pages,
+                                                failed_indexes=failed_pages)
+    elif stored_pages:
+        pages = (page for page in pages if page.index not in stored_pages)
+    if archive is not None:
+        pages = archive.record(pages, run_date, property_type, outcode)
+    if run_date is not None:
+        retrieval_meta_kwargs.setdefault("run_date", run_date)
+    meta = retrieval_meta(outcode=outcode, property_type=property_type, **retrieval_meta_kwargs)
+    meta_written = False
+    if parse_pool is not None:
+        pages = parse_pool.decode_pages(pages, meta=retrieval_meta_.meta_ref(meta["_id"]))
+    ptype_label = consts.PROPERTY_TYPE_MAP[property_type]
+    n_pages = 0
+    n_listings = 0
+    # property IDs already handled in this call, whose state may not be stored yet
+    seen_ids = set()
+    try:
+        for i, page in enumerate(pages):
+            try:
+                attr_arr = page.properties
+            except Exception:
+                LOGGER.exception("Failed to parse property array from page %d of results of outcode %d.",
+                                 i + 1, outcode)
+                raise
+            n_pages += 1
+            n_listings += len(attr_arr)
+            fingerprints = None
+            if incremental:
+                attr_arr, fingerprints, page_counts = incremental_.detect_changes(db[state_name], attr_arr,
+                                                                                  seen=seen_ids)
+                if counts is not None:
+                    counts.update(page_counts)
+            LISTINGS_STORED.inc(len(attr_arr), property_type=ptype_label)
+            if not getattr(page, "tagged", False):
+                for attr in attr_arr:
+                    add_retrieval_meta(attr, meta["_id"])
+            if not meta_written and len(attr_arr) > 0:
+                # written before the first listing that refers to it
+                db[retrieval_meta_.META_COLLECTION].insert_one(meta)
+                meta_written = True
+            state_ops = []
+            if fingerprints:
+                state_ops = incremental_.state_updates(fingerprints, datetime.now(pytz.timezone(TIMEZONE)))
             for attr in attr_arr:
-                add_retrieval_meta(attr, outcode=outcode, property_type=property_type, **retrieval_meta_kwargs)
-            resp = coll.insert_many(attr_arr)
-            oids.extend(resp.inserted_ids)
+                attr.setdefault("_id", ObjectId())
+            page_ids = [attr["_id"] for attr in attr_arr]
+            # run once the page's listings and state have been written
+            on_stored = None
+            if fetching and page.last_index >= CHECKPOINT_MIN_PAGES * getter.PER_PAGE:
+                on_stored = functools.partial(_checkpoint_page, outcode, property_type, page.index)
+            if stored_pages is not None:
+                on_stored = functools.partial(_record_stored_page, stored_pages, page.index, page_ids, on_stored)
+
+            if writer is not None:
+                # the state is only updated if the listings are stored successfully
+                stages = [(db_name, [InsertOne(attr) for attr in attr_arr])]
+                if len(state_ops) > 0:
+                    stages.append((state_name, state_ops))
+                writer.submit(writer_key, stages, ids=page_ids, callback=on_stored)
+            else:
+                if len(attr_arr) > 0:
+                    bulk_writer.WRITE_OPS.inc(len(attr_arr), collection=db_name, mode="direct")
+                    with bulk_writer.WRITE_SECONDS.time(collection=db_name, mode="direct"):
+                        resp = db[db_name].insert_many(attr_arr)
+                    oids.extend(resp.inserted_ids)
+                if len(state_ops) > 0:
+                    # only record the new state once the listings are safely stored
+                    bulk_writer.WRITE_OPS.inc(len(state_ops), collection=state_name, mode="direct")
+                    with bulk_writer.WRITE_SECONDS.time(collection=state_name, mode="direct"):
+                        db[state_name].bulk_write(state_ops, ordered=False)
+                if on_stored is not None:
+                    on_stored()
+    finally:
+        if writer is not None:
+            # also after a failure, so that write errors are raised and the pages already submitted are recorded as
+            # stored before the caller retries
+            writer_oids = writer.wait(writer_key)
+
+    OUTCODE_PAGES.observe(n_pages, property_type=ptype_label)
+    OUTCODE_LISTINGS.observe(n_listings, property_type=ptype_label)
+    if writer is not None:
+        oids = writer_oids
     return oids
 
 
-def get_all_outcodes(property_type, retries=3, sec_between_retry=10):
+def _checkpoint_page(outcode, property_type, page_index):
+    get_page_log().log(PAGE_CHECKPOINT_TABLE, outcode=outcode, property_type=property_type, page_index=page_index)
+
+
+def _record_stored_page(stored_pages, page_index, ids, checkpoint=None):
+    stored_pages[page_index] = ids
+    if checkpoint is not None:
+        checkpoint()
+
+
+def _get_one_outcode_with_postcode(outcode, outcode_postcode, property_type, incremental, writer, resume_since,
+                                   archive, run_date, replay, parse_pool=None, page_indexes=None, stored_pages=None):
     """
-    Iterate over all outcodes and store the results in MongoDB
-    :param property_type:
-    :return:
+    :param page_indexes: If supplied, only these pages of the outcode are retrieved.
+    :param stored_pages: Optional dictionary of the pages of this outcode stored so far (see get_one_outcode).
+    :return: Tuple of (inserted object IDs, change counts, indexes of pages that failed).
     """
-    property_type_str = consts.PROPERTY_TYPE_MAP[property_type]
-    try_count = collections.Counter()
-    oids = {}
-    for outcode, pc in consts.OUTCODE_MAP.items():
-        LOGGER.info("Getting %s for outcode %d.",
-                    consts.PROPERTY_TYPE_MAP[property_type],
+    if page_indexes is None:
+        LOGGER.info("Getting %s for outcode %d.", consts.PROPERTY_TYPE_MAP[property_type], outcode)
+    else:
+        LOGGER.info("Getting %d pages of %s for outcode %d.", len(page_indexes), consts.PROPERTY_TYPE_MAP[property_type],
                     outcode)
-        try:
-            oids[outcode] = get_one_outcode(outcode, property_type, outcode_postcode=pc)
-            n = len(oids[outcode])
-            ACCESS_LOG.log(
-                "rightmove",
-                outcode=outcode,
-                property_type=property_type,
-                success=1,
-                num_retries=0,
-                result=f"Retrieved {n} entries of type {property_type_str}."
+    # replayed listings are dated by the crawl that archived them
+    kwargs = {"run_date": run_date}
+    failed_pages = []
+    if replay:
+        kwargs["pages"] = archive.iter_pages(run_date, property_type, outcode)
+        kwargs["replayed_from"] = run_date
+    else:
+        kwargs["archive"] = archive
+    if page_indexes is not None:
+        kwargs["page_indexes"] = page_indexes
+    elif resume_since is not None:
+        kwargs["skip_pages"] = get_page_log().completed_pages(PAGE_CHECKPOINT_TABLE, outcode, property_type, resume_since)
+        if len(kwargs["skip_pages"]) > 0:
+            LOGGER.info("Resuming outcode %d: skipping %d pages already stored.", outcode, len(kwargs["skip_pages"]))
+    counts = collections.Counter()
+    oids = get_one_outcode(outcode, property_type, incremental=incremental, counts=counts, writer=writer,
+                           failed_pages=failed_pages, parse_pool=parse_pool, stored_pages=stored_pages,
+                           outcode_postcode=outcode_postcode, **kwargs)
+    if incremental:
+        LOGGER.info("Outcode %d: %d new, %d changed, %d unchanged listings.", outcode,
+                    counts[incremental_.STATUS_NEW], counts[incremental_.STATUS_CHANGED],
+                    counts[incremental_.STATUS_UNCHANGED])
+    return oids, counts, failed_pages
+
+
+def _log_outcode_result(table_name, outcode, property_type, success, num_retries, n=None, counts=None):
+    property_type_str = consts.PROPERTY_TYPE_MAP[property_type]
+    result = None
+    if success:
+        result = f"Retrieved {n} entries of type {property_type_str}."
+        if counts:
+            result += " {new} new, {changed} changed, {unchanged} unchanged.".format(
+                new=counts[incremental_.STATUS_NEW],
+                changed=counts[incremental_.STATUS_CHANGED],
+                unchanged=counts[incremental_.STATUS_UNCHANGED],
             )
-        except Exception:
-            LOGGER.exception("Failed to retrieve results for outcode %d.", outcode)
-            # store this outcode for possible retrying later
-            try_count[outcode] += 1
-
-    if retries > 1:
-        while len(try_count) > 0:
-            for outcode, i in list(try_count.items()):
-                try_count[outcode] += 1
-                try:
-                    pc = consts.OUTCODE_MAP[outcode]
-                    oids[outcode] = get_one_outcode(outcode, property_type, outcode_postcode=pc)
-                    n = len(oids[outcode])
-                    n_retry = try_count.pop(outcode) - 1
-                    LOGGER.info("Succeeded in getting outcode %d on try %d.", outcode, i)
-                    ACCESS_LOG.log(
-                        "rightmove",
-                        outcode=outcode,
-                        property_type=property_type,
-                        success=1,
-                        num_retries=n_retry,
-                        result=f"Retrieved {n} entries of type {property_type_str}."
-                    )
-                except Exception:
-                    LOGGER.exception("Failed to retrieve results for outcode %d on try %d.", outcode, try_count[outcode])
-                    if i == retries:
-                        LOGGER.error("Will give up on outcode %d.", outcode)
-                        n_retry = try_count.pop(outcode) - 1
-                        ACCESS_LOG.log(
-                            "rightmove",
-                            outcode=outcode,
-                            property_type=property_type,
-                            success=0,
-                            num_retries=n_retry
-                        )
-                        continue
-                    time.sleep(sec_between_retry)
+    get_access_log().log(
+        table_name,
+        outcode=outcode,
+        property_type=property_type,
+        success=success,
+        num_retries=num_retries,
+        result=result
+    )
+
+
+def get_all_outcodes(property_type, retries=3, sec_between_retry=10, workers=DEFAULT_WORKERS,
+                     incremental=DEFAULT_INCREMENTAL, background_writes=DEFAULT_BACKGROUND_WRITES, resume=False,
+                     archive_root=DEFAULT_ARCHIVE_ROOT, replay_date=None, shard=None, lease_run_id=None,
+                     metrics_path=metrics.DEFAULT_METRICS_PATH, max_outcodes=None,
+                     parse_processes=DEFAULT_PARSE_PROCESSES):
+    """
+    Iterate over all outcodes and store the results in MongoDB.
+    Outcodes are retrieved concurrently by a pool of threads sharing the same requester, so the global rate limits
+    still apply. Access log entries are written from the calling thread, one per outcode.
+    :param property_type:
+    :param retries: Maximum number of attempts per outcode, and per page of an outcode.
+    :param sec_between_retry: Base of the exponential backoff before a failed outcode or page is retried.
+    :param workers: Number of outcodes to retrieve concurrently.
+    :param incremental: If True, only store listings that are new or changed (see get_one_outcode).
+    :param background_writes: If True, writes to MongoDB are batched by a background writer so that they overlap
+    with fetching.
+    :param resume: If True, continue an interrupted run: skip outcodes successfully retrieved within the last
+    `crawler.resume_window_hours`, and pages of large outcodes already stored in that window.
+    :param archive_root: Optional directory of a rightmove.archive.PageArchive. If supplied, raw pages are archived
+    under today's date.
+    :param replay_date: If supplied, no requests are made: the pages archived on this date (YYYY-MM-DD) are
+    processed instead. Requires `archive_root`. Access log entries go to the `rightmove_replay` table.
+    :param shard: Optional tuple (K, N): only crawl the outcodes in shard K of N (see rightmove.sharding).
+    :param lease_run_id: If supplied, outcodes are taken from the MongoDB lease queue for this run ID, shared with
+    any other workers using the same ID, instead of being iterated directly.
+    :param metrics_path: If supplied, metrics (see core.metrics) are written to this file every
+    `metrics.interval` seconds and at the end of the run, as JSON if it ends in .json or else in Prometheus text
+    format.
+    :param max_outcodes: If supplied, only the first `max_outcodes` outcodes are crawled, e.g. for profiling.
+    :param parse_processes: If greater than zero, pages are decoded by this many parser processes (see
+    rightmove.pipeline) rather than in the threads that fetch them.
+    :return: Dictionary of inserted object IDs, keyed by outcode.
+    """
+    archive = archive_.PageArchive(archive_root) if archive_root else None
+    table_name = "rightmove"
+    if replay_date is not None:
+        if archive is None:
+            raise ValueError("An archive_root is required to replay archived pages.")
+        run_date = replay_date
+        table_name = "rightmove_replay"
+        outcodes = [(outcode, consts.OUTCODE_MAP.get(outcode)) for outcode in archive.outcodes(run_date, property_type)]
+        LOGGER.info("Replaying %d outcodes archived on %s.", len(outcodes), run_date)
+    else:
+        run_date = datetime.now(pytz.timezone(TIMEZONE)).date().isoformat()
+        outcodes = consts.OUTCODE_MAP.items()
+
+    resume_since = None
+    if resume and replay_date is None:
+        resume_since = datetime.now() - timedelta(hours=RESUME_WINDOW_HOURS)
+        done = get_access_log().successful_outcodes(table_name, property_type, resume_since)
+        outcodes = [(outcode, pc) for outcode, pc in outcodes if outcode not in done]
+        LOGGER.info("Resuming run: %d outcodes already retrieved since %s, %d remaining.",
+                    len(done), resume_since.strftime("%Y-%m-%d %H:%M"), len(outcodes))
+
+    if shard is not None:
+        outcodes = sharding.select_shard(outcodes, *shard)
+        LOGGER.info("Crawling shard %d/%d: %d outcodes.", shard[0], shard[1], len(outcodes))
+
+    if max_outcodes is not None:
+        outcodes = list(itertools.islice(outcodes, max_outcodes))
+        LOGGER.info("Limiting the run to %d outcodes.", len(outcodes))
+
+    lease_queue = None
+    if lease_run_id is not None:
+        lease_queue = sharding.MongoLeaseQueue(mongo_connection(), lease_run_id, property_type)
+        lease_queue.populate(outcodes)
+        LOGGER.info("Taking outcodes from lease queue for run %s as %s.", lease_run_id, lease_queue.owner)
+        outcodes = iter(lease_queue)
+
+    exporter = None
+    if metrics_path:
+        exporter = metrics.MetricsExporter(metrics_path).start()
+    writer = None
+    if background_writes:
+        from core import bulk_writer
+        writer = bulk_writer.BulkWriter(mongo_connection()).start()
+    parse_pool = None
+    if parse_processes:
+        parse_pool = pipeline.ParsePool(parse_processes).start()
+    fn = functools.partial(
+        _get_one_outcode_with_postcode,
+        property_type=property_type,
+        incremental=incremental,
+        writer=writer,
+        resume_since=resume_since,
+        archive=archive,
+        run_date=run_date,
+        replay=replay_date is not None,
+        parse_pool=parse_pool,
+    )
+    try:
+        return _get_outcodes(fn, table_name, property_type, outcodes, retries, sec_between_retry, workers,
+                             lease_queue=lease_queue)
+    finally:
+        if parse_pool is not None:
+            parse_pool.close()
+        if writer is not None:
+            writer.close()
+        for log in (ACCESS_LOG, PAGE_LOG):
+            if log is not None:
+                log.flush()
+        if exporter is not None:
+            exporter.close()
+
+
+class _OutcodeProgress(object):
+    """
+    Results gathered for one outcode over its attempts. At most one task per outcode is in flight or waiting to be
+    retried at any time.
+    """
+    def __init__(self):
+        # inserted IDs by pagination index, including pages stored by attempts that later failed
+        self.stored_pages = {}
+        self.counts = collections.Counter()
+        self.n_try = 0
+        self.n_retries = 0
+        self.page_tries = collections.Counter()
+        # pagination indexes given up on after running out of retries
+        self.abandoned_pages = set()
+
+    @property
+    def oids(self):
+        return [oid for ids in self.stored_pages.values() for oid in ids]
+
+
+def _get_outcodes(fn, table_name, property_type, outcodes, retries, sec_between_retry, workers, lease_queue=None):
+    """
+    Retrieve outcodes on a pool of `workers` threads. A failed outcode, or the failed pages of an otherwise
+    successful outcode, are put on a retry scheduler with an exponential backoff deadline. Whenever a worker is free
+    it takes a retry that has fallen due, or else the next fresh outcode, so it only waits when there is nothing else
+    to do. Each outcode is logged once it has finished, with its total number of retries; an outcode with any page
+    given up on is logged as failed. Pages stored by an attempt that failed part way through are not stored again by
+    its retries.
+    """
+    fresh = iter(outcodes)
+    exhausted = False
+    retry_queue = scheduler.RetryScheduler()
+    progress = {}
+    pending = {}
+    oids = {}
+
+    def backoff(n_try):
+        from core import requester
+        return requester.backoff_delay(n_try - 1, base=sec_between_retry, cap=sec_between_retry * 2 ** retries)
+
+    ptype_label = consts.PROPERTY_TYPE_MAP[property_type]
+
+    def finish(outcode, success):
+        p = progress.pop(outcode)
+        OUTCODES_DONE.inc(property_type=ptype_label, result="success" if success else "failed")
+        if success:
+            oids[outcode] = p.oids
+            if p.n_retries > 0:
+                LOGGER.info("Succeeded in getting outcode %d after %d retries.", outcode, p.n_retries)
+            _log_outcode_result(table_name, outcode, property_type, 1, p.n_retries, n=len(p.oids), counts=p.counts)
+        else:
+            _log_outcode_result(table_name, outcode, property_type, 0, p.n_retries)
+        if lease_queue is not None:
+            lease_queue.complete(outcode, success=success)
+
+    def handle(task, res, exc):
+        outcode, pc, page_indexes = task
+        p = progress[outcode]
+        if page_indexes is None:
+            p.n_try += 1
+            if exc is not None:
+                LOGGER.error("Failed to retrieve results for outcode %d on try %d.", outcode, p.n_try, exc_info=exc)
+                if p.n_try >= retries:
+                    LOGGER.error("Will give up on outcode %d.", outcode)
+                    finish(outcode, False)
+                else:
+                    p.n_retries += 1
+                    RETRIES.inc(property_type=ptype_label, kind="outcode")
+                    retry_queue.push(task, backoff(p.n_try))
+                return
+        if exc is not None:
+            LOGGER.error("Failed to retrieve pages %s of outcode %d.", page_indexes, outcode, exc_info=exc)
+            failed = [i for i in page_indexes if i not in p.stored_pages]
+        else:
+            p.counts.update(res[1])
+            failed = res[2]
+
+        to_retry = []
+        for i in failed:
+            p.page_tries[i] += 1
+            if p.page_tries[i] >= retries:
+                LOGGER.error("Will give up on page with index %d of outcode %d.", i, outcode)
+                p.abandoned_pages.add(i)
+            else:
+                to_retry.append(i)
+        if len(to_retry) > 0:
+            p.n_retries += 1
+            RETRIES.inc(property_type=ptype_label, kind="page")
+            retry_queue.push((outcode, pc, tuple(to_retry)), backoff(max(p.page_tries[i] for i in to_retry)))
+        else:
+            finish(outcode, len(p.abandoned_pages) == 0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(pending) < workers:
+                # retries that have fallen due go before fresh work
+                task = retry_queue.pop_due()
+                if task is None and not exhausted:
+                    try:
+                        outcode, pc = next(fresh)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        task = (outcode, pc, None)
+                        progress[outcode] = _OutcodeProgress()
+                if task is None:
+                    break
+                pending[executor.submit(fn, task[0], task[1], page_indexes=task[2],
+                                        stored_pages=progress[task[0]].stored_pages)] = task
+            if len(pending) == 0:
+                if len(retry_queue) == 0:
+                    break
+                time.sleep(retry_queue.time_until_due())
+                continue
+            # with a free worker, wake up when the next retry falls due
+            timeout = retry_queue.time_until_due() if len(pending) < workers else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                task = pending.pop(fut)
+                exc = fut.exception()
+                handle(task, None if exc is not None else fut.result(), exc)
+
+    return oids
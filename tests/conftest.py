@@ -0,0 +1,79 @@
+import pytest
+from bench.fakes import FakeDatabase, FakeMongoClient
+from bench.mock_server import MockRightmoveServer
+from core import register, requester
+from rightmove import consts, worker
+
+N_OUTCODES = 3
+N_RESULTS = 300
+
+
+class FakeClock(object):
+    """
+    Clock for the `clock` attribute of limiters, caches and schedulers, which only moves when `now` is changed.
+    """
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def db():
+    """
+    Empty in-memory MongoDB database.
+    """
+    return FakeDatabase()
+
+
+@pytest.fixture
+def make_requester(monkeypatch):
+    """
+    :return: Function making a new RequesterSingleton from the given kwargs, rather than returning the process-wide
+    instance. Retries are made without backoff.
+    """
+    monkeypatch.setattr(requester.Singleton, "_instances", {})
+    monkeypatch.setattr(requester, "backoff_delay", lambda attempt: 0.)
+
+    def make(**kwargs):
+        requester.Singleton._instances.pop(requester.RequesterSingleton, None)
+        return requester.RequesterSingleton(**kwargs)
+    return make
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    In-memory MongoDB stand-in used by the worker.
+    :return: The worker's database.
+    """
+    monkeypatch.setattr(worker, "MONGO_CLI", FakeMongoClient())
+    return worker.mongo_connection()
+
+
+@pytest.fixture
+def server(monkeypatch, mongo, tmp_path):
+    """
+    Mock Rightmove server that the worker crawls, for the first N_OUTCODES outcodes, with N_RESULTS listings each.
+    The worker gets an unthrottled requester, and access logs in a temporary database.
+    """
+    outcodes = dict(list(consts.OUTCODE_MAP.items())[:N_OUTCODES])
+    monkeypatch.setattr(consts, "OUTCODE_MAP", outcodes)
+    monkeypatch.setattr(requester.Singleton, "_instances", {})
+    req = requester.MoverightRequester(limiter=None, rate_controller=None, cache=None)
+    monkeypatch.setattr(worker, "REQUESTER", req)
+    db_fn = str(tmp_path / "access_log.db")
+    monkeypatch.setattr(worker, "ACCESS_LOG", register.AccessLog(database=db_fn))
+    monkeypatch.setattr(worker, "PAGE_LOG", register.PageCheckpointLog(batch_size=1, database=db_fn))
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=N_RESULTS, max_results=N_RESULTS) as srv:
+        for property_type, url in srv.find_urls().items():
+            monkeypatch.setitem(consts.FIND_URLS, property_type, url)
+        yield srv
+    worker.ACCESS_LOG.close()
+    worker.PAGE_LOG.close()
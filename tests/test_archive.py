@@ -0,0 +1,57 @@
+import os
+from rightmove import archive, consts, parser, retrieval_meta, worker
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+COLLECTION = consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]
+
+
+def test_identical_pages_stored_once(tmp_path):
+    arch = archive.PageArchive(str(tmp_path))
+    pages = [parser.SearchPage(b"same", index=0), parser.SearchPage(b"same", index=48),
+             parser.SearchPage(b"other", index=96)]
+    assert list(arch.record(pages, "2024-01-01", PROPERTY_TYPE, 1)) == pages
+    assert len(list((tmp_path / "objects").glob("*/*.gz"))) == 2
+    assert [(p.index, p.content) for p in arch.iter_pages("2024-01-01", PROPERTY_TYPE, 1)] == \
+        [(0, b"same"), (48, b"same"), (96, b"other")]
+    assert arch.outcodes("2024-01-01", PROPERTY_TYPE) == [1]
+    assert arch.outcodes("2024-01-02", PROPERTY_TYPE) == []
+    assert arch.run_dates() == ["2024-01-01"]
+
+
+def test_manifest_kept_when_interrupted(tmp_path):
+    arch = archive.PageArchive(str(tmp_path))
+    pages = arch.record((parser.SearchPage(str(i).encode(), index=i * 48) for i in range(3)), "2024-01-01",
+                        PROPERTY_TYPE, 1)
+    next(pages)
+    next(pages)
+    assert sorted(arch.manifest("2024-01-01", PROPERTY_TYPE, 1)) == [0, 48]
+
+
+def test_replay_stores_archived_pages_without_requests(server, mongo, tmp_path):
+    root = str(tmp_path / "archive")
+    kwargs = dict(retries=1, workers=1, archive_root=root, metrics_path=None, parse_processes=0)
+    crawled = worker.get_all_outcodes(PROPERTY_TYPE, **kwargs)
+    n_requests = server.counts["requests"]
+    run_date, = archive.PageArchive(root).run_dates()
+
+    replayed = worker.get_all_outcodes(PROPERTY_TYPE, replay_date=run_date, **kwargs)
+    assert server.counts["requests"] == n_requests
+    assert {k: len(v) for k, v in replayed.items()} == {k: len(v) for k, v in crawled.items()}
+    docs = list(mongo[COLLECTION].docs.values())
+    assert sorted(d["id"] for d in docs[len(docs) // 2:]) == sorted(d["id"] for d in docs[:len(docs) // 2])
+    n_replayed = worker.ACCESS_LOG.connection.execute("SELECT SUM(success) FROM rightmove_replay").fetchone()[0]
+    assert n_replayed == len(consts.OUTCODE_MAP)
+
+
+def test_replay_keeps_archived_run_date(server, mongo, tmp_path):
+    root = str(tmp_path / "archive")
+    kwargs = dict(retries=1, workers=1, archive_root=root, metrics_path=None, parse_processes=0)
+    worker.get_all_outcodes(PROPERTY_TYPE, **kwargs)
+    run_date, = archive.PageArchive(root).run_dates()
+    os.rename(os.path.join(root, "runs", run_date), os.path.join(root, "runs", "2024-01-01"))
+    mongo[retrieval_meta.META_COLLECTION].docs.clear()
+
+    worker.get_all_outcodes(PROPERTY_TYPE, replay_date="2024-01-01", **kwargs)
+    metas = list(mongo[retrieval_meta.META_COLLECTION].docs.values())
+    assert len(metas) == len(consts.OUTCODE_MAP)
+    assert {(m["run_date"], m["replayed_from"]) for m in metas} == {("2024-01-01", "2024-01-01")}
@@ -0,0 +1,65 @@
+import asyncio
+import aiohttp
+import pytest
+from bench.mock_server import MockRightmoveServer
+from core import async_requester
+from rightmove import consts, getter
+
+N_RESULTS = 200
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(async_requester, "backoff_delay", lambda attempt: 0.)
+
+
+def test_async_outcode_search_generator():
+    async def crawl(find_url):
+        async with async_requester.AsyncRequester() as requester:
+            return [page async for page in getter.async_outcode_search_generator(1, find_url, requester=requester)]
+
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=N_RESULTS, max_results=N_RESULTS) as server:
+        pages = _run(crawl(server.find_urls()[consts.PROPERTY_TYPE_FORSALE]))
+
+    assert sorted(p.index for p in pages) == [0, 48, 96, 144, 192]
+    assert sum(len(p.properties) for p in pages) == N_RESULTS
+
+
+def test_response_body_read_before_release():
+    async def get(url):
+        async with async_requester.AsyncRequester() as requester:
+            return await requester.get(url, params=getter.outcode_search_payload(1))
+
+    with MockRightmoveServer(latency=0, latency_jitter=0) as server:
+        resp = _run(get(server.find_urls()[consts.PROPERTY_TYPE_FORSALE]))
+
+    assert resp.ok and resp.status == 200
+    assert resp.body.startswith(b"<") and len(resp.body) == int(resp.headers["Content-Length"])
+
+
+def test_retryable_status_is_retried(no_backoff):
+    async def get(url):
+        async with async_requester.AsyncRequester(retries=2) as requester:
+            return await requester.get(url, params=getter.outcode_search_payload(1))
+
+    with MockRightmoveServer(latency=0, latency_jitter=0, error_rate=1., error_codes=(503,), retry_after=0) as server:
+        resp = _run(get(server.find_urls()[consts.PROPERTY_TYPE_FORSALE]))
+        assert server.counts["requests"] == 3
+
+    assert resp.status == 503
+    with pytest.raises(aiohttp.ClientResponseError):
+        resp.raise_for_status()
+
+
+def test_failed_first_page_raises(no_backoff):
+    async def crawl(find_url):
+        async with async_requester.AsyncRequester(retries=0) as requester:
+            return [page async for page in getter.async_outcode_search_generator(1, find_url, requester=requester)]
+
+    with MockRightmoveServer(latency=0, latency_jitter=0, error_rate=1., error_codes=(500,)) as server:
+        with pytest.raises(aiohttp.ClientResponseError):
+            _run(crawl(server.find_urls()[consts.PROPERTY_TYPE_FORSALE]))
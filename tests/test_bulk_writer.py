@@ -0,0 +1,126 @@
+import random
+import time
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from bench.fakes import FakeCollection
+from bench.pages import synthetic_listing
+from core import bulk_writer
+from rightmove import consts, pipeline, worker
+
+
+class FailingCollection(FakeCollection):
+    """
+    Rejects the inserts of documents flagged with `fail`, as a unique index would.
+    """
+    def bulk_write(self, ops, ordered=True):
+        bad = [i for i, op in enumerate(ops) if isinstance(op, InsertOne) and op._doc.get("fail")]
+        super().bulk_write([op for i, op in enumerate(ops) if i not in bad], ordered=ordered)
+        if len(bad) > 0:
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": 11000} for i in bad]})
+
+
+def test_submissions_coalesced_into_one_write(db):
+    with bulk_writer.BulkWriter(db, batch_size=100, flush_interval=60.) as writer:
+        for key in ("a", "b"):
+            writer.submit(key, [("listings", [InsertOne({"_id": f"{key}{i}"}) for i in range(3)])],
+                          ids=[f"{key}{i}" for i in range(3)])
+        assert writer.wait("a") == ["a0", "a1", "a2"]
+        assert writer.wait("b") == ["b0", "b1", "b2"]
+    assert len(db["listings"].docs) == 6
+    assert db["listings"].n_calls["bulk_write"] == 1
+
+
+def test_flushes_when_batch_size_reached(db):
+    with bulk_writer.BulkWriter(db, batch_size=2, flush_interval=60.) as writer:
+        for i in range(4):
+            writer.submit("a", [("listings", [InsertOne({"_id": i})])], ids=[i])
+        assert writer.wait("a") == [0, 1, 2, 3]
+    assert db["listings"].n_calls["bulk_write"] == 2
+
+
+def test_flushes_after_interval_without_wait(db):
+    done = []
+    with bulk_writer.BulkWriter(db, batch_size=100, flush_interval=0.05) as writer:
+        writer.submit("a", [("listings", [InsertOne({"_id": 1})])], callback=lambda: done.append(1))
+        deadline = time.monotonic() + 1.
+        while len(done) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert done == [1]
+
+
+def test_failed_stage_skips_later_stages_of_its_submission_only(db):
+    db.collections["listings"] = FailingCollection("listings")
+    callbacks = []
+    with bulk_writer.BulkWriter(db, batch_size=100, flush_interval=60.) as writer:
+        for key, fail in (("bad", True), ("good", False)):
+            writer.submit(
+                key,
+                [("listings", [InsertOne({"_id": key, "fail": fail})]),
+                 ("state", [UpdateOne({"_id": key}, {"$set": {"seen": True}}, upsert=True)])],
+                ids=[key], callback=lambda key=key: callbacks.append(key),
+            )
+        with pytest.raises(BulkWriteError):
+            writer.wait("bad")
+        assert writer.wait("good") == ["good"]
+    assert list(db["listings"].docs) == ["good"]
+    assert list(db["state"].docs) == ["good"]
+    assert callbacks == ["good"]
+
+
+def test_submit_requires_start(db):
+    with pytest.raises(RuntimeError):
+        bulk_writer.BulkWriter(db).submit("a", [])
+
+
+def _pages(fail_after=None):
+    """
+    Two pages of five listings. If `fail_after` is given, the iteration fails after yielding that many pages, as if
+    the next page could not be fetched or decoded.
+    """
+    rng = random.Random(0)
+    listings = [synthetic_listing(rng, 1000 + i) for i in range(10)]
+    for n, index in enumerate((0, 48)):
+        if n == fail_after:
+            raise ValueError("Failed to decode page")
+        yield pipeline.DecodedPage(index, listings[5 * n:5 * (n + 1)], 48, tagged=False)
+
+
+@pytest.mark.parametrize("background", [True, False])
+def test_retry_of_failed_outcode_skips_stored_pages(mongo, background):
+    writer = bulk_writer.BulkWriter(mongo, flush_interval=60.).start() if background else None
+    stored = {}
+    try:
+        with pytest.raises(ValueError):
+            worker.get_one_outcode(1, consts.PROPERTY_TYPE_FORSALE, writer=writer, pages=_pages(fail_after=1),
+                                   stored_pages=stored)
+        if writer is not None:
+            # the submitted page was waited for, rather than left outstanding
+            assert writer._tickets == {}
+        assert list(stored) == [0]
+        oids = worker.get_one_outcode(1, consts.PROPERTY_TYPE_FORSALE, writer=writer, pages=_pages(),
+                                      stored_pages=stored)
+    finally:
+        if writer is not None:
+            writer.close()
+    assert len(oids) == 5 and sorted(stored) == [0, 48]
+    docs = mongo[consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE]].docs.values()
+    assert sorted(d["id"] for d in docs) == list(range(1000, 1010))
+
+
+def test_write_error_raised_after_failed_page(mongo):
+    coll_name = consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE]
+    mongo.collections[coll_name] = FailingCollection(coll_name)
+
+    def pages():
+        page = next(_pages())
+        page.properties[0]["fail"] = True
+        yield page
+        raise ValueError("Failed to decode page")
+
+    stored = {}
+    with bulk_writer.BulkWriter(mongo, flush_interval=60.) as writer:
+        with pytest.raises(BulkWriteError):
+            worker.get_one_outcode(1, consts.PROPERTY_TYPE_FORSALE, writer=writer, pages=pages(), stored_pages=stored)
+        assert writer._tickets == {}
+    assert stored == {}
@@ -0,0 +1,66 @@
+import os
+import pyarrow.parquet as pq
+import pytest
+from rightmove import consts, export, parser, retrieval_meta, worker
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+
+
+@pytest.fixture
+def crawl(server, mongo):
+    """
+    :return: Tuple (crawl date of the listings stored from the mock server, number of them that can be exported).
+    """
+    worker.get_all_outcodes(PROPERTY_TYPE, retries=1, workers=2, metrics_path=None, parse_processes=0)
+    run_date, = mongo[retrieval_meta.META_COLLECTION].distinct("run_date")
+    docs = list(mongo[consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]].docs.values())
+    results = parser.parse_search_result_batch(docs, PROPERTY_TYPE)
+    n_rows = sum(obj is not None and not error.get("FAILED") for obj, error in results)
+    # some listings are of types that are not tracked, e.g. land
+    assert 0 < n_rows < len(docs)
+    return run_date, n_rows
+
+
+def _exporter(db, tmp_path, **kwargs):
+    return export.ParquetExporter(db, PROPERTY_TYPE, root=str(tmp_path / "dataset"), chunk_size=100, **kwargs)
+
+
+def test_export_partition(crawl, mongo, tmp_path):
+    run_date, n_rows = crawl
+    exporter = _exporter(mongo, tmp_path)
+    # today's crawl may still be running
+    assert exporter.pending_dates() == []
+    assert exporter.run(include_today=True) == {run_date: n_rows}
+
+    path = exporter.partition_path(run_date)
+    assert os.listdir(exporter.type_path) == [os.path.basename(path)]
+    assert path.endswith(f"property_type={consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]}/crawl_date={run_date}")
+    pf = pq.ParquetFile(os.path.join(path, export.PART_FILENAME))
+    assert pf.schema_arrow == export.SCHEMAS[PROPERTY_TYPE]
+    assert pf.metadata.num_row_groups == 9
+    table = pf.read()
+    assert table.num_rows == n_rows
+    assert set(table.column("outcode").to_pylist()) == set(consts.OUTCODE_MAP)
+    assert table.column("property_id").null_count == 0
+    assert all(url.startswith(consts.BASE_URL) for url in table.column("url").to_pylist())
+
+
+def test_export_is_incremental(crawl, mongo, tmp_path):
+    run_date, n_rows = crawl
+    exporter = _exporter(mongo, tmp_path)
+    exporter.run(include_today=True)
+    assert exporter.exported_dates() == {run_date}
+    assert exporter.run(include_today=True) == {}
+    # an explicit date is written again
+    assert exporter.run(dates=[run_date]) == {run_date: n_rows}
+    assert os.listdir(exporter.type_path) == [f"crawl_date={run_date}"]
+
+
+def test_flatten_leaves_out_unparseable_listings():
+    rows, n_skipped = export.flatten([{"id": 1}], PROPERTY_TYPE)
+    assert (rows, n_skipped) == ([], 1)
+
+
+def test_root_required(mongo):
+    with pytest.raises(ValueError):
+        export.ParquetExporter(mongo, PROPERTY_TYPE, root=None)
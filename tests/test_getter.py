@@ -0,0 +1,37 @@
+import time
+from bench.mock_server import MockRightmoveServer
+from rightmove import consts, getter
+
+
+def test_pages_fetched_without_requester():
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=100, max_results=100) as server:
+        url = server.find_urls()[consts.PROPERTY_TYPE_FORSALE]
+        pages = list(getter.outcode_search_generator(1, url, fanout=1))
+        assert server.counts["requests"] == 3
+    assert [page.index for page in pages] == [0, 48, 96]
+    assert sum(len(page.properties) for page in pages) == 100
+
+
+def test_prefetched_pages_yielded_in_order():
+    # later pages respond first
+    latency = {48: 0.4, 96: 0.3, 144: 0.2}
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=200, max_results=200,
+                             index_latency=latency) as server:
+        url = server.find_urls()[consts.PROPERTY_TYPE_FORSALE]
+        t0 = time.monotonic()
+        pages = list(getter.outcode_search_generator(1, url, fanout=4))
+        elapsed = time.monotonic() - t0
+    assert [page.index for page in pages] == [0, 48, 96, 144, 192]
+    # fetched concurrently: one at a time would take at least the sum of the delays
+    assert elapsed < sum(latency.values()) - 0.1
+
+
+def test_failed_page_skipped_without_stalling_later_pages():
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=300, max_results=300,
+                             fail_indexes={48: None}, index_latency={48: 0.3}) as server:
+        url = server.find_urls()[consts.PROPERTY_TYPE_FORSALE]
+        failed = []
+        pages = list(getter.outcode_search_generator(1, url, fanout=2, failed_indexes=failed))
+        assert server.page_counts[(1, 48)] == 1
+    assert failed == [48]
+    assert [page.index for page in pages] == [0, 96, 144, 192, 240, 288]
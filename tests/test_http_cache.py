@@ -0,0 +1,110 @@
+import collections
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from core import requester
+
+
+class EtagServer(object):
+    """
+    Serves a fixed body per path with an ETag, and 304 to requests revalidating the current ETag.
+    """
+    def __init__(self):
+        self.version = 1
+        self.statuses = collections.Counter()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                etag = f'"v{server.version}"'
+                status = 304 if self.headers.get("If-None-Match") == etag else 200
+                server.statuses[status] += 1
+                body = b"" if status == 304 else f"{self.path} v{server.version}".encode()
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/find.html"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    srv = EtagServer()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def make_cache(tmp_path, clock):
+    def make(**kwargs):
+        cache = requester.HttpCache(str(tmp_path / "cache" / "http_cache.db"), **kwargs)
+        cache.clock = clock
+        return cache
+    return make
+
+
+def test_revalidated_with_etag(server, make_cache, make_requester):
+    req = make_requester(cache=make_cache(fresh_for=0), retries=0)
+    first = req.get(server.url, params={"index": 48})
+    second = req.get(server.url, params={"index": 48})
+    assert server.statuses == {200: 1, 304: 1}
+    assert second.content == first.content == b"/find.html?index=48 v1"
+    assert getattr(second, "from_cache", False)
+
+    server.version = 2
+    third = req.get(server.url, params={"index": 48})
+    assert server.statuses == {200: 2, 304: 1}
+    assert third.content == b"/find.html?index=48 v2"
+    assert not getattr(third, "from_cache", False)
+
+
+def test_fresh_entries_served_without_request(server, make_cache, make_requester):
+    cache = make_cache(fresh_for=60.)
+    req = make_requester(cache=cache, retries=0)
+    req.get(server.url)
+    assert req.get(server.url).from_cache
+    assert server.statuses == {200: 1}
+    cache.clock.now += 61.
+    assert req.get(server.url).from_cache
+    assert server.statuses == {200: 1, 304: 1}
+
+
+def test_keyed_by_query_string(server, make_cache, make_requester):
+    req = make_requester(cache=make_cache(fresh_for=60.), retries=0)
+    for index in (0, 48, 0):
+        req.get(server.url, params={"index": index})
+    assert server.statuses == {200: 2}
+
+
+def _response(body):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = body
+    return resp
+
+
+def test_least_recently_used_evicted(make_cache):
+    # room for two of the (incompressible) bodies
+    cache = make_cache(max_bytes=250, fresh_for=60.)
+    for url in ("a", "b"):
+        cache.put(url, _response(os.urandom(100)))
+        cache.clock.now += 1.
+    cache.get("a")
+    cache.clock.now += 1.
+    cache.put("c", _response(os.urandom(100)))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["entries"] == 2
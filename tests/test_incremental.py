@@ -0,0 +1,76 @@
+import collections
+import copy
+import random
+import pytest
+from bench.pages import synthetic_listing
+from core import bulk_writer
+from rightmove import consts, incremental, pipeline, worker
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+COLLECTION = consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]
+STATE_COLLECTION = incremental.state_collection_name(PROPERTY_TYPE)
+
+
+@pytest.fixture
+def listings():
+    rng = random.Random(0)
+    return [synthetic_listing(rng, 1000 + i) for i in range(10)]
+
+
+def _pages(listings):
+    """
+    Two pages of one outcode, with the first listing (e.g. a featured property) shown on both.
+    """
+    listings = copy.deepcopy(listings)
+    return [
+        pipeline.DecodedPage(0, listings[:5], 48, tagged=False),
+        pipeline.DecodedPage(48, [copy.deepcopy(listings[0])] + listings[5:], 48, tagged=False),
+    ]
+
+
+def _crawl(listings, background):
+    counts = collections.Counter()
+    if background:
+        with bulk_writer.BulkWriter(worker.mongo_connection(), flush_interval=60) as writer:
+            worker.get_one_outcode(1, PROPERTY_TYPE, incremental=True, counts=counts, writer=writer,
+                                   pages=_pages(listings))
+    else:
+        worker.get_one_outcode(1, PROPERTY_TYPE, incremental=True, counts=counts, pages=_pages(listings))
+    return counts
+
+
+def test_fingerprint_ignores_untracked_fields(listings):
+    attr = copy.deepcopy(listings[0])
+    fp = incremental.listing_fingerprint(attr)
+    attr["numberOfImages"] += 1
+    assert incremental.listing_fingerprint(attr) == fp
+    attr["price"]["amount"] += 1000
+    assert incremental.listing_fingerprint(attr) != fp
+
+
+@pytest.mark.parametrize("background", [True, False])
+def test_listing_on_two_pages_stored_once(mongo, listings, background):
+    counts = _crawl(listings, background)
+    assert counts == {incremental.STATUS_NEW: 10}
+    assert sorted(d["id"] for d in mongo[COLLECTION].docs.values()) == [l["id"] for l in listings]
+    assert len(mongo[STATE_COLLECTION].docs) == 10
+
+
+@pytest.mark.parametrize("background", [True, False])
+def test_only_changed_listings_stored_again(mongo, listings, background):
+    _crawl(listings, background)
+    counts = _crawl(listings, background)
+    assert counts == {incremental.STATUS_UNCHANGED: 10}
+    assert len(mongo[COLLECTION].docs) == 10
+
+    listings[3]["price"]["amount"] += 5000
+    counts = _crawl(listings, background)
+    assert counts == {incremental.STATUS_UNCHANGED: 9, incremental.STATUS_CHANGED: 1}
+    assert len(mongo[COLLECTION].docs) == 11
+
+
+def test_listings_without_id_always_written(mongo, listings):
+    attr = copy.deepcopy(listings[0])
+    del attr["id"]
+    to_write, fingerprints, counts = incremental.detect_changes(mongo[STATE_COLLECTION], [attr, attr])
+    assert len(to_write) == 2 and fingerprints == {}
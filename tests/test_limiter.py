@@ -0,0 +1,100 @@
+import asyncio
+import bisect
+import time
+from core import requester
+
+
+def _crawl(limiter, clock, duration):
+    """
+    Make calls back to back, as fast as the limiter allows, for `duration` seconds of the fake clock.
+    :return: List of the times of the calls.
+    """
+    t0 = clock.now
+    times = []
+    while True:
+        clock.now += limiter.reserve()
+        if clock.now - t0 >= duration:
+            return times
+        times.append(clock.now - t0)
+
+
+def _max_in_window(times, window):
+    return max(bisect.bisect_left(times, t + window) - i for i, t in enumerate(times))
+
+
+def test_fresh_limiter_keeps_hourly_quota(clock):
+    store = requester.MemoryBucketStore()
+    store.clock = clock
+    limiter = requester.Limiter(per_hour=10000, per_second=6, store=store)
+    times = _crawl(limiter, clock, 2 * 3600)
+    assert _max_in_window(times, 3600) <= 10000
+    # the quota is still used in full
+    assert len([t for t in times if t < 3600]) >= 9990
+
+
+def test_idle_limiter_keeps_daily_quota(clock):
+    store = requester.MemoryBucketStore()
+    store.clock = clock
+    limiter = requester.Limiter(per_day=2000, per_minute=10, store=store)
+    times = _crawl(limiter, clock, 86400)
+    clock.now += 86400
+    times += [86400 * 2 + t for t in _crawl(limiter, clock, 86400)]
+    assert _max_in_window(times, 86400) <= 2000
+
+
+def test_burst_limited_by_shortest_period(clock):
+    store = requester.MemoryBucketStore()
+    store.clock = clock
+    limiter = requester.Limiter(per_hour=10000, per_second=6, store=store)
+    waits = [limiter.reserve() for _ in range(6)]
+    assert waits == [0.] * 6
+    assert limiter.reserve() > 0
+
+
+def test_sqlite_store_shares_quota(tmp_path, clock):
+    db = str(tmp_path / "limiter.db")
+    limiters = []
+    for _ in range(2):
+        store = requester.SqliteBucketStore(db)
+        store.clock = clock
+        limiters.append(requester.Limiter(per_minute=100, per_second=5, store=store, name="shared"))
+    times = []
+    t0 = clock.now
+    for i in range(400):
+        clock.now = max(clock.now, t0) + limiters[i % 2].reserve()
+        times.append(clock.now - t0)
+    assert _max_in_window(times, 60) <= 100
+
+
+def test_no_limits():
+    limiter = requester.Limiter()
+    assert limiter.reserve() == 0.
+
+
+class SlowStore(requester.MemoryBucketStore):
+    """
+    Store whose reservations block, as a SQLite transaction waiting on another process does.
+    """
+    def reserve(self, buckets):
+        time.sleep(0.2)
+        return super().reserve(buckets)
+
+
+def test_acquire_async_does_not_block_event_loop():
+    limiter = requester.Limiter(per_second=10, store=SlowStore())
+    ticks = []
+
+    async def ticker():
+        for _ in range(10):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        t0 = time.monotonic()
+        await asyncio.gather(limiter.acquire_async(), ticker())
+        return t0
+
+    t0 = asyncio.run(main())
+    # the ticker kept running while the reservation was blocked
+    assert sum(t < t0 + 0.15 for t in ticks) >= 5
+    assert limiter.total_calls == 1
@@ -0,0 +1,116 @@
+import json
+import pytest
+from core import metrics
+from rightmove import consts, worker
+
+
+@pytest.fixture
+def registry():
+    return metrics.MetricsRegistry()
+
+
+def test_counter_labels(registry):
+    c = registry.counter("requests_total", "Requests.", ("method", "status"))
+    c.inc(method="GET", status=200)
+    c.inc(2, method="GET", status="200")
+    c.inc(method="GET")
+    assert c.value(method="GET", status=200) == 3
+    # missing labels are empty, and unknown ones ignored
+    assert c.value(method="GET", status="") == 1
+    assert c.value(method="GET", other="x") == 1
+    assert c.value(method="POST", status=200) == 0
+    assert c.snapshot() == [
+        {"labels": {"method": "GET", "status": ""}, "value": 1},
+        {"labels": {"method": "GET", "status": "200"}, "value": 3},
+    ]
+
+
+@pytest.mark.parametrize("value, bucket", [
+    (0, 0), (1, 0), (1.0001, 1), (2, 1), (4.9999, 2), (5, 2), (5.0001, 3), (1e9, 3), (-1, 0),
+])
+def test_histogram_bucket_bounds_inclusive(registry, value, bucket):
+    h = registry.histogram("size", "Sizes.", buckets=(5, 1, 2))
+    h.observe(value)
+    counts = [0, 0, 0, 0]
+    counts[bucket] = 1
+    assert h.snapshot()[0]["buckets"] == dict(zip(("1.0", "2.0", "5.0", "+Inf"), counts))
+
+
+def test_histogram_sum_count_mean(registry):
+    h = registry.histogram("latency", "Latency.", ("host",), buckets=(1, 2))
+    for v in (0.5, 1.5, 4):
+        h.observe(v, host="a")
+    snap, = h.snapshot()
+    assert (snap["labels"], snap["count"], snap["sum"], snap["mean"]) == ({"host": "a"}, 3, 6., 2.)
+    with h.time(host="b"):
+        pass
+    assert [s["count"] for s in h.snapshot()] == [3, 1]
+
+
+def test_registry_reuses_metrics_by_name(registry):
+    assert registry.counter("n", "N.") is registry.counter("n", "N.")
+    with pytest.raises(ValueError):
+        registry.gauge("n", "N.")
+
+
+def test_prometheus_text(registry):
+    c = registry.counter("listings_total", "Listings stored.", ("property_type",))
+    c.inc(3, property_type="residential-for-sale")
+    c.inc(property_type='say "hi" \\')
+    g = registry.gauge("rate", "Current rate.")
+    g.set(2.5)
+    h = registry.histogram("pages", "Pages per outcode.", ("property_type",), buckets=(1, 10))
+    for v in (1, 3, 30):
+        h.observe(v, property_type="r")
+    assert registry.to_prometheus() == (
+        '# HELP listings_total Listings stored.\n'
+        '# TYPE listings_total counter\n'
+        'listings_total{property_type="residential-for-sale"} 3.0\n'
+        'listings_total{property_type="say \\"hi\\" \\\\"} 1.0\n'
+        '# HELP rate Current rate.\n'
+        '# TYPE rate gauge\n'
+        'rate 2.5\n'
+        '# HELP pages Pages per outcode.\n'
+        '# TYPE pages histogram\n'
+        'pages_bucket{property_type="r",le="1.0"} 1\n'
+        'pages_bucket{property_type="r",le="10.0"} 2\n'
+        'pages_bucket{property_type="r",le="+Inf"} 3\n'
+        'pages_sum{property_type="r"} 34.0\n'
+        'pages_count{property_type="r"} 3\n'
+    )
+
+
+def test_write_is_atomic_and_chooses_format(registry, tmp_path):
+    registry.counter("n", "N.").inc()
+    registry.write(str(tmp_path / "out" / "metrics.prom"))
+    assert (tmp_path / "out" / "metrics.prom").read_text() == registry.to_prometheus()
+    registry.write(str(tmp_path / "metrics.json"))
+    assert json.loads((tmp_path / "metrics.json").read_text())["metrics"]["n"]["values"] == [
+        {"labels": {}, "value": 1}
+    ]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["metrics.json", "out"]
+
+
+def test_exporter_writes_on_close(registry, tmp_path):
+    path = str(tmp_path / "metrics.json")
+    c = registry.counter("n", "N.")
+    with metrics.MetricsExporter(path, interval=0, registry=registry):
+        c.inc(5)
+    assert json.loads(open(path).read())["metrics"]["n"]["values"][0]["value"] == 5
+
+
+def test_worker_exports_json_metrics(server, tmp_path):
+    metrics.REGISTRY.reset()
+    path = tmp_path / "metrics.json"
+    worker.get_all_outcodes(consts.PROPERTY_TYPE_FORSALE, retries=1, workers=2, metrics_path=str(path),
+                            parse_processes=0)
+    snapshot = json.loads(path.read_text())["metrics"]
+    ptype = consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE]
+    assert snapshot["outcodes_total"]["type"] == "counter"
+    assert snapshot["outcodes_total"]["values"] == [
+        {"labels": {"property_type": ptype, "result": "success"}, "value": len(consts.OUTCODE_MAP)}
+    ]
+    pages, = snapshot["outcode_pages"]["values"]
+    assert pages["labels"] == {"property_type": ptype} and pages["count"] == len(consts.OUTCODE_MAP)
+    stored, = snapshot["listings_stored_total"]["values"]
+    assert stored["value"] == len(worker.mongo_connection()[ptype].docs)
@@ -0,0 +1,51 @@
+import copy
+import random
+import pytest
+from bench.pages import synthetic_listing
+from rightmove import consts, parser
+
+
+def listings(property_type, n=200, seed=3):
+    rng = random.Random(seed)
+    out = [synthetic_listing(rng, 1000 + i, property_type=property_type) for i in range(n)]
+    # edge cases: status, unknown and untracked descriptions, a listing the parser cannot handle
+    out[0]["displayStatus"] = "Under offer"
+    out[1]["propertyTypeFullDescription"] = "2 bedroom houseboat for sale"
+    out[2]["propertyTypeFullDescription"] = "Plot for sale"
+    out[3]["propertyTypeFullDescription"] = "Studio apartment to rent"
+    del out[4]["location"]
+    return out
+
+
+def parse_each(attr_arr, property_type):
+    out = []
+    for attr in attr_arr:
+        try:
+            out.append(parser.RESULT_PARSERS[property_type](attr))
+        except Exception as exc:
+            out.append((None, repr(exc)))
+    return out
+
+
+@pytest.mark.parametrize("property_type", [consts.PROPERTY_TYPE_FORSALE, consts.PROPERTY_TYPE_TORENT])
+def test_batch_matches_per_listing(property_type):
+    attr_arr = listings(property_type)
+
+    parser.classify_description.cache_clear()
+    expected = parse_each(copy.deepcopy(attr_arr), property_type)
+    parser.classify_description.cache_clear()
+    batch = parser.parse_search_result_batch(copy.deepcopy(attr_arr), property_type)
+
+    assert len(batch) == len(attr_arr)
+    assert batch == expected
+    assert batch[4][0] is None and "location" in batch[4][1]
+    assert any(e for _, e in batch[:4])
+    # the batch classified each distinct description once
+    assert parser.classify_description.cache_info().misses == len(
+        {a["propertyTypeFullDescription"] for a in attr_arr if "location" in a}
+    )
+
+
+def test_batch_rejects_unknown_property_type():
+    with pytest.raises(NotImplementedError):
+        parser.parse_search_result_batch([], -1)
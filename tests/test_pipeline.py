@@ -0,0 +1,47 @@
+import pytest
+import requests
+from bench.mock_server import MockRightmoveServer
+from rightmove import consts, getter, pipeline
+
+N_RESULTS = 200
+PAGE_INDEXES = [0, 48, 96, 144, 192]
+
+
+@pytest.fixture(scope="module")
+def find_url():
+    with MockRightmoveServer(latency=0, latency_jitter=0, min_results=N_RESULTS, max_results=N_RESULTS) as server:
+        yield server.find_urls()[consts.PROPERTY_TYPE_FORSALE]
+
+
+def _pages(find_url, fanout=1):
+    with requests.Session() as session:
+        yield from getter.outcode_search_generator(1, find_url, requester=session, fanout=fanout)
+
+
+@pytest.mark.parametrize("fanout", [1, 2])
+def test_only_first_page_decoded_while_fetching(find_url, fanout):
+    pages = list(_pages(find_url, fanout=fanout))
+    assert [p.index for p in pages] == PAGE_INDEXES
+    assert pages[0].is_decoded
+    assert not any(p.is_decoded for p in pages[1:])
+
+
+def test_fetched_pages_decoded_in_pool(find_url, monkeypatch):
+    submitted = []
+    submit = pipeline.ParsePool.submit
+
+    def counting_submit(self, *args, **kwargs):
+        submitted.append(1)
+        return submit(self, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline.ParsePool, "submit", counting_submit)
+    with pipeline.ParsePool(processes=2) as pool:
+        decoded = list(pool.decode_pages(_pages(find_url, fanout=2), meta={"id": "meta"}))
+
+    assert len(submitted) == len(PAGE_INDEXES) - 1
+    assert [p.index for p in decoded] == PAGE_INDEXES
+    assert all(isinstance(p, pipeline.DecodedPage) and p.tagged for p in decoded[1:])
+    assert all(attr["__retrieval_meta"] == {"id": "meta"} for p in decoded[1:] for attr in p.properties)
+
+    inline = list(_pages(find_url))
+    assert [[a["id"] for a in p.properties] for p in decoded] == [[a["id"] for a in p.properties] for p in inline]
@@ -0,0 +1,68 @@
+import os
+import pstats
+import threading
+import time
+from core import profiling
+
+
+def busy_work(n=20000):
+    return sum(i * i for i in range(n))
+
+
+def busy_for(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        busy_work(1000)
+
+
+def _calls(stats, function):
+    return sum(v[1] for (_, _, fn), v in stats.stats.items() if fn == function)
+
+
+def test_cprofile_run_writes_profile_and_summary(tmp_path):
+    with profiling.ProfileRun("cprofile", profile_dir=str(tmp_path), name="test") as run:
+        busy_work()
+        t = threading.Thread(target=busy_work)
+        t.start()
+        t.join()
+    assert sorted(run.paths) == ["profile", "summary"]
+    assert os.path.dirname(run.paths["profile"]) == run.out_dir
+    stats = pstats.Stats(run.paths["profile"])
+    # both the calling thread and the thread started while profiling
+    assert _calls(stats, "busy_work") == 2
+    summary = open(run.paths["summary"]).read()
+    assert summary.startswith("Profile of test (cprofile)") and "busy_work" in summary
+
+
+def test_thread_profilers_disabled_on_stop():
+    first_done, go = threading.Event(), threading.Event()
+
+    def target():
+        busy_work()
+        first_done.set()
+        go.wait()
+        busy_work()
+
+    profiler = profiling.ThreadProfiler().start()
+    t = threading.Thread(target=target)
+    t.start()
+    first_done.wait()
+    profiler.stop()
+    go.set()
+    t.join()
+    # the call made after stop is not counted
+    assert _calls(profiler.stats(), "busy_work") == 1
+
+
+def test_sampling_run_writes_stacks_and_summary(tmp_path):
+    with profiling.ProfileRun("sample", profile_dir=str(tmp_path), name="test", sample_interval=0.002) as run:
+        t = threading.Thread(target=busy_for, args=(0.2,))
+        t.start()
+        t.join()
+    assert sorted(run.paths) == ["stacks", "summary"]
+    assert run.profiler.n_samples > 0
+    lines = open(run.paths["stacks"]).read().splitlines()
+    assert any("busy_for(test_profiling.py)" in line for line in lines)
+    stack, n = lines[0].rsplit(" ", 1)
+    assert int(n) > 0 and ";" in stack
+    assert "samples every 0.002s" in open(run.paths["summary"]).read()
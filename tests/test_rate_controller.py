@@ -0,0 +1,94 @@
+import pytest
+from core import requester
+
+
+@pytest.fixture
+def controller(clock):
+    controller = requester.AdaptiveRateController(initial_rate=4., min_rate=0.5, max_rate=6., increase=1.,
+                                                  decrease=0.5, latency_target=1., window=1., tolerance=0.2,
+                                                  min_responses=10)
+    controller.clock = clock
+    return controller
+
+
+def test_default_controller_starts_at_limit():
+    if requester.DEFAULT_RATE_CONTROLLER is None:
+        pytest.skip("adaptive pacing disabled in the config")
+    assert requester.DEFAULT_RATE_CONTROLLER.rate == requester.DEFAULT_LIMIT_PER_SECOND
+
+
+def test_paces_at_current_rate(controller):
+    waits = [controller.reserve() for _ in range(4)]
+    assert waits == pytest.approx([0., 0.25, 0.5, 0.75])
+    assert controller.stats()["calls"] == 4
+    assert controller.total_wait == pytest.approx(1.5)
+
+
+def test_additive_increase_up_to_max(controller):
+    for _ in range(4):
+        controller.record(200, latency=0.1)
+    assert controller.rate == pytest.approx(5., abs=0.2)
+    for _ in range(100):
+        controller.record(200, latency=0.1)
+    assert controller.rate == 6.
+
+
+def test_slow_responses_and_errors_hold_rate(controller):
+    controller.record(200, latency=5.)
+    controller.record(500, latency=0.1)
+    controller.record(None)
+    assert controller.rate == 4.
+    assert controller.n_errors == 2
+
+
+def test_occasional_throttling_tolerated(controller):
+    # up to 20% of a window of at least 10 responses
+    for status in [429, 200, 200, 200, 200, 503, 200, 200, 200, 200]:
+        controller.record(status, latency=0.1)
+    assert controller.n_throttled == 2
+    assert controller.rate > 4.
+    controller.record(429, latency=0.1)
+    assert controller.rate < 4.
+
+
+def test_decreases_at_most_once_per_window(controller):
+    for _ in range(3):
+        controller.record(429, latency=0.1)
+    assert controller.rate == 2.
+    # sent before the decrease
+    for _ in range(10):
+        controller.record(429, latency=0.1)
+    assert controller.rate == 2.
+    controller.clock.now += 1.
+    for _ in range(3):
+        controller.record(429, latency=0.1)
+    assert controller.rate == 1.
+    assert controller.n_throttled == 16
+
+
+def test_throttled_share_judged_at_end_of_window(controller):
+    # sending below the current rate: 3 of 10 responses is not over 20% of the 4 * 5 requests expected yet
+    controller.window = 5.
+    for status in [429, 200, 429, 200, 429, 200, 200, 200, 200, 200]:
+        controller.record(status, latency=0.1)
+    assert controller.rate > 4.
+    rate = controller.rate
+    controller.clock.now += 5.
+    controller.record(200, latency=0.1)
+    # halved when the window closed, then increased for the success
+    assert controller.rate == pytest.approx(rate / 2 + 1. / (rate / 2))
+
+
+def test_throttling_decreases_down_to_min(controller):
+    for _ in range(10):
+        controller.clock.now += 1.
+        for _ in range(3):
+            controller.record(503, latency=0.1)
+    assert controller.rate == 0.5
+
+
+def test_retry_after_pauses_requests(controller):
+    controller.record(429, retry_after=30.)
+    assert controller.reserve() == pytest.approx(30.)
+    controller.clock.now += 31.
+    assert controller.reserve() == 0.
@@ -0,0 +1,92 @@
+import datetime
+import sqlite3
+import time
+import pytest
+from core import register
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "access_log.db")
+
+
+def _count(db_path, table_name):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+
+def test_rows_written_in_batches(db_path):
+    log = register.AccessLog(batch_size=3, flush_interval=60, flush_success=False, database=db_path)
+    for outcode in range(2):
+        log.log("rightmove", outcode=outcode, property_type=1, success=1)
+    assert _count(db_path, "rightmove") == 0
+    log.log("rightmove", outcode=2, property_type=1, success=1)
+    assert _count(db_path, "rightmove") == 3
+    log.close()
+
+
+def test_success_rows_written_straight_away(db_path):
+    log = register.AccessLog(batch_size=100, flush_interval=60, flush_success=True, database=db_path)
+    log.log("rightmove", outcode=1, property_type=1, success=0)
+    assert _count(db_path, "rightmove") == 0
+    log.log("rightmove", outcode=2, property_type=1, success=1)
+    assert _count(db_path, "rightmove") == 2
+    log.close()
+
+
+def test_idle_rows_written_after_flush_interval(db_path):
+    log = register.AccessLog(batch_size=100, flush_interval=0.1, database=db_path)
+    log.log("rightmove", outcode=1, property_type=1, success=1)
+    deadline = time.monotonic() + 5
+    while _count(db_path, "rightmove") == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _count(db_path, "rightmove") == 1
+    log.close()
+
+
+def test_close_writes_buffered_rows(db_path):
+    log = register.AccessLog(batch_size=100, flush_interval=60, database=db_path)
+    log.log("rightmove", outcode=1, property_type=1, success=1)
+    log.close()
+    assert _count(db_path, "rightmove") == 1
+
+
+def test_successful_outcodes(db_path):
+    since = datetime.datetime.now() - datetime.timedelta(hours=1)
+    log = register.AccessLog(batch_size=100, flush_interval=60, database=db_path)
+    log.log("rightmove", outcode=1, property_type=1, success=1)
+    log.log("rightmove", outcode=2, property_type=1, success=0)
+    log.log("rightmove", outcode=3, property_type=2, success=1)
+    log.log("rightmove", outcode=4, property_type=1, success=1, dt=since - datetime.timedelta(hours=1))
+    assert log.successful_outcodes("rightmove", 1, since) == {1}
+    assert log.successful_outcodes("missing", 1, since) == set()
+    log.close()
+
+
+def test_completed_pages(db_path):
+    since = datetime.datetime.now() - datetime.timedelta(hours=1)
+    log = register.PageCheckpointLog(batch_size=100, flush_interval=60, database=db_path)
+    for index in (0, 48, 96):
+        log.log("rightmove_page", outcode=1, property_type=1, page_index=index)
+    log.log("rightmove_page", outcode=2, property_type=1, page_index=0)
+    assert log.completed_pages("rightmove_page", 1, 1, since) == {0, 48, 96}
+    log.close()
+
+
+def test_unknown_field(db_path):
+    log = register.AccessLog(database=db_path)
+    with pytest.raises(KeyError):
+        log.log("rightmove", outcode=1, property_type=1, success=1, unknown=1)
+    log.close()
+
+
+def test_database_shared_in_wal_mode(db_path):
+    first = register.AccessLog(batch_size=1, database=db_path)
+    second = register.AccessLog(batch_size=1, database=db_path)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    first.log("rightmove", outcode=1, property_type=1, success=1)
+    second.log("rightmove", outcode=2, property_type=1, success=1)
+    assert _count(db_path, "rightmove") == 2
+    first.close()
+    second.close()
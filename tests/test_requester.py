@@ -0,0 +1,55 @@
+import pytest
+from bench.mock_server import MockRightmoveServer
+from core import requester
+from rightmove import consts, getter
+
+
+def _get(req, server):
+    return req.get(server.find_urls()[consts.PROPERTY_TYPE_FORSALE], params=getter.outcode_search_payload(1))
+
+
+def test_retryable_status_is_retried(make_requester):
+    controller = requester.AdaptiveRateController(initial_rate=100.)
+    req = make_requester(retries=2, rate_controller=controller)
+    with MockRightmoveServer(latency=0, latency_jitter=0, error_rate=1., error_codes=(429,), retry_after=0) as server:
+        resp = _get(req, server)
+        assert server.counts["requests"] == 3
+    assert resp.status_code == 429
+    assert controller.n_throttled == 3
+    assert req.n_retries == 2
+
+
+def test_success_is_not_retried(make_requester):
+    req = make_requester(retries=2)
+    with MockRightmoveServer(latency=0, latency_jitter=0) as server:
+        resp = _get(req, server)
+        assert server.counts["requests"] == 1
+    assert resp.ok
+    assert req.n_retries == 0
+
+
+def test_sequential_requests_reuse_one_connection(make_requester):
+    req = make_requester()
+    with MockRightmoveServer(latency=0, latency_jitter=0) as server:
+        for _ in range(5):
+            assert _get(req, server).ok
+        assert server.counts["connections"] == 1
+    assert req.connection_stats() == {"requests": 5, "connections": 1, "reused": 4}
+
+
+def test_connection_error_raised_after_retries(make_requester):
+    req = make_requester(retries=1, timeout=(1, 1))
+    with MockRightmoveServer() as server:
+        url = server.find_urls()[consts.PROPERTY_TYPE_FORSALE]
+    with pytest.raises(requester.requests.exceptions.ConnectionError):
+        req.get(url)
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("5", 5.), ("-1", 0.), ("soon", None)])
+def test_parse_retry_after(value, expected):
+    assert requester.parse_retry_after(value) == expected
+
+
+def test_backoff_delay_capped():
+    assert all(0.5 <= requester.backoff_delay(0, base=1., cap=60.) <= 1. for _ in range(20))
+    assert all(30. <= requester.backoff_delay(10, base=1., cap=60.) <= 60. for _ in range(20))
@@ -0,0 +1,92 @@
+import datetime
+import json
+import signal
+import subprocess
+import sys
+from rightmove import consts, worker
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+COLLECTION = consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]
+# 300 results: the first page and 6 more
+INDEXES = list(range(0, 300, 48))
+
+
+# crawls the first N outcodes of the mock server into a fake MongoDB and the access log given, with the access log's
+# usual batching, and kills itself without cleaning up as soon as M outcodes are logged
+CRASHING_CRAWL = """
+import json, os, signal, sys
+from bench.fakes import FakeMongoClient
+from core import register, requester
+from rightmove import consts, worker
+
+db_fn, find_urls, n_outcodes, n_logged = sys.argv[1], json.loads(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+consts.OUTCODE_MAP = dict(list(consts.OUTCODE_MAP.items())[:n_outcodes])
+consts.FIND_URLS.update({int(k): v for k, v in find_urls.items()})
+worker.MONGO_CLI = FakeMongoClient()
+worker.REQUESTER = requester.MoverightRequester(limiter=None, rate_controller=None, cache=None)
+worker.ACCESS_LOG = register.AccessLog(batch_size=50, flush_interval=60, database=db_fn)
+worker.PAGE_LOG = register.PageCheckpointLog(batch_size=1, database=db_fn)
+log_result = worker._log_outcode_result
+logged = []
+
+
+def log_then_crash(*args, **kwargs):
+    log_result(*args, **kwargs)
+    logged.append(args[1])
+    if len(logged) == n_logged:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+worker._log_outcode_result = log_then_crash
+worker.get_all_outcodes(int(sys.argv[5]), retries=1, workers=1, metrics_path=None, parse_processes=0)
+"""
+
+
+def _crawl(resume=False):
+    return worker.get_all_outcodes(PROPERTY_TYPE, retries=1, workers=1, resume=resume, metrics_path=None,
+                                   parse_processes=0)
+
+
+def test_pages_of_large_outcodes_checkpointed(server):
+    _crawl()
+    since = datetime.datetime.now() - datetime.timedelta(hours=1)
+    for outcode in consts.OUTCODE_MAP:
+        assert worker.PAGE_LOG.completed_pages(worker.PAGE_CHECKPOINT_TABLE, outcode, PROPERTY_TYPE,
+                                               since) == set(INDEXES)
+
+
+def test_finished_run_resumes_with_nothing_to_do(server, mongo):
+    _crawl()
+    n_requests = server.counts["requests"]
+    assert _crawl(resume=True) == {}
+    assert server.counts["requests"] == n_requests
+    assert len(mongo[COLLECTION].docs) == 900
+
+
+def test_resume_skips_finished_outcodes_and_stored_pages(server, mongo):
+    done, partial, fresh = consts.OUTCODE_MAP
+    worker.ACCESS_LOG.log("rightmove", outcode=done, property_type=PROPERTY_TYPE, success=1)
+    for index in INDEXES[:3]:
+        worker.PAGE_LOG.log(worker.PAGE_CHECKPOINT_TABLE, outcode=partial, property_type=PROPERTY_TYPE,
+                            page_index=index)
+
+    oids = _crawl(resume=True)
+    assert set(oids) == {partial, fresh}
+    assert len(oids[partial]) == 300 - 3 * 48
+    assert len(oids[fresh]) == 300
+    # the first page of a partly stored outcode is always fetched, for the number of results
+    assert server.counts["requests"] == (len(INDEXES) - 2) + len(INDEXES)
+
+
+def test_outcodes_logged_before_crash_not_crawled_again(server, tmp_path):
+    outcodes = list(consts.OUTCODE_MAP)
+    db_fn = str(tmp_path / "access_log.db")
+    out = subprocess.run([sys.executable, "-c", CRASHING_CRAWL, db_fn, json.dumps(server.find_urls()),
+                          str(len(outcodes)), "2", str(PROPERTY_TYPE)], capture_output=True, text=True)
+    assert out.returncode == -signal.SIGKILL, out.stderr
+    since = datetime.datetime.now() - datetime.timedelta(hours=1)
+    assert worker.ACCESS_LOG.successful_outcodes("rightmove", PROPERTY_TYPE, since) == set(outcodes[:2])
+
+    n_requests = server.counts["requests"]
+    assert set(_crawl(resume=True)) == set(outcodes[2:])
+    assert server.counts["requests"] - n_requests == len(INDEXES)
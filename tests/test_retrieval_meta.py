@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from bench.fakes import FakeDatabase
+from rightmove import retrieval_meta
+
+COLLECTION = "residential-for-sale"
+META = retrieval_meta.META_FIELD
+T0 = pytz.utc.localize(datetime(2024, 1, 1, 22, 0))
+
+
+def _legacy(listing_id, outcode, minutes):
+    # metadata as embedded in listings before it was normalised
+    return {"id": listing_id, META: {"user_agent": "ua", "version": "1", "outcode": outcode, "property_type": 1,
+                                     "timestamp": T0 + timedelta(minutes=minutes)}}
+
+
+@pytest.fixture
+def db(db):
+    docs = [_legacy(1, 10, 0), _legacy(2, 10, 5), _legacy(3, 11, 1), _legacy(4, 10, 60 * 24)]
+    db[COLLECTION].insert_many(docs)
+    return db
+
+
+def test_migrate_groups_by_outcode_and_day(db):
+    assert retrieval_meta.migrate_collection(db, COLLECTION, batch_size=2) == (4, 3)
+    metas = list(db[retrieval_meta.META_COLLECTION].docs.values())
+    assert sorted((m["outcode"], m["run_date"]) for m in metas) == [
+        (10, "2024-01-01"), (10, "2024-01-02"), (11, "2024-01-01")
+    ]
+    first = next(m for m in metas if m["outcode"] == 10 and m["run_date"] == "2024-01-01")
+    assert (first["timestamp"], first["timestamp_last"]) == (T0, T0 + timedelta(minutes=5))
+
+    listings = list(db[COLLECTION].docs.values())
+    assert all(set(d[META]) == {"id"} for d in listings)
+    joined = list(retrieval_meta.join_meta(db, db[COLLECTION].find()))
+    assert [d[META]["outcode"] for d in joined] == [10, 10, 11, 10]
+    assert joined[0][META] == joined[1][META]
+
+
+def test_migrate_is_resumable(db):
+    retrieval_meta.migrate_collection(db, COLLECTION)
+    db[COLLECTION].insert_many([_legacy(5, 11, 2)])
+    assert retrieval_meta.migrate_collection(db, COLLECTION) == (1, 0)
+    assert len(db[retrieval_meta.META_COLLECTION].docs) == 3
+    meta = db[retrieval_meta.META_COLLECTION].find_one({"outcode": 11})
+    assert (meta["timestamp"], meta["timestamp_last"]) == (T0 + timedelta(minutes=1), T0 + timedelta(minutes=2))
+
+
+@pytest.mark.parametrize("ts, run_date", [
+    # naive UTC, as pymongo returns it: 00:30 BST on 1 July
+    (datetime(2024, 6, 30, 23, 30), "2024-07-01"),
+    (datetime(2024, 6, 30, 22, 30), "2024-06-30"),
+    (pytz.utc.localize(datetime(2024, 6, 30, 23, 30)), "2024-07-01"),
+    # GMT in winter
+    (datetime(2024, 1, 1, 23, 30), "2024-01-01"),
+])
+def test_migrate_uses_local_date_of_utc_timestamps(monkeypatch, ts, run_date):
+    monkeypatch.setattr(retrieval_meta, "TIMEZONE", "Europe/London")
+    db = FakeDatabase()
+    db[COLLECTION].insert_many([{"id": 1, META: {"outcode": 10, "property_type": 1, "timestamp": ts}}])
+    retrieval_meta.migrate_collection(db, COLLECTION)
+    meta, = db[retrieval_meta.META_COLLECTION].docs.values()
+    assert meta["run_date"] == run_date
+
+
+def test_dry_run_writes_nothing(db):
+    before = [dict(d) for d in db[COLLECTION].docs.values()]
+    assert retrieval_meta.migrate_collection(db, COLLECTION, dry_run=True) == (4, 3)
+    assert list(db[COLLECTION].docs.values()) == before
+    assert len(db[retrieval_meta.META_COLLECTION].docs) == 0
+
+
+def test_join_meta_passes_legacy_listings_through(db):
+    meta = retrieval_meta.new_meta(T0, outcode=12)
+    db[retrieval_meta.META_COLLECTION].insert_one(dict(meta))
+    db[COLLECTION].insert_many([{"id": 6, META: retrieval_meta.meta_ref(meta["_id"])}])
+    joined = {d["id"]: d[META] for d in retrieval_meta.join_meta(db, db[COLLECTION].find(), batch_size=2)}
+    assert joined[1]["outcode"] == 10
+    assert joined[6] == {"timestamp": T0, "run_date": "2024-01-01", "outcode": 12}
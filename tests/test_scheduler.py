@@ -0,0 +1,31 @@
+import pytest
+from core import scheduler
+
+
+@pytest.fixture
+def sched(clock):
+    sched = scheduler.RetryScheduler()
+    sched.clock = clock
+    return sched
+
+
+def test_nothing_due_before_deadline(sched):
+    assert sched.pop_due() is None
+    assert sched.time_until_due() is None
+    sched.push("a", delay=5.)
+    assert sched.pop_due() is None
+    assert sched.time_until_due() == 5.
+    sched.clock.now += 5.
+    assert sched.time_until_due() == 0.
+    assert sched.pop_due() == "a"
+    assert len(sched) == 0
+
+
+def test_earliest_deadline_first_then_push_order(sched):
+    sched.push("late", delay=10.)
+    sched.push("first", delay=1.)
+    sched.push("second", delay=1.)
+    sched.push("now")
+    sched.clock.now += 20.
+    assert [sched.pop_due() for _ in range(4)] == ["now", "first", "second", "late"]
+    assert sched.pop_due() is None
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bench.fakes import FakeDatabase
+from rightmove import consts, sharding, worker
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+OUTCODES = [(i, f"PC{i}") for i in range(1, 21)]
+
+
+@pytest.mark.parametrize("spec, expected", [("1/1", (1, 1)), ("3/8", (3, 8))])
+def test_parse_shard(spec, expected):
+    assert sharding.parse_shard(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["3", "a/b", "0/4", "5/4", "1/0"])
+def test_parse_shard_invalid(spec):
+    with pytest.raises(ValueError):
+        sharding.parse_shard(spec)
+
+
+def test_shards_partition_outcodes():
+    shards = [sharding.select_shard(OUTCODES, k, 4) for k in range(1, 5)]
+    assert sorted(pc for shard in shards for pc in shard) == OUTCODES
+    # independent of the order of the outcode table
+    assert sharding.select_shard(reversed(OUTCODES), 2, 4) == list(reversed(shards[1]))
+
+
+def _queue(db, owner, **kwargs):
+    return sharding.MongoLeaseQueue(db, "run", PROPERTY_TYPE, owner=owner, **kwargs)
+
+
+def test_each_outcode_leased_once(db):
+    queues = [_queue(db, owner) for owner in ("a", "b")]
+    for queue in queues:
+        queue.populate(OUTCODES)
+    assert len(db[sharding.LEASE_COLLECTION].docs) == len(OUTCODES)
+
+    leased = {"a": [], "b": []}
+    iters = {q.owner: iter(q) for q in queues}
+    while len(iters) > 0:
+        for owner, it in list(iters.items()):
+            item = next(it, None)
+            if item is None:
+                del iters[owner]
+            else:
+                leased[owner].append(item)
+    assert sorted(leased["a"] + leased["b"]) == OUTCODES
+    assert len(leased["a"]) > 0 and len(leased["b"]) > 0
+
+
+def test_populate_keeps_existing_state(db):
+    queue = _queue(db, "a")
+    queue.populate(OUTCODES[:2])
+    outcode, _ = queue.acquire()
+    queue.complete(outcode)
+    queue.populate(OUTCODES[:2])
+    assert queue.acquire() == OUTCODES[1]
+    assert queue.acquire() is None
+
+
+def test_expired_lease_reclaimed(db):
+    crashed = _queue(db, "crashed", ttl=60)
+    crashed.populate(OUTCODES[:1])
+    assert crashed.acquire() == OUTCODES[0]
+    other = _queue(db, "other", ttl=60)
+    assert other.acquire() is None
+
+    doc, = db[sharding.LEASE_COLLECTION].docs.values()
+    doc["lease_expires"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert other.acquire() == OUTCODES[0]
+    assert doc["attempts"] == 2 and doc["owner"] == "other"
+
+    # the crashed worker no longer holds the lease
+    crashed.complete(OUTCODES[0][0])
+    assert doc["state"] == sharding.STATE_LEASED
+    other.complete(OUTCODES[0][0], success=False)
+    assert doc["state"] == sharding.STATE_FAILED
+
+
+def test_indexes_created(db):
+    _queue(db, "a", retention_days=2)
+    indexes = db[sharding.LEASE_COLLECTION].indexes
+    keys, _ = indexes["run_id_property_type_state_outcode"]
+    assert [k for k, _ in keys] == ["run_id", "property_type", "state", "outcode"]
+    keys, options = indexes["finished_ttl"]
+    assert [k for k, _ in keys] == ["finished"] and options["expireAfterSeconds"] == 2 * 86400
+
+    kept = FakeDatabase()
+    _queue(kept, "a", retention_days=None)
+    assert list(kept[sharding.LEASE_COLLECTION].indexes) == ["run_id_property_type_state_outcode"]
+
+
+def test_finished_time_is_utc(db):
+    queue = _queue(db, "a")
+    queue.populate(OUTCODES[:1])
+    queue.acquire()
+    queue.complete(OUTCODES[0][0])
+    doc, = db[sharding.LEASE_COLLECTION].docs.values()
+    assert doc["finished"].tzinfo is not None and doc["finished"].utcoffset() == timedelta(0)
+    assert doc["lease_expires"] > doc["finished"]
+
+
+def test_crawl_from_lease_queue(server, mongo):
+    kwargs = dict(retries=1, workers=2, lease_run_id="run", metrics_path=None, parse_processes=0)
+    assert set(worker.get_all_outcodes(PROPERTY_TYPE, **kwargs)) == set(consts.OUTCODE_MAP)
+    states = {d["outcode"]: d["state"] for d in mongo[sharding.LEASE_COLLECTION].docs.values()}
+    assert states == {outcode: sharding.STATE_DONE for outcode in consts.OUTCODE_MAP}
+
+    n_requests = server.counts["requests"]
+    assert worker.get_all_outcodes(PROPERTY_TYPE, **kwargs) == {}
+    assert server.counts["requests"] == n_requests
@@ -0,0 +1,91 @@
+from datetime import date, datetime, time
+import pytest
+import pytz
+from rightmove import consts, retrieval_meta, store
+
+PROPERTY_TYPE = consts.PROPERTY_TYPE_FORSALE
+COLLECTION = consts.PROPERTY_TYPE_MAP[PROPERTY_TYPE]
+META = retrieval_meta.META_FIELD
+
+
+def _timestamp(day):
+    return pytz.timezone(store.TIMEZONE).localize(datetime.combine(day, time(23, 30)))
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(store, "_INDEXED", set())
+    # property 1 is listed in outcode 10 on both days, at a new price on the second
+    for day, outcode, listings in (
+        (date(2024, 1, 1), 10, [(1, 100), (2, 200)]),
+        (date(2024, 1, 1), 11, [(3, 300)]),
+        (date(2024, 1, 2), 10, [(1, 150)]),
+    ):
+        meta = retrieval_meta.new_meta(_timestamp(day), outcode=outcode, property_type=PROPERTY_TYPE)
+        db[retrieval_meta.META_COLLECTION].insert_one(meta)
+        db[COLLECTION].insert_many([
+            {"id": pid, "price": {"amount": price}, "bedrooms": 2, META: retrieval_meta.meta_ref(meta["_id"])}
+            for pid, price in listings
+        ])
+    # stored before the metadata was normalised
+    db[COLLECTION].insert_one({"id": 4, "price": {"amount": 400}, "bedrooms": 3,
+                               META: {"outcode": 10, "timestamp": _timestamp(date(2024, 1, 1))}})
+    return db
+
+
+def _prices(docs):
+    return sorted((d["id"], d["price"]["amount"]) for d in docs)
+
+
+def test_indexes_created_once(db):
+    store.ListingStore(db, PROPERTY_TYPE)
+    assert set(db[COLLECTION].indexes) == {name for name, _, _ in store.LISTING_INDEXES}
+    assert set(db[retrieval_meta.META_COLLECTION].indexes) == {name for name, _, _ in store.META_INDEXES}
+    db[COLLECTION].indexes.clear()
+    store.ListingStore(db, PROPERTY_TYPE)
+    assert db[COLLECTION].indexes == {}
+
+
+def test_find_by_outcode_and_date(db):
+    listings = store.ListingStore(db, PROPERTY_TYPE)
+    assert _prices(listings.find()) == [(1, 100), (1, 150), (2, 200), (3, 300), (4, 400)]
+    assert _prices(listings.find(outcodes=[10], start="2024-01-01", end=date(2024, 1, 1))) == \
+        [(1, 100), (2, 200), (4, 400)]
+    assert _prices(listings.find(start="2024-01-02")) == [(1, 150)]
+    docs = list(listings.find(outcodes=[11]))
+    assert [d[META]["outcode"] for d in docs] == [11]
+
+
+def test_find_many_retrievals_in_batches(db, monkeypatch):
+    monkeypatch.setattr(store, "MAX_META_IDS", 1)
+    listings = store.ListingStore(db, PROPERTY_TYPE)
+    assert len(listings._filters(None, "2024-01-01", None)) == 4
+    assert _prices(listings.find(start="2024-01-01")) == [(1, 100), (1, 150), (2, 200), (3, 300), (4, 400)]
+    # property 1 is in two of the batches: the newer snapshot is kept, and the order is still by property ID
+    docs = list(listings.latest(start="2024-01-01", fields=["price"]))
+    assert [(d["id"], d["price"]["amount"]) for d in docs] == [(1, 150), (2, 200), (3, 300), (4, 400)]
+    assert [d[META]["outcode"] for d in docs] == [10, 10, 11, 10]
+
+
+def test_find_projection(db):
+    doc = next(iter(store.ListingStore(db, PROPERTY_TYPE).find(outcodes=[11], fields=["price"])))
+    assert set(doc) == {"_id", "price", META}
+    assert doc[META]["outcode"] == 11
+
+
+def test_latest_snapshot_per_property(db):
+    listings = store.ListingStore(db, PROPERTY_TYPE)
+    assert [(d["id"], d["price"]["amount"]) for d in listings.latest()] == [(1, 150), (2, 200), (3, 300), (4, 400)]
+    assert _prices(listings.latest(outcodes=[10], end="2024-01-01")) == [(1, 100), (2, 200), (4, 400)]
+    doc = next(iter(listings.latest(outcodes=[11], fields=["bedrooms"])))
+    assert set(doc) == {"_id", "id", "bedrooms", META}
+
+
+def test_chunks_and_frames(db):
+    listings = store.ListingStore(db, PROPERTY_TYPE, chunk_size=2)
+    assert [len(c) for c in listings.chunks(listings.find())] == [2, 2, 1]
+    df = listings.dataframe(listings.latest(fields=["price"]))
+    assert list(df["id"]) == [1, 2, 3, 4]
+    assert list(df["price.amount"]) == [150, 200, 300, 400]
+    assert list(df[f"{META}.outcode"]) == [10, 10, 11, 10]
+    assert listings.dataframe([]).empty
@@ -0,0 +1,51 @@
+import collections
+import subprocess
+import sys
+from rightmove import consts, worker
+
+LAZY_MODULES = ("requests", "pymongo", "bson", "asyncio", "core.requester", "core.bulk_writer")
+
+
+def test_import_leaves_slow_modules_for_first_use():
+    # a fresh interpreter, since the other tests import these modules anyway
+    out = subprocess.run(
+        [sys.executable, "-c", "import sys, rightmove.worker; "
+                               f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"],
+        capture_output=True, text=True, check=True,
+    )
+    assert out.stdout.strip() == ""
+
+
+def test_failed_pages_are_retried_alone_then_given_up(server, monkeypatch):
+    # page 48 of each outcode fails once; page 96 fails every time
+    server.fail_indexes = {48: 1, 96: None}
+    monkeypatch.setattr(worker.REQUESTER, "retries", 0)
+    crawled = worker.get_all_outcodes(consts.PROPERTY_TYPE_FORSALE, retries=3, sec_between_retry=0.01, workers=2,
+                                      metrics_path=None, parse_processes=0)
+    assert crawled == {}
+    for outcode in consts.OUTCODE_MAP:
+        requested = {i: n for (oc, i), n in server.page_counts.items() if oc == outcode}
+        assert requested == {i: {48: 2, 96: 3}.get(i, 1) for i in range(0, server.max_results, 48)}
+    rows = worker.ACCESS_LOG.connection.execute(
+        "SELECT outcode, success, num_retries FROM rightmove ORDER BY outcode"
+    ).fetchall()
+    assert rows == [(outcode, 0, 2) for outcode in sorted(consts.OUTCODE_MAP)]
+    # every other page was stored once
+    n_docs = len(worker.mongo_connection()[consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE]].docs)
+    assert n_docs == len(consts.OUTCODE_MAP) * (server.max_results - 48)
+
+
+def test_concurrent_crawl_stores_each_outcode_once(server, monkeypatch):
+    outcodes = dict(list(consts.load_outcode_index().items())[:12])
+    monkeypatch.setattr(consts, "OUTCODE_MAP", outcodes)
+    server.latency = 0.01
+    crawled = worker.get_all_outcodes(consts.PROPERTY_TYPE_FORSALE, retries=1, workers=4, metrics_path=None,
+                                      parse_processes=0)
+    assert sorted(crawled) == sorted(outcodes)
+    assert all(len(oids) == server.max_results for oids in crawled.values())
+    docs = worker.mongo_connection()[consts.PROPERTY_TYPE_MAP[consts.PROPERTY_TYPE_FORSALE]].docs.values()
+    per_outcode = collections.Counter(doc["id"] // 100000 for doc in docs)
+    assert per_outcode == {outcode: server.max_results for outcode in outcodes}
+    assert set(server.page_counts.values()) == {1}
+    rows = worker.ACCESS_LOG.connection.execute("SELECT outcode, success FROM rightmove ORDER BY outcode").fetchall()
+    assert rows == [(outcode, 1) for outcode in sorted(outcodes)]